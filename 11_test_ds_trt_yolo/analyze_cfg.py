@@ -0,0 +1,92 @@
+# analyze_cfg.py
+
+#############################################################################
+#  Copyright (c) 2021, NVIDIA CORPORATION. All rights reserved.             #
+#                                                                           #
+#  Licensed under the Apache License, Version 2.0 (the "License");          #
+#  you may not use this file except in compliance with the License.         #
+#  You may obtain a copy of the License at                                  #
+#                                                                           #
+#      http://www.apache.org/licenses/LICENSE-2.0                           #
+#                                                                           #
+#  Unless required by applicable law or agreed to in writing, software      #
+#  distributed under the License is distributed on an "AS IS" BASIS,        #
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+#  See the License for the specific language governing permissions and      #
+#  limitations under the License.                                           #
+#############################################################################
+
+import argparse
+
+from tools.onnx.net.darknet_cfg import parse_input_size
+from tools.onnx.net.darknet_cost import analyze_cfg, rank_layers, write_json, write_csv
+
+# Function for printing the most expensive layers of a report
+def print_top_layers(report, key, top):
+    print('%s %dx%d batch %d, top %d layers by %s' % (
+        report['cfg'], report['height'], report['width'], report['batch_size'], top, key))
+    print('%5s %-14s %-20s %12s %10s %12s' % ('index', 'type', 'output', 'params', 'GMACs', 'act(MiB)'))
+    for layer in rank_layers(report, key, top):
+        print('%5d %-14s %-20s %12d %10.3f %12.2f' % (
+            layer['index'], layer['type'], 'x'.join(str(d) for d in layer['output_shape']),
+            layer['params'], layer['macs'] / 1e9, layer['activation_bytes'] / 2**20))
+    print()
+
+# Main function
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-c', '--config_file', type=str, required=True,
+        help=('Put YOLO model configuration file path'
+              'Samples are like models/yolovX-[288|416|608].cfg'))
+    parser.add_argument(
+        '-s', '--input_sizes', type=str, nargs='+',
+        help='Network input sizes to analyze like 608 or 320x512 (height x width) [the size of the cfg]')
+    parser.add_argument(
+        '-b', '--batch_sizes', type=int, nargs='+', default=[1],
+        help='Batch sizes to analyze [1]')
+    parser.add_argument(
+        '--fp16', default=False, action="store_true",
+        help='Count 2 bytes per activation instead of 4')
+    parser.add_argument(
+        '--sort', type=str, default='macs', choices=['macs', 'params', 'activation_bytes', 'live_bytes'],
+        help='Cost to rank the layers by [macs]')
+    parser.add_argument(
+        '--top', type=int, default=0,
+        help='Print the N most expensive layers of every case [0]')
+    parser.add_argument(
+        '--json', type=str,
+        help='Write all reports with the per-layer costs to this JSON file')
+    parser.add_argument(
+        '--csv', type=str,
+        help='Write one row per layer and case to this CSV file')
+    args = parser.parse_args()
+
+    dtype_bytes = 2 if args.fp16 else 4
+    reports = []
+    try:
+        sizes = [parse_input_size(size) for size in args.input_sizes] if args.input_sizes else [(None, None)]
+    except ValueError as e:
+        parser.error(str(e))
+    for height, width in sizes:
+        for batch_size in args.batch_sizes:
+            reports.append(analyze_cfg(args.config_file, batch_size, height, width, dtype_bytes))
+
+    if args.top > 0:
+        for report in reports:
+            print_top_layers(report, args.sort, args.top)
+
+    print('%-11s %5s %12s %10s %10s %16s' % ('input', 'batch', 'params(M)', 'GMACs', 'GFLOPs', 'peak act(MiB)'))
+    for report in reports:
+        total = report['total']
+        print('%-11s %5d %12.2f %10.2f %10.2f %16.1f' % (
+            '%dx%d' % (report['height'], report['width']), report['batch_size'], total['params'] / 1e6,
+            total['macs'] / 1e9, total['flops'] / 1e9, total['peak_live_bytes'] / 2**20))
+
+    if args.json:
+        write_json(reports, args.json)
+    if args.csv:
+        write_csv(reports, args.csv)
+
+if __name__ == '__main__':
+    main()
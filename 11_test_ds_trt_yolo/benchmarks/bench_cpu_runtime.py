@@ -0,0 +1,95 @@
+# bench_cpu_runtime.py
+
+#############################################################################
+#  Copyright (c) 2021, NVIDIA CORPORATION. All rights reserved.             #
+#                                                                           #
+#  Licensed under the Apache License, Version 2.0 (the "License");          #
+#  you may not use this file except in compliance with the License.         #
+#  You may obtain a copy of the License at                                  #
+#                                                                           #
+#      http://www.apache.org/licenses/LICENSE-2.0                           #
+#                                                                           #
+#  Unless required by applicable law or agreed to in writing, software      #
+#  distributed under the License is distributed on an "AS IS" BASIS,        #
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+#  See the License for the specific language governing permissions and      #
+#  limitations under the License.                                           #
+#############################################################################
+
+# Usage (from 11_test_ds_trt_yolo/):
+#   python3 -m benchmarks.bench_cpu_runtime -c models/yolov4-416.cfg -m models/yolov4-416.weights -b 1 4 --threads 4
+#
+# CPU throughput of the same fused model with eager torch, frozen TorchScript
+# and onnxruntime, inference plus post_processing of every batch.
+
+import io
+import time
+import argparse
+from contextlib import redirect_stdout
+
+import torch
+import numpy as np
+import onnxruntime
+
+from tools.utils import post_processing
+from tools.cpu_runtime import DarknetSession, set_cpu_threads
+
+def run(func, iterations):
+    func()
+    t = time.time()
+    for _ in range(iterations):
+        func()
+    return (time.time() - t) / iterations
+
+# Function for the onnxruntime session of the same model, exported like transform_to_onnx() with a static batch
+def export_session(model, x, threads):
+    f = io.BytesIO()
+    with redirect_stdout(io.StringIO()):
+        torch.onnx.export(model, torch.from_numpy(x), f, export_params=True, opset_version=12,
+                          do_constant_folding=True, input_names=['input'], output_names=['boxes', 'confs'])
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = threads
+    return onnxruntime.InferenceSession(f.getvalue(), options)
+
+# Main function
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-c', '--config_file', type=str, required=True,
+        help='Darknet cfg file')
+    parser.add_argument(
+        '-m', '--model_file', type=str,
+        help='Darknet weights file, random weights without it')
+    parser.add_argument(
+        '-b', '--batch_sizes', type=int, nargs='+', default=[1, 4],
+        help='Batch sizes to measure [1 4]')
+    parser.add_argument(
+        '-n', '--iterations', type=int, default=5,
+        help='Timed iterations per case [5]')
+    parser.add_argument(
+        '--threads', type=int, default=0,
+        help='Intra-op threads of torch and onnxruntime, 0 keeps their default [0]')
+    args = parser.parse_args()
+
+    set_cpu_threads(args.threads)
+    sessions = [(mode, DarknetSession(args.config_file, args.model_file, mode=mode))
+                for mode in ['eager', 'torchscript']]
+
+    print('%5s %-12s %14s %14s %10s %14s' % ('batch', 'backend', 'infer(ms)', 'end2end(ms)', 'images/s', 'max abs diff'))
+    for batch_size in args.batch_sizes:
+        x = np.random.RandomState(0).rand(batch_size, 3, sessions[0][1].model.height,
+                                           sessions[0][1].model.width).astype(np.float32)
+        ort_session = export_session(sessions[0][1].model, x, args.threads)
+        reference = sessions[0][1].run(None, {'input': x})
+
+        for name, session in sessions + [('onnxruntime', ort_session)]:
+            infer = lambda: session.run(None, {'input': x})
+            outputs = infer()
+            diff = max(np.abs(a - b).max() for a, b in zip(reference, outputs))
+            infer_latency = run(infer, args.iterations)
+            latency = run(lambda: post_processing(None, 0.4, 0.6, infer()), args.iterations)
+            print('%5d %-12s %14.2f %14.2f %10.1f %14.3g' % (
+                batch_size, name, infer_latency * 1000, latency * 1000, batch_size / latency, diff))
+
+if __name__ == '__main__':
+    main()
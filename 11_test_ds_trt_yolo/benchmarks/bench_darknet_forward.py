@@ -0,0 +1,147 @@
+# bench_darknet_forward.py
+
+#############################################################################
+#  Copyright (c) 2021, NVIDIA CORPORATION. All rights reserved.             #
+#                                                                           #
+#  Licensed under the Apache License, Version 2.0 (the "License");          #
+#  you may not use this file except in compliance with the License.         #
+#  You may obtain a copy of the License at                                  #
+#                                                                           #
+#      http://www.apache.org/licenses/LICENSE-2.0                           #
+#                                                                           #
+#  Unless required by applicable law or agreed to in writing, software      #
+#  distributed under the License is distributed on an "AS IS" BASIS,        #
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+#  See the License for the specific language governing permissions and      #
+#  limitations under the License.                                           #
+#############################################################################
+
+# Usage (from 11_test_ds_trt_yolo/):
+#   python3 -m benchmarks.bench_darknet_forward -c models/yolov3-tiny-416.cfg -s 32 160 416
+
+import io
+import os
+import time
+import argparse
+from contextlib import redirect_stdout
+
+import torch
+from torch import cat
+from torch.nn.functional import relu, leaky_relu
+
+from tools.utils import get_region_boxes
+from tools.onnx.net.darknet import Darknet
+
+# The per-forward string dispatch over model.blocks replaced by the compiled plan
+def forward_blocks(model, x):
+    ind = -2
+    outputs = dict()
+    out_boxes = []
+    for block in model.blocks:
+        ind = ind + 1
+        if block['type'] == 'net':
+            continue
+        elif block['type'] in ['convolutional', 'maxpool', 'reorg', 'upsample', 'avgpool', 'softmax', 'connected']:
+            print("INDEX : %d" % ind)
+            x = model.models[ind](x)
+            outputs[ind] = x
+        elif block['type'] == 'route':
+            layers = block['layers'].split(',')
+            layers = [int(i) if int(i) > 0 else int(i) + ind for i in layers]
+            if len(layers) == 1:
+                if 'groups' not in block.keys() or int(block['groups']) == 1:
+                    x = outputs[layers[0]]
+                else:
+                    groups = int(block['groups'])
+                    group_id = int(block['group_id'])
+                    _, b, _, _ = outputs[layers[0]].shape
+                    x = outputs[layers[0]][:, b // groups * group_id:b // groups * (group_id + 1)]
+            else:
+                x = cat([outputs[layer] for layer in layers], 1)
+            outputs[ind] = x
+        elif block['type'] == 'shortcut':
+            from_layer = int(block['from'])
+            from_layer = from_layer if from_layer > 0 else from_layer + ind
+            x = outputs[from_layer] + outputs[ind - 1]
+            if block['activation'] == 'leaky':
+                x = leaky_relu(x, 0.1, inplace=True)
+            elif block['activation'] == 'relu':
+                x = relu(x, inplace=True)
+            outputs[ind] = x
+        elif block['type'] == 'yolo':
+            out_boxes.append(model.models[ind](x))
+    return get_region_boxes(out_boxes)
+
+# Module returning a recorded output, leaves only the dispatch work of a forward pass
+class Replay(torch.nn.Module):
+    def __init__(self, output):
+        super(Replay, self).__init__()
+        self.output = output
+
+    def forward(self, x):
+        return self.output
+
+# Function for a copy of the model whose modules replay their outputs for x
+def make_replay_model(config_file, model, x):
+    recorded = {}
+    hooks = [module.register_forward_hook(lambda m, i, o, ind=ind: recorded.__setitem__(ind, o))
+             for ind, module in enumerate(model.models)]
+    model(x)
+    for hook in hooks:
+        hook.remove()
+    replay = Darknet(config_file).eval()
+    for ind, output in recorded.items():
+        replay.models[ind] = Replay(output)
+    replay.plan = replay.compile_plan()
+    return replay
+
+# Function for the best of 5 rounds, the dispatch overhead is small next to the noise
+def run(func, iterations, rounds=5):
+    func()
+    best = float('inf')
+    for _ in range(rounds):
+        t = time.time()
+        for _ in range(iterations):
+            func()
+        best = min(best, (time.time() - t) / iterations)
+    return best
+
+# Main function
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-c', '--config_file', type=str, required=True,
+        help='Darknet cfg file, tiny models show the dispatch overhead best')
+    parser.add_argument(
+        '-s', '--input_sizes', type=int, nargs='+', default=[32, 160, 416],
+        help='Network input sizes to measure [32 160 416]')
+    parser.add_argument(
+        '-n', '--iterations', type=int, default=50,
+        help='Timed iterations per case [50]')
+    args = parser.parse_args()
+
+    with redirect_stdout(io.StringIO()):
+        model = Darknet(args.config_file).eval()
+
+    # The INDEX prints of the string dispatch go to /dev/null, a terminal costs even more.
+    # 'dispatch' replays recorded module outputs, so only the per-forward overhead is left
+    results = []
+    with torch.no_grad(), open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        for input_size in args.input_sizes:
+            x = torch.randn(1, 3, input_size, input_size)
+            replay = make_replay_model(args.config_file, model, x)
+            results.append((input_size,
+                            run(lambda: forward_blocks(model, x), args.iterations),
+                            run(lambda: model(x), args.iterations),
+                            run(lambda: forward_blocks(replay, x), args.iterations * 10),
+                            run(lambda: replay(x), args.iterations * 10)))
+
+    print('size  %-16s ms/forward  dispatch us/forward  dispatch share' % 'forward')
+    for input_size, blocks, plan, blocks_dispatch, plan_dispatch in results:
+        for name, latency, dispatch in (('string dispatch', blocks, blocks_dispatch),
+                                        ('compiled plan', plan, plan_dispatch)):
+            print('%4d  %-16s %10.3f  %19.1f  %13.1f%%' % (
+                input_size, name, latency * 1000, dispatch * 1e6, 100.0 * dispatch / latency))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# bench_darknet_memory.py
+
+#############################################################################
+#  Copyright (c) 2021, NVIDIA CORPORATION. All rights reserved.             #
+#                                                                           #
+#  Licensed under the Apache License, Version 2.0 (the "License");          #
+#  you may not use this file except in compliance with the License.         #
+#  You may obtain a copy of the License at                                  #
+#                                                                           #
+#      http://www.apache.org/licenses/LICENSE-2.0                           #
+#                                                                           #
+#  Unless required by applicable law or agreed to in writing, software      #
+#  distributed under the License is distributed on an "AS IS" BASIS,        #
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+#  See the License for the specific language governing permissions and      #
+#  limitations under the License.                                           #
+#############################################################################
+
+# Usage (from 11_test_ds_trt_yolo/, Linux only):
+#   python3 -m benchmarks.bench_darknet_memory -c models/yolov3-tiny-416.cfg models/yolov4-608.cfg -b 1 8
+#
+# Every case runs in a fresh process, the peak RSS of the forward pass is
+# measured with /proc/self/clear_refs and VmHWM.
+
+import sys
+import argparse
+import subprocess
+
+# Function for reading a memory field of /proc/self/status in MiB
+def read_status_mib(field):
+    with open('/proc/self/status') as fp:
+        for line in fp:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) / 1024.0
+    raise SystemExit('ERROR: %s not found in /proc/self/status!' % field)
+
+# Function for the peak memory of one forward pass, run in the child process
+def measure(config_file, batch_size, keep_all):
+    import io
+    import torch
+    from contextlib import redirect_stdout
+    from tools.onnx.net.darknet import Darknet
+
+    with redirect_stdout(io.StringIO()):
+        model = Darknet(config_file).eval()
+    if keep_all:
+        # Keep every layer output for the whole pass like before the liveness plan
+        model.plan = model.compile_plan(keep_all=True)
+    x = torch.randn(batch_size, 3, model.height, model.width)
+
+    rss = read_status_mib('VmRSS')
+    with open('/proc/self/clear_refs', 'w') as fp:
+        fp.write('5')
+    with torch.no_grad(), redirect_stdout(io.StringIO()):
+        model(x)
+    print('%.1f' % (read_status_mib('VmHWM') - rss))
+
+# Main function
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-c', '--config_files', type=str, nargs='+', required=True,
+        help='Darknet cfg files to measure')
+    parser.add_argument(
+        '-b', '--batch_sizes', type=int, nargs='+', default=[1],
+        help='Batch sizes to measure [1]')
+    parser.add_argument(
+        '--child', type=str, choices=['keep_all', 'liveness'],
+        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        measure(args.config_files[0], args.batch_sizes[0], args.child == 'keep_all')
+        return
+
+    print('%-32s %5s %14s %14s %8s' % ('cfg', 'batch', 'keep all(MiB)', 'liveness(MiB)', 'saved'))
+    for config_file in args.config_files:
+        for batch_size in args.batch_sizes:
+            peaks = []
+            for mode in ('keep_all', 'liveness'):
+                out = subprocess.run([sys.executable, '-m', 'benchmarks.bench_darknet_memory', '--child', mode,
+                                      '-c', config_file, '-b', str(batch_size)],
+                                     stdout=subprocess.PIPE, universal_newlines=True, check=True)
+                peaks.append(float(out.stdout.split()[-1]))
+            print('%-32s %5d %14.1f %14.1f %7.1f%%' % (
+                config_file.split('/')[-1], batch_size, peaks[0], peaks[1], 100.0 * (1 - peaks[1] / peaks[0])))
+
+if __name__ == '__main__':
+    main()
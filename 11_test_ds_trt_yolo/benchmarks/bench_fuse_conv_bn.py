@@ -0,0 +1,116 @@
+# bench_fuse_conv_bn.py
+
+#############################################################################
+#  Copyright (c) 2021, NVIDIA CORPORATION. All rights reserved.             #
+#                                                                           #
+#  Licensed under the Apache License, Version 2.0 (the "License");          #
+#  you may not use this file except in compliance with the License.         #
+#  You may obtain a copy of the License at                                  #
+#                                                                           #
+#      http://www.apache.org/licenses/LICENSE-2.0                           #
+#                                                                           #
+#  Unless required by applicable law or agreed to in writing, software      #
+#  distributed under the License is distributed on an "AS IS" BASIS,        #
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+#  See the License for the specific language governing permissions and      #
+#  limitations under the License.                                           #
+#############################################################################
+
+# Usage (from 11_test_ds_trt_yolo/):
+#   python3 -m benchmarks.bench_fuse_conv_bn -c models/yolov4-416.cfg -m models/yolov4-416.weights
+#
+# Checks that Darknet.fuse_conv_bn() keeps the outputs and measures the
+# CPU latency and the exported ONNX graph before and after folding.
+# Without weights the BatchNorm statistics are randomized.
+
+import io
+import time
+import argparse
+from collections import Counter
+from contextlib import redirect_stdout
+
+import onnx
+import torch
+import onnxruntime
+
+from tools.onnx.net.darknet import Darknet
+
+# Function for non trivial BatchNorm statistics of a model without weights
+def randomize_batch_norm(model, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    with torch.no_grad():
+        for module in model.modules():
+            if isinstance(module, torch.nn.BatchNorm2d):
+                num = module.num_features
+                module.weight.copy_(torch.rand(num, generator=generator) + 0.5)
+                module.bias.copy_(torch.randn(num, generator=generator) * 0.1)
+                module.running_mean.copy_(torch.randn(num, generator=generator) * 0.1)
+                module.running_var.copy_(torch.rand(num, generator=generator) + 0.5)
+
+def load_model(config_file, model_file):
+    with redirect_stdout(io.StringIO()):
+        model = Darknet(config_file).eval()
+        if model_file:
+            model.load_weights(model_file)
+        else:
+            randomize_batch_norm(model)
+    return model
+
+def run(func, iterations):
+    func()
+    t = time.time()
+    for _ in range(iterations):
+        func()
+    return (time.time() - t) / iterations
+
+# Function for the exported graph like transform_to_onnx(), returns (onnxruntime session, node counts, bytes)
+def export(model, x):
+    f = io.BytesIO()
+    with redirect_stdout(io.StringIO()):
+        torch.onnx.export(model, x, f, export_params=True, opset_version=12, do_constant_folding=True,
+                          input_names=['input'], output_names=['boxes', 'confs'])
+    nodes = Counter(node.op_type for node in onnx.load_from_string(f.getvalue()).graph.node)
+    return onnxruntime.InferenceSession(f.getvalue()), nodes, len(f.getvalue())
+
+# Main function
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-c', '--config_file', type=str, required=True,
+        help='Darknet cfg file')
+    parser.add_argument(
+        '-m', '--model_file', type=str,
+        help='Darknet weights file, random BatchNorm statistics without it')
+    parser.add_argument(
+        '-b', '--batch_size', type=int, default=1,
+        help='Batch size [1]')
+    parser.add_argument(
+        '-n', '--iterations', type=int, default=10,
+        help='Timed iterations per case [10]')
+    args = parser.parse_args()
+
+    model = load_model(args.config_file, args.model_file)
+    fused = load_model(args.config_file, args.model_file)
+    fused.load_state_dict(model.state_dict())
+    fused.fuse_conv_bn()
+
+    x = torch.rand(args.batch_size, 3, model.height, model.width)
+    with torch.no_grad():
+        outputs = model(x)
+        fused_outputs = fused(x)
+        for name, a, b in zip(('boxes', 'confs'), outputs, fused_outputs):
+            diff = (a - b).abs().max().item()
+            print('max abs diff of %-5s : %.3g' % (name, diff))
+            assert torch.allclose(a, b, rtol=1e-4, atol=1e-4), 'fused %s differ!' % name
+
+        print('%-8s %12s %12s %8s %8s %10s' % ('model', 'torch(ms)', 'ort(ms)', 'nodes', 'BN', 'onnx(MB)'))
+        for name, m in (('unfused', model), ('fused', fused)):
+            torch_latency = run(lambda: m(x), args.iterations)
+            session, nodes, size = export(m, x)
+            ort_latency = run(lambda: session.run(None, {'input': x.numpy()}), args.iterations)
+            print('%-8s %12.2f %12.2f %8d %8d %10.2f' % (
+                name, torch_latency * 1000, ort_latency * 1000, sum(nodes.values()),
+                nodes['BatchNormalization'], size / 1e6))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+# bench_load_weights.py
+
+#############################################################################
+#  Copyright (c) 2021, NVIDIA CORPORATION. All rights reserved.             #
+#                                                                           #
+#  Licensed under the Apache License, Version 2.0 (the "License");          #
+#  you may not use this file except in compliance with the License.         #
+#  You may obtain a copy of the License at                                  #
+#                                                                           #
+#      http://www.apache.org/licenses/LICENSE-2.0                           #
+#                                                                           #
+#  Unless required by applicable law or agreed to in writing, software      #
+#  distributed under the License is distributed on an "AS IS" BASIS,        #
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+#  See the License for the specific language governing permissions and      #
+#  limitations under the License.                                           #
+#############################################################################
+
+# Usage (from 11_test_ds_trt_yolo/, Linux only):
+#   python3 -m benchmarks.bench_load_weights -c models/yolov4-608.cfg -m models/yolov4-608.weights
+#
+# Every case runs in a fresh process. The peak RSS of load_weights() is measured
+# with /proc/self/clear_refs and VmHWM, the sidecar cache is written first.
+
+import sys
+import time
+import argparse
+import subprocess
+
+from benchmarks.bench_darknet_memory import read_status_mib
+
+MODES = {
+    'fromfile' : {'mmap': False},
+    'memmap'   : {'mmap': True},
+    'cache'    : {'cache': True},
+}
+
+# Function for the load time and memory of one mode, run in the child process
+def measure(config_file, model_file, mode):
+    import io
+    from contextlib import redirect_stdout
+    from tools.onnx.net.darknet import Darknet
+
+    with redirect_stdout(io.StringIO()):
+        model = Darknet(config_file)
+    rss = read_status_mib('VmRSS')
+    with open('/proc/self/clear_refs', 'w') as fp:
+        fp.write('5')
+    t = time.time()
+    model.load_weights(model_file, **MODES[mode])
+    seconds = time.time() - t
+    print('%.4f %.1f %.1f' % (seconds, read_status_mib('VmHWM') - rss, read_status_mib('VmRSS') - rss))
+
+# Main function
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-c', '--config_file', type=str, required=True,
+        help='Darknet cfg file')
+    parser.add_argument(
+        '-m', '--model_file', type=str, required=True,
+        help='Darknet weights file')
+    parser.add_argument(
+        '--child', type=str, choices=list(MODES),
+        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        measure(args.config_file, args.model_file, args.child)
+        return
+
+    # Write the sidecar cache before measuring it
+    import io
+    from contextlib import redirect_stdout
+    from tools.onnx.net.darknet import Darknet
+    with redirect_stdout(io.StringIO()):
+        model = Darknet(args.config_file)
+        model.load_weights(args.model_file)
+    model.save_weights_cache(args.model_file)
+    del model
+
+    # The RSS delta is relative to the randomly initialized model, whose parameters are released by the load
+    print('%-10s %10s %16s %16s' % ('mode', 'load(ms)', 'peak RSS(MiB)', 'RSS after(MiB)'))
+    for mode in MODES:
+        out = subprocess.run([sys.executable, '-m', 'benchmarks.bench_load_weights', '--child', mode,
+                              '-c', args.config_file, '-m', args.model_file],
+                             stdout=subprocess.PIPE, universal_newlines=True, check=True)
+        seconds, peak, after = [float(v) for v in out.stdout.split()[-3:]]
+        print('%-10s %10.1f %+16.1f %+16.1f' % (mode, seconds * 1000, peak, after))
+
+if __name__ == '__main__':
+    main()
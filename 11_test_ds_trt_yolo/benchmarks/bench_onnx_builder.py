@@ -0,0 +1,90 @@
+# bench_onnx_builder.py
+
+#############################################################################
+#  Copyright (c) 2021, NVIDIA CORPORATION. All rights reserved.             #
+#                                                                           #
+#  Licensed under the Apache License, Version 2.0 (the "License");          #
+#  you may not use this file except in compliance with the License.         #
+#  You may obtain a copy of the License at                                  #
+#                                                                           #
+#      http://www.apache.org/licenses/LICENSE-2.0                           #
+#                                                                           #
+#  Unless required by applicable law or agreed to in writing, software      #
+#  distributed under the License is distributed on an "AS IS" BASIS,        #
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+#  See the License for the specific language governing permissions and      #
+#  limitations under the License.                                           #
+#############################################################################
+
+# Usage (from 11_test_ds_trt_yolo/, Linux only):
+#   python3 -m benchmarks.bench_onnx_builder -c models/yolov4-608.cfg -m models/yolov4-608.weights
+#
+# Every case runs in a fresh process, the time includes the imports. The peak
+# RSS of the whole process (VmHWM) is compared with the largest conv layer.
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+
+from benchmarks.bench_darknet_memory import read_status_mib
+
+# Function for exporting the dynamic batch ONNX file in the child process
+def measure(config_file, model_file, mode, onnx_path):
+    import io
+    from contextlib import redirect_stdout
+    with redirect_stdout(io.StringIO()):
+        if mode == 'traced':
+            from yolo_to_onnx import load_darknet, export_onnx
+            model = load_darknet(model_file, config_file)
+            export_onnx(model, model_file, -1, model.height, model.width, onnx_path)
+        else:
+            from tools.onnx.onnx_builder import build_onnx
+            build_onnx(config_file, model_file, -1, onnx_path=onnx_path)
+    print('%.1f %.1f' % (read_status_mib('VmRSS'), read_status_mib('VmHWM')))
+
+# Function for the size of the largest conv weight of an ONNX file in MiB
+def largest_weight_mib(onnx_file):
+    import onnx
+    model = onnx.load(onnx_file)
+    return max(len(t.raw_data) for t in model.graph.initializer) / (1024.0 * 1024.0)
+
+# Main function
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-c', '--config_file', type=str, required=True,
+        help='Darknet cfg file to export')
+    parser.add_argument(
+        '-m', '--model_file', type=str, required=True,
+        help='Darknet weights file of the cfg')
+    parser.add_argument(
+        '--child', type=str, choices=['traced', 'direct'],
+        help=argparse.SUPPRESS)
+    parser.add_argument(
+        '--onnx_path', type=str,
+        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        measure(args.config_file, args.model_file, args.child, args.onnx_path)
+        return
+
+    print('%-10s %10s %14s %16s' % ('exporter', 'time(s)', 'peak RSS(MiB)', 'largest layer(MiB)'))
+    for mode in ('traced', 'direct'):
+        onnx_path = tempfile.mkdtemp() + '/'
+        t = time.time()
+        out = subprocess.run([sys.executable, '-m', 'benchmarks.bench_onnx_builder', '--child', mode,
+                              '-c', args.config_file, '-m', args.model_file, '--onnx_path', onnx_path],
+                             stdout=subprocess.PIPE, universal_newlines=True, check=True)
+        seconds = time.time() - t
+        peak = float(out.stdout.split()[-1])
+        onnx_file = onnx_path + os.listdir(onnx_path)[0]
+        print('%-10s %10.1f %14.1f %16.1f' % (mode, seconds, peak, largest_weight_mib(onnx_file)))
+        os.remove(onnx_file)
+        os.rmdir(onnx_path)
+
+if __name__ == '__main__':
+    main()
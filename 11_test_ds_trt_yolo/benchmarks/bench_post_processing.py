@@ -0,0 +1,126 @@
+# bench_post_processing.py
+
+#############################################################################
+#  Copyright (c) 2021, NVIDIA CORPORATION. All rights reserved.             #
+#                                                                           #
+#  Licensed under the Apache License, Version 2.0 (the "License");          #
+#  you may not use this file except in compliance with the License.         #
+#  You may obtain a copy of the License at                                  #
+#                                                                           #
+#      http://www.apache.org/licenses/LICENSE-2.0                           #
+#                                                                           #
+#  Unless required by applicable law or agreed to in writing, software      #
+#  distributed under the License is distributed on an "AS IS" BASIS,        #
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+#  See the License for the specific language governing permissions and      #
+#  limitations under the License.                                           #
+#############################################################################
+
+# Usage (from 11_test_ds_trt_yolo/):
+#   python3 -m benchmarks.bench_post_processing -s 608 -b 1 4 8 -w 1 4 8 -o 30 300
+#
+# Prints the break-even of the parallel path (num_workers > 1) on the target,
+# the smallest batch and candidate count where it beats the serial path.
+
+import os
+import time
+import argparse
+import numpy as np
+
+from tools.utils import post_processing, get_usable_cores, matrix_nms_cpu
+from tools.metrics import MetricsRegistry
+
+# Function for synthetic Yolo outputs: a few objects, each found by a cluster of overlapping boxes
+def make_yolo_outputs(batch_size, input_size, num_classes=80, num_objects=30, seed=0):
+    rng = np.random.default_rng(seed)
+    # 3 anchors on the stride 8, 16 and 32 grids
+    num = sum(3 * (input_size // s) ** 2 for s in (8, 16, 32))
+
+    center = rng.random((batch_size, num, 2)).astype(np.float32)
+    size = (rng.random((batch_size, num, 2)) * 0.1 + 0.01).astype(np.float32)
+    confs = (rng.random((batch_size, num, num_classes)) * 0.2).astype(np.float32)
+
+    # Boxes near an object get its class with a high score
+    objects = rng.integers(0, num, (batch_size, num_objects * 20))
+    obj_id = np.arange(objects.shape[1]) % num_objects
+    for i in range(batch_size):
+        obj_center = rng.random((num_objects, 2)).astype(np.float32)
+        obj_class = rng.integers(0, num_classes, num_objects)
+        center[i, objects[i]] = obj_center[obj_id] + rng.normal(0, 0.005, (objects.shape[1], 2))
+        size[i, objects[i]] = 0.08
+        confs[i, objects[i], obj_class[obj_id]] = rng.uniform(0.4, 1.0, objects.shape[1])
+
+    boxes = np.concatenate((center - size / 2, center + size / 2), axis=2)[:, :, None, :]
+    return [boxes, confs]
+
+# Function for checking Matrix NMS on exact duplicates, the scores must stay finite
+def check_matrix_nms():
+    boxes = np.array([[0.1, 0.1, 0.3, 0.3], [0.1, 0.1, 0.3, 0.3], [0.1, 0.1, 0.3, 0.3], [0.6, 0.6, 0.8, 0.8]],
+                     dtype=np.float32)
+    confs = np.array([0.9, 0.8, 0.7, 0.6], dtype=np.float32)
+    for kernel in ('linear', 'gaussian'):
+        scores = matrix_nms_cpu(boxes, confs, kernel=kernel)
+        assert np.all(np.isfinite(scores)), 'matrix nms (%s) scores are not finite: %s' % (kernel, scores)
+        assert scores[0] == confs[0] and np.all(scores[1:3] < 0.4), 'matrix nms (%s) kept a duplicate' % kernel
+
+def run(output, num_workers, iterations, method, metrics):
+    post_processing(None, 0.4, 0.6, output, method=method, num_workers=num_workers, metrics=metrics)
+    t = time.time()
+    for _ in range(iterations):
+        post_processing(None, 0.4, 0.6, output, method=method, num_workers=num_workers, metrics=metrics)
+    return (time.time() - t) / iterations
+
+# Main function
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-s', '--input_size', type=int, default=608,
+        help='Network input size [608]')
+    parser.add_argument(
+        '-b', '--batch_sizes', type=int, nargs='+', default=[1, 4, 8],
+        help='Batch sizes to measure [1 4 8]')
+    parser.add_argument(
+        '-w', '--num_workers', type=int, nargs='+', default=sorted({1, get_usable_cores()}),
+        help='Worker counts to measure, 1 is the serial path [1 usable cores]')
+    parser.add_argument(
+        '-o', '--num_objects', type=int, nargs='+', default=[30],
+        help='Objects per image, each found by 20 boxes, more objects are more NMS candidates [30]')
+    parser.add_argument(
+        '-n', '--iterations', type=int, default=20,
+        help='Timed iterations per case [20]')
+    parser.add_argument(
+        '-m', '--method', type=str, default='greedy',
+        help='NMS method of post_processing [greedy]')
+    args = parser.parse_args()
+
+    check_matrix_nms()
+    cores = get_usable_cores()
+    print('usable cores: %d, worker counts above it run with %d workers' % (cores, cores))
+    print('objects  candidates/image  batch  workers   ms/batch   speedup')
+    break_even = []
+    for num_objects in args.num_objects:
+        for batch_size in args.batch_sizes:
+            output = make_yolo_outputs(batch_size, args.input_size, num_objects=num_objects)
+            serial = None
+            for num_workers in args.num_workers:
+                metrics = MetricsRegistry()
+                latency = run(output, num_workers, args.iterations, args.method, metrics)
+                counters = metrics.counters
+                candidates = counters['post_processing.candidates'] / counters['post_processing.images']
+                serial = serial or latency
+                print('%7d  %16.0f  %5d  %7d  %9.2f  %7.2fx' % (num_objects, candidates, batch_size,
+                                                                min(num_workers, cores), latency * 1000,
+                                                                serial / latency))
+                if min(num_workers, cores) > 1 and serial / latency > 1.05:
+                    break_even.append((num_objects, candidates, batch_size, min(num_workers, cores)))
+
+    # The smallest batch and candidate count where the parallel path is more than 5% faster
+    if break_even:
+        num_objects, candidates, batch_size, num_workers = min(break_even, key=lambda case: (case[1] * case[2]))
+        print('break-even: batch %d with %.0f candidates/image (%d objects) and %d workers'
+              % (batch_size, candidates, num_objects, num_workers))
+    else:
+        print('break-even: none, keep num_workers=0 (serial) on this target')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# bench_preprocess.py
+
+#############################################################################
+#  Copyright (c) 2021, NVIDIA CORPORATION. All rights reserved.             #
+#                                                                           #
+#  Licensed under the Apache License, Version 2.0 (the "License");          #
+#  you may not use this file except in compliance with the License.         #
+#  You may obtain a copy of the License at                                  #
+#                                                                           #
+#      http://www.apache.org/licenses/LICENSE-2.0                           #
+#                                                                           #
+#  Unless required by applicable law or agreed to in writing, software      #
+#  distributed under the License is distributed on an "AS IS" BASIS,        #
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+#  See the License for the specific language governing permissions and      #
+#  limitations under the License.                                           #
+#############################################################################
+
+# Usage (from 11_test_ds_trt_yolo/):
+#   python3 -m benchmarks.bench_preprocess -s 608 -b 1 8 --image_size 1080 1920
+
+import time
+import argparse
+import numpy as np
+import cv2
+
+from tools.preprocess import preprocess_batch
+
+# The resize -> cvtColor -> transpose -> astype -> /= 255 -> np.stack chain replaced by tools.preprocess
+def preprocess_chain(imgs, input_hw):
+    batch = []
+    for img in imgs:
+        img = cv2.resize(img, (input_hw[1], input_hw[0]))
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        img = img.transpose((2, 0, 1)).astype(np.float32)
+        img /= 255.0
+        batch.append(img)
+    return np.stack(batch)
+
+def run(func, iterations):
+    func()
+    t = time.time()
+    for _ in range(iterations):
+        func()
+    return (time.time() - t) / iterations
+
+# Main function
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-s', '--input_size', type=int, default=608,
+        help='Network input size [608]')
+    parser.add_argument(
+        '-b', '--batch_sizes', type=int, nargs='+', default=[1, 8],
+        help='Batch sizes to measure [1 8]')
+    parser.add_argument(
+        '--image_size', type=int, nargs=2, default=[1080, 1920],
+        help='Height and width of the source images [1080 1920]')
+    parser.add_argument(
+        '-n', '--iterations', type=int, default=20,
+        help='Timed iterations per case [20]')
+    args = parser.parse_args()
+
+    input_hw = (args.input_size, args.input_size)
+    rng = np.random.default_rng(0)
+    print('batch  %-24s ms/batch   speedup' % 'preprocess')
+    for batch_size in args.batch_sizes:
+        imgs = [rng.integers(0, 256, (args.image_size[0], args.image_size[1], 3), dtype=np.uint8)
+                for _ in range(batch_size)]
+        out32 = np.empty((batch_size, 3) + input_hw, dtype=np.float32)
+        out16 = np.empty((batch_size, 3) + input_hw, dtype=np.float16)
+
+        # Same pixels as the old chain, up to the rounding of the scale
+        preprocess_batch(imgs, out32)
+        assert np.allclose(out32, preprocess_chain(imgs, input_hw), atol=1e-6)
+
+        cases = [
+            ('chain + np.stack',       lambda: preprocess_chain(imgs, input_hw)),
+            ('fused float32',          lambda: preprocess_batch(imgs, out32)),
+            ('fused float32 letterbox', lambda: preprocess_batch(imgs, out32, letterbox=True)),
+            ('fused float16',          lambda: preprocess_batch(imgs, out16)),
+        ]
+        baseline = None
+        for name, func in cases:
+            latency = run(func, args.iterations)
+            baseline = baseline or latency
+            print('%5d  %-24s %8.2f  %7.2fx' % (batch_size, name, latency * 1000, baseline / latency))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# bench_yolo_decode.py
+
+#############################################################################
+#  Copyright (c) 2021, NVIDIA CORPORATION. All rights reserved.             #
+#                                                                           #
+#  Licensed under the Apache License, Version 2.0 (the "License");          #
+#  you may not use this file except in compliance with the License.         #
+#  You may obtain a copy of the License at                                  #
+#                                                                           #
+#      http://www.apache.org/licenses/LICENSE-2.0                           #
+#                                                                           #
+#  Unless required by applicable law or agreed to in writing, software      #
+#  distributed under the License is distributed on an "AS IS" BASIS,        #
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+#  See the License for the specific language governing permissions and      #
+#  limitations under the License.                                           #
+#############################################################################
+
+# Usage (from 11_test_ds_trt_yolo/):
+#   python3 -m benchmarks.bench_yolo_decode -s 608 -b 1 8
+
+import io
+import time
+import argparse
+from collections import Counter
+
+import onnx
+import torch
+
+from tools.onnx.layer.yolo import Yolo, yolo_forward_dynamic
+
+ANCHORS = [12, 16, 19, 36, 40, 28, 36, 75, 76, 55, 72, 146, 142, 110, 192, 243, 459, 401]
+
+# Function for the three Yolo heads of yolov4 (strides 8, 16 and 32)
+def make_yolo_layers(num_classes=80):
+    layers = []
+    for i, stride in enumerate((8, 16, 32)):
+        layer = Yolo(anchor_mask=[3 * i, 3 * i + 1, 3 * i + 2], num_classes=num_classes,
+                     anchors=[float(a) for a in ANCHORS], num_anchors=9, stride=stride)
+        layers.append(layer.eval())
+    return layers
+
+# The decode of all heads, like the tail of Darknet.forward
+class YoloHeads(torch.nn.Module):
+    def __init__(self, layers):
+        super(YoloHeads, self).__init__()
+        self.layers = torch.nn.ModuleList(layers)
+
+    def forward(self, x0, x1, x2):
+        outputs = [layer(x) for layer, x in zip(self.layers, (x0, x1, x2))]
+        return torch.cat([o[0] for o in outputs], 1), torch.cat([o[1] for o in outputs], 1)
+
+# Function for decoding every call from scratch, without the cached constants
+def decode_uncached(layers, inputs):
+    for layer, x in zip(layers, inputs):
+        masked_anchors = []
+        for m in layer.anchor_mask:
+            masked_anchors += layer.anchors[m * layer.anchor_step:(m + 1) * layer.anchor_step]
+        masked_anchors = [anchor / layer.stride for anchor in masked_anchors]
+        yolo_forward_dynamic(x, layer.thresh, layer.num_classes, masked_anchors, len(layer.anchor_mask),
+                             scale_x_y=layer.scale_x_y)
+
+def run(func, iterations):
+    func()
+    t = time.time()
+    for _ in range(iterations):
+        func()
+    return (time.time() - t) / iterations
+
+# Function for the node count of the exported decode graph
+def count_nodes(heads, inputs):
+    f = io.BytesIO()
+    torch.onnx.export(heads, inputs, f, opset_version=12, do_constant_folding=True,
+                      input_names=['x0', 'x1', 'x2'], output_names=['boxes', 'confs'],
+                      dynamic_axes={'x0': {0: 'batch_size'}, 'x1': {0: 'batch_size'}, 'x2': {0: 'batch_size'},
+                                    'boxes': {0: 'batch_size'}, 'confs': {0: 'batch_size'}})
+    return Counter(node.op_type for node in onnx.load_from_string(f.getvalue()).graph.node)
+
+# Main function
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-s', '--input_size', type=int, default=608,
+        help='Network input size [608]')
+    parser.add_argument(
+        '-b', '--batch_sizes', type=int, nargs='+', default=[1, 8],
+        help='Batch sizes to measure [1 8]')
+    parser.add_argument(
+        '-n', '--iterations', type=int, default=20,
+        help='Timed iterations per case [20]')
+    args = parser.parse_args()
+
+    layers = make_yolo_layers()
+    heads = YoloHeads(layers)
+
+    print('batch  %-10s ms/batch   speedup' % 'decode')
+    for batch_size in args.batch_sizes:
+        inputs = tuple(torch.randn(batch_size, 255, args.input_size // s, args.input_size // s) for s in (8, 16, 32))
+        with torch.no_grad():
+            uncached = run(lambda: decode_uncached(layers, inputs), args.iterations)
+            cached = run(lambda: [layer(x) for layer, x in zip(layers, inputs)], args.iterations)
+        print('%5d  %-10s %8.2f  %7.2fx' % (batch_size, 'uncached', uncached * 1000, 1.0))
+        print('%5d  %-10s %8.2f  %7.2fx' % (batch_size, 'cached', cached * 1000, uncached / cached))
+
+    nodes = count_nodes(heads, inputs)
+    print('Exported decode graph: %d nodes' % sum(nodes.values()))
+    for op_type, count in nodes.most_common():
+        print('  %-12s %4d' % (op_type, count))
+
+if __name__ == '__main__':
+    main()
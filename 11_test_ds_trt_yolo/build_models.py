@@ -0,0 +1,78 @@
+# build_models.py
+
+#############################################################################
+#  Copyright (c) 2021, NVIDIA CORPORATION. All rights reserved.             #
+#                                                                           #
+#  Licensed under the Apache License, Version 2.0 (the "License");          #
+#  you may not use this file except in compliance with the License.         #
+#  You may obtain a copy of the License at                                  #
+#                                                                           #
+#      http://www.apache.org/licenses/LICENSE-2.0                           #
+#                                                                           #
+#  Unless required by applicable law or agreed to in writing, software      #
+#  distributed under the License is distributed on an "AS IS" BASIS,        #
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+#  See the License for the specific language governing permissions and      #
+#  limitations under the License.                                           #
+#############################################################################
+
+import json
+import argparse
+from functools import partial
+
+from tools.build_matrix import expand_matrix, run_command, MockRunner, Scheduler
+
+# Model zoo conversion of build_onnx_model.sh and build_trt_engine.sh from one build matrix:
+# export (yolo_to_onnx.py) -> graph surgery -> TensorRT build (onnx_to_trt.py),
+# shared steps run once and independent jobs run in parallel.
+
+# Main function
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-m', '--matrix', type=str, default='build_matrix.json',
+        help='Build matrix JSON file, see tools.build_matrix.expand_matrix() [build_matrix.json]')
+    parser.add_argument(
+        '-w', '--workers', type=int, default=2,
+        help='Max number of jobs running at once [2]')
+    parser.add_argument(
+        '--memory_mb', type=float,
+        help='Memory budget of the running jobs in MiB [80%% of the available memory]')
+    parser.add_argument(
+        '--log_dir', type=str, default='trt_output/logs',
+        help='Directory of the job logs [trt_output/logs]')
+    parser.add_argument(
+        '--dry_run', default=False, action="store_true",
+        help='Print the jobs and their commands without running them')
+    parser.add_argument(
+        '--mock', default=False, action="store_true",
+        help='Sleep instead of running the commands, to try the scheduler on any host')
+    parser.add_argument(
+        '--mock_fail', type=str,
+        help='With --mock, fail the jobs whose name contains this string')
+    parser.add_argument(
+        '--report', type=str,
+        help='Write the status and duration of every job to this JSON file')
+    args = parser.parse_args()
+
+    with open(args.matrix) as fp:
+        jobs = expand_matrix(json.load(fp))
+
+    if args.dry_run:
+        for job in jobs:
+            print('%s <- %s' % (job.name, ', '.join(job.deps) or '-'))
+            print('    ' + ' '.join(job.cmd))
+        print('%d jobs' % len(jobs))
+        return
+
+    runner = MockRunner(fail=args.mock_fail) if args.mock else partial(run_command, log_dir=args.log_dir)
+    scheduler = Scheduler(jobs, runner, args.workers, args.memory_mb)
+    seconds = scheduler.run()
+    scheduler.print_report(seconds)
+    if args.report:
+        scheduler.write_report(args.report)
+    if any(job.status != 'done' for job in jobs):
+        raise SystemExit('ERROR: not every job of %s has been built!' % args.matrix)
+
+if __name__ == '__main__':
+    main()
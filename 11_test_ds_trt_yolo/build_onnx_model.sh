@@ -18,24 +18,16 @@
 
 echo
 echo "Convert Darknet yolov3-608 to ONNX model"
-python3 yolo_to_onnx.py -m models/yolov3-608.weights -c models/yolov3-608.cfg -b 8  # For static batch 8
-python3 yolo_to_onnx.py -m models/yolov3-608.weights -c models/yolov3-608.cfg -b 4  # For static batch 4
-python3 yolo_to_onnx.py -m models/yolov3-608.weights -c models/yolov3-608.cfg -b -1 # For Dynamic batch 
+python3 yolo_to_onnx.py -m models/yolov3-608.weights -c models/yolov3-608.cfg -b 8 4 -1 --specialize  # Dynamic batch traced, static batch 8 and 4 rewritten from it
 
 echo
 echo "Convert Darknet yolov3-tiny-608 to ONNX model"
-python3 yolo_to_onnx.py -m models/yolov3-tiny-608.weights -c models/yolov3-tiny-608.cfg -b 8  # For static batch 8
-python3 yolo_to_onnx.py -m models/yolov3-tiny-608.weights -c models/yolov3-tiny-608.cfg -b 4  # For static batch 4
-python3 yolo_to_onnx.py -m models/yolov3-tiny-608.weights -c models/yolov3-tiny-608.cfg -b -1 # For Dynamic batch 
+python3 yolo_to_onnx.py -m models/yolov3-tiny-608.weights -c models/yolov3-tiny-608.cfg -b 8 4 -1 --specialize  # Dynamic batch traced, static batch 8 and 4 rewritten from it
 
 echo
 echo "Convert Darknet yolov4-608 to ONNX model"
-python3 yolo_to_onnx.py -m models/yolov4-608.weights -c models/yolov4-608.cfg -b 8  # For static batch 8
-python3 yolo_to_onnx.py -m models/yolov4-608.weights -c models/yolov4-608.cfg -b 4  # For static batch 4
-python3 yolo_to_onnx.py -m models/yolov4-608.weights -c models/yolov4-608.cfg -b -1 # For Dynamic batch 
+python3 yolo_to_onnx.py -m models/yolov4-608.weights -c models/yolov4-608.cfg -b 8 4 -1 --specialize  # Dynamic batch traced, static batch 8 and 4 rewritten from it
 
 echo
 echo "Convert Darknet yolov4-tiny-608 to ONNX model"
-python3 yolo_to_onnx.py -m models/yolov4-tiny-608.weights -c models/yolov4-tiny-608.cfg -b 8  # For static batch 8  
-python3 yolo_to_onnx.py -m models/yolov4-tiny-608.weights -c models/yolov4-tiny-608.cfg -b 4  # For static batch 4
-python3 yolo_to_onnx.py -m models/yolov4-tiny-608.weights -c models/yolov4-tiny-608.cfg -b -1 # For Dynamic batch 
+python3 yolo_to_onnx.py -m models/yolov4-tiny-608.weights -c models/yolov4-tiny-608.cfg -b 8 4 -1 --specialize  # Dynamic batch traced, static batch 8 and 4 rewritten from it
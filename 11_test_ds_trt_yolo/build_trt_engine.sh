@@ -58,7 +58,7 @@ python3 onnx_to_trt.py -i models/onnx/yolov3-tiny_8_3_608_608_static.onnx -p INT
 python3 onnx_to_trt.py -i models/onnx/yolov3-tiny_4_3_608_608_static.onnx -p INT8 -c calib_database -g DLA0 -b 4 4 4 -v
 python3 onnx_to_trt.py -i models/onnx/yolov3-tiny_4_3_608_608_static.onnx -p INT8 -c calib_database -g DLA1 -b 4 4 4 -v
 echo "[yolov3-tiny-608.gs.onnx] Build & export TRT model."
-ython3 onnx_to_trt.py -i models/onnx/yolov3-tiny_8_3_608_608_static.onnx -p INT8 -c calib_database -g CUDA -b 8 8 8 -v -j tools/onnx/graph/surgery/add_batchedNMSPlugin.json
+python3 onnx_to_trt.py -i models/onnx/yolov3-tiny_8_3_608_608_static.onnx -p INT8 -c calib_database -g CUDA -b 8 8 8 -v -j tools/onnx/graph/surgery/add_batchedNMSPlugin.json
 python3 onnx_to_trt.py -i models/onnx/yolov3-tiny_4_3_608_608_static.onnx -p INT8 -c calib_database -g DLA0 -b 4 4 4 -v -j tools/onnx/graph/surgery/add_batchedNMSPlugin.json
 python3 onnx_to_trt.py -i models/onnx/yolov3-tiny_4_3_608_608_static.onnx -p INT8 -c calib_database -g DLA1 -b 4 4 4 -v -j tools/onnx/graph/surgery/add_batchedNMSPlugin.json
 
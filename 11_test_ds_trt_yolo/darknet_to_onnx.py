@@ -0,0 +1,95 @@
+# darknet_to_onnx.py
+
+#############################################################################
+#  Copyright (c) 2021, NVIDIA CORPORATION. All rights reserved.             #
+#                                                                           #
+#  Licensed under the Apache License, Version 2.0 (the "License");          #
+#  you may not use this file except in compliance with the License.         #
+#  You may obtain a copy of the License at                                  #
+#                                                                           #
+#      http://www.apache.org/licenses/LICENSE-2.0                           #
+#                                                                           #
+#  Unless required by applicable law or agreed to in writing, software      #
+#  distributed under the License is distributed on an "AS IS" BASIS,        #
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+#  See the License for the specific language governing permissions and      #
+#  limitations under the License.                                           #
+#############################################################################
+
+import os
+import time
+import argparse
+
+from tools.onnx.net.darknet_cfg import Darknet_cfg, parse_input_size
+from tools.onnx.onnx_builder import build_onnx
+from tools.onnx.onnx_specialize import check_parity
+
+# Main function
+def main():
+    """Build ONNX files straight from a Darknet cfg and weights, without torch."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-m', '--model_file', type=str, required=True,
+        help=('Put YOLO model file path'
+              'Samples are like models/yolovX[-spp|]-[288|416|608].weights'))
+    parser.add_argument(
+        '-c', '--config_file', type=str, required=True,
+        help=('Put YOLO model configuration file path'
+              'Samples are like models/yolovX-[288|416|608].cfg'))
+    parser.add_argument(
+        '-b', '--batch_size', type=int, nargs='+', default=[-1],
+        help='Batch sizes to build, 0/-1 for the dynamic batch [-1]')
+    parser.add_argument(
+        '-s', '--input_sizes', type=str, nargs='+',
+        help='Input sizes to build like 416 or 416x608 (height x width), multiples of 32 [the size of the cfg]')
+    parser.add_argument(
+        '-o', '--onnx_path', type=str, default='models/onnx/',
+        help='Output directory of the ONNX files [models/onnx/]')
+    parser.add_argument(
+        '--compact', default=False, action="store_true",
+        help=('Output the top-1 score and class of every box (boxes, scores, classes)'
+              ' instead of the confs of all classes, for engines without the NMS plugin'))
+    parser.add_argument(
+        '--compact_thresh', type=float,
+        help='With --compact, set the scores below this confidence threshold to 0 in the model')
+    parser.add_argument(
+        '--check', default=False, action="store_true",
+        help=('Compare the outputs of every ONNX file by onnxruntime with the export of the same name'
+              ' by yolo_to_onnx.py in --reference_dir'))
+    parser.add_argument(
+        '--reference_dir', type=str, default='models/onnx/',
+        help='Directory of the exports of yolo_to_onnx.py for --check [models/onnx/]')
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.model_file):
+        raise SystemExit('ERROR: Model file (%s) not found!' % args.model_file)
+    if not os.path.isfile(args.config_file):
+        raise SystemExit('ERROR: Model config file (%s) not found!' % args.config_file)
+    if args.check and os.path.abspath(args.reference_dir) == os.path.abspath(args.onnx_path):
+        parser.error('--check needs a --reference_dir other than --onnx_path.')
+
+    net = Darknet_cfg().parse_cfg(args.config_file)[0]
+    sizes = [parse_input_size(size) for size in args.input_sizes] if args.input_sizes else \
+            [(int(net['height']), int(net['width']))]
+    summary = []
+    for height, width in sizes:
+        for batch in args.batch_size:
+            t = time.time()
+            onnx_file_name = build_onnx(args.config_file, args.model_file, batch, height, width, args.onnx_path,
+                                        args.compact, args.compact_thresh)
+            seconds = time.time() - t
+            parity = ''
+            if args.check:
+                reference_file = os.path.join(args.reference_dir, onnx_file_name)
+                parity = 'no reference' if not os.path.isfile(reference_file) else 'max abs diff ' + \
+                         ', '.join('%s %.3g' % item for item in
+                                   check_parity(os.path.join(args.onnx_path, onnx_file_name), reference_file).items())
+            summary.append((onnx_file_name, batch, height, width, seconds, parity))
+
+    print('%-56s %6s %11s %9s  %s' % ('onnx file', 'batch', 'input', 'build(s)', 'parity' if args.check else ''))
+    for onnx_file_name, batch, height, width, seconds, parity in summary:
+        print('%-56s %6s %11s %9.1f  %s' % (onnx_file_name, batch if batch > 0 else 'dynamic',
+                                            '%dx%d' % (height, width), seconds, parity))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+# onnx_stream.py
+
+#############################################################################
+#  Copyright (c) 2021, NVIDIA CORPORATION. All rights reserved.             #
+#                                                                           #
+#  Licensed under the Apache License, Version 2.0 (the "License");          #
+#  you may not use this file except in compliance with the License.         #
+#  You may obtain a copy of the License at                                  #
+#                                                                           #
+#      http://www.apache.org/licenses/LICENSE-2.0                           #
+#                                                                           #
+#  Unless required by applicable law or agreed to in writing, software      #
+#  distributed under the License is distributed on an "AS IS" BASIS,        #
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+#  See the License for the specific language governing permissions and      #
+#  limitations under the License.                                           #
+#############################################################################
+
+import os
+import cv2
+import argparse
+import onnxruntime
+import numpy as np
+
+from tools.pipeline import Pipeline, read_frames
+from tools.cpu_runtime import RUNTIME_MODES, DarknetSession
+from tools.preprocess import preprocess_batch, restore_boxes
+from tools.utils import post_processing, load_class_names, plot_boxes_cv2
+
+# Streaming detection of a video file or an image sequence with the exported onnx model.
+# decode -> preprocess -> inference -> postprocess -> render, each stage is a thread
+# connected to the next one by a bounded queue.
+
+# Function for grouping decoded frames into batches
+def decode_batches(input_path, batch_size):
+    names = []
+    frames = []
+    for name, frame, fps in read_frames(input_path):
+        names.append(name)
+        frames.append(frame)
+        if len(frames) == batch_size:
+            yield {'names': names, 'frames': frames, 'num_frames': len(frames), 'fps': fps}
+            names = []
+            frames = []
+    if frames:
+        yield {'names': names, 'frames': frames, 'num_frames': len(frames), 'fps': fps}
+
+# Function for the output image name of a decoded frame, {video}_{index}.jpg for the frames of a video
+def get_frame_file_name(name):
+    path, sep, index = name.rpartition(':')
+    if sep and index.isdigit():
+        return '%s_%06d.jpg' % (os.path.splitext(os.path.basename(path))[0], int(index))
+    return os.path.basename(name)
+
+class StreamDetector(object):
+    def __init__(self, session, batch_size, conf_thresh=0.4, nms_thresh=0.6, class_names=None, output_path=None,
+                 letterbox=False):
+        self.session = session
+        self.input_name = session.get_inputs()[0].name
+        input_shape = session.get_inputs()[0].shape
+        self.input_h = input_shape[2]
+        self.input_w = input_shape[3]
+        # Static batch models always take a full batch
+        self.static_batch = input_shape[0] if isinstance(input_shape[0], int) and input_shape[0] > 0 else None
+        self.batch_size = self.static_batch or batch_size
+        self.conf_thresh = conf_thresh
+        self.nms_thresh = nms_thresh
+        self.class_names = class_names
+        self.output_path = output_path
+        self.letterbox = letterbox
+        self.writer = None
+
+    def preprocess(self, item):
+        # A new buffer per batch, the queues may still hold the previous ones
+        img_in = np.zeros((self.batch_size, 3, self.input_h, self.input_w), dtype=np.float32)
+        item['meta'] = preprocess_batch(item['frames'], img_in, self.letterbox)
+        if self.static_batch is None:
+            img_in = img_in[:item['num_frames']]
+        item['input'] = img_in
+        return item
+
+    def infer(self, item):
+        item['outputs'] = self.session.run(None, {self.input_name: item.pop('input')})
+        return item
+
+    def postprocess(self, item):
+        item['detections'] = post_processing(None, self.conf_thresh, self.nms_thresh, item.pop('outputs'))
+        if self.letterbox:
+            for dets, meta in zip(item['detections'], item['meta']):
+                dets['box'] = restore_boxes(dets['box'], meta)
+        return item
+
+    def render(self, item):
+        if self.output_path is None:
+            return item
+        for i, (name, frame) in enumerate(zip(item['names'], item['frames'])):
+            img = plot_boxes_cv2(frame, item['detections'][i], class_names=self.class_names, verbose=False)
+            if os.path.isdir(self.output_path):
+                cv2.imwrite(os.path.join(self.output_path, get_frame_file_name(name)), img)
+            else:
+                if self.writer is None:
+                    # The frame rate of the source video, 30 for images or a video without one
+                    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+                    self.writer = cv2.VideoWriter(self.output_path, fourcc, item['fps'] or 30,
+                                                  (img.shape[1], img.shape[0]))
+                self.writer.write(img)
+        return item
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.release()
+
+# Main function
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-m', '--onnx_file', type=str,
+        help='Put the ONNX model exported by yolo_to_onnx.py')
+    parser.add_argument(
+        '--backend', type=str, default='onnxruntime', choices=['onnxruntime'] + RUNTIME_MODES,
+        help=('Inference backend [onnxruntime], eager and torchscript run the Darknet model'
+              ' of --config_file and --weights_file with torch on CPU'))
+    parser.add_argument(
+        '-c', '--config_file', type=str,
+        help='Put YOLO model configuration file path for the eager and torchscript backends')
+    parser.add_argument(
+        '-w', '--weights_file', type=str,
+        help='Put YOLO model file path for the eager and torchscript backends')
+    parser.add_argument(
+        '--threads', type=int, default=0,
+        help='Intra-op threads of the inference backend, 0 keeps its default [0]')
+    parser.add_argument(
+        '--interop_threads', type=int, default=0,
+        help='Inter-op threads of the inference backend, 0 keeps its default [0]')
+    parser.add_argument(
+        '-i', '--input', type=str, required=True,
+        help='Put a video file, an image directory or a glob pattern of images')
+    parser.add_argument(
+        '-l', '--label_file', type=str,
+        help='Put label of classes file path')
+    parser.add_argument(
+        '-o', '--output', type=str,
+        help=('Output video file (.mp4) or an existing directory for rendered frames.'
+              ' Rendering is skipped without it'))
+    parser.add_argument(
+        '-b', '--batch_size', type=int, default=1,
+        help='Batch size for dynamic batch models [1]')
+    parser.add_argument(
+        '-q', '--queue_size', type=int, default=4,
+        help='Capacity of the queue in front of every stage [4]')
+    parser.add_argument(
+        '--conf_thresh', type=float, default=0.4,
+        help='Confidence threshold [0.4]')
+    parser.add_argument(
+        '--nms_thresh', type=float, default=0.6,
+        help='NMS IoU threshold [0.6]')
+    parser.add_argument(
+        '--letterbox', default=False, action="store_true",
+        help='Keep the aspect ratio of frames and pad them to the network input')
+    args = parser.parse_args()
+
+    class_names = load_class_names(args.label_file) if args.label_file else None
+    if args.backend == 'onnxruntime':
+        if args.onnx_file is None or not os.path.isfile(args.onnx_file):
+            raise SystemExit('ERROR: ONNX file (%s) not found!' % args.onnx_file)
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = args.threads
+        options.inter_op_num_threads = args.interop_threads
+        session = onnxruntime.InferenceSession(args.onnx_file, options)
+    else:
+        for name, path in (('Model config', args.config_file), ('Model', args.weights_file)):
+            if path is None or not os.path.isfile(path):
+                raise SystemExit('ERROR: %s file (%s) not found!' % (name, path))
+        session = DarknetSession(args.config_file, args.weights_file, mode=args.backend,
+                                 intra_op_threads=args.threads, inter_op_threads=args.interop_threads)
+    print("The model expects input shape: ", session.get_inputs()[0].shape)
+
+    detector = StreamDetector(session, args.batch_size, args.conf_thresh, args.nms_thresh,
+                              class_names, args.output, args.letterbox)
+    pipeline = Pipeline(args.queue_size)
+    pipeline.add_stage('preprocess', detector.preprocess)
+    pipeline.add_stage('inference', detector.infer)
+    pipeline.add_stage('postprocess', detector.postprocess)
+    pipeline.add_stage('render', detector.render)
+
+    try:
+        stats = pipeline.run(decode_batches(args.input, detector.batch_size))
+    finally:
+        detector.close()
+    pipeline.print_stats(stats)
+
+if __name__ == '__main__':
+    main()
@@ -24,6 +24,7 @@ import argparse
 from tools.tensorrt.trt_utils import *
 from tools.onnx.onnx_utils import *
 from tools.utils import get_input_dim
+from tools.artifact_cache import ArtifactCache, source_files
 
 # Args option flag maps
 core_flage = {
@@ -46,7 +47,7 @@ def main():
         '-i', '--input_model', type=str, required=True, help=('Put the ONNX model that you want to convert to TRT engine.'
               'models/onnx/yolov3_b_ch_h_w.onnx'))
     parser.add_argument(
-        '-p', '--precision', type=str, required=True,
+        '-p', '--precision', type=str,
         help=('[ FP32 | FP16 | INT8 ]'
               'For INT8 quantization, you need to prepare calibration dataset in the \"calib_database/\" folder'))
     parser.add_argument(
@@ -72,6 +73,23 @@ def main():
         '-j', '--json_for_surgery', nargs='+', type=str,
         help=('Put the json file of ONNX graph surgery requestion format to Add|Remove|Change'
               'node to the target graph before generate TensorRT engine'))
+    parser.add_argument(
+        '-t', '--tuned_model', type=str,
+        help='Output ONNX file of the graph surgery [{input_model}_tuned.onnx]')
+    parser.add_argument(
+        '--cache_dir', type=str,
+        help='Reuse the graph surgery output of the same ONNX and jsons from this artifact cache (e.g. models/cache)')
+    parser.add_argument(
+        '--surgery_only', action='store_true',
+        help='Only write the graph surgery output (--tuned_model) without building the engine')
+    parser.add_argument(
+        '--skip_surgery', action='store_true',
+        help=('Build from an existing graph surgery output (--tuned_model) of the same input model and jsons,'
+              ' the engine name still follows --input_model'))
+    parser.add_argument(
+        '--refittable', action='store_true',
+        help=('Build a refittable engine, whose weights refit_trt.py replaces with the manifest of'
+              ' swap_weights.py --refit_manifest (a retrain of the same cfg) without building again'))
     args = parser.parse_args()
 
     model_name = None
@@ -79,10 +97,14 @@ def main():
     dynamic_batch = False
 
     # Exceptions
+    if args.precision is None and not args.surgery_only:
+        parser.error("--precision is required to build the engine.")
     if (args.precision == "INT8") and (args.calib_dataset is None):
         parser.error("--INT8 needs --calib_dataset.")
     if len(args.batch) != 3:
         parser.error("batch needs to have 3 element [MIN OPT MAX] for dynamic and [MAX MAX MAX] for static")
+    if args.refittable and "DLA" in args.gpu_core:
+        parser.error("--refittable is not supported on DLA")
     if not (args.batch[0] == args.batch[2]):
         if "DLA" in args.gpu_core:
             parser.error("For DLA, batch should be ( MIN == OPT == MAX)")
@@ -99,11 +121,31 @@ def main():
 
     # If ONNX graph surgeon option        
     # Graph Surgeon
-    if args.json_for_surgery != "":
-        print("Graph surgery has been requested by JSON files: \n", args.json_for_surgery)
-    gs = GraphSurgery(model_file, args.json_for_surgery, dynamic_batch)
-    gs.do_graph_surgeon()
-    onnx_model = gs.get_onnx_model()
+    if args.skip_surgery:
+        tuned_model = args.tuned_model or model_file.split('.onnx')[0] + '_tuned.onnx'
+        print("Reusing the graph surgery output: %s" % tuned_model)
+        onnx_model = load_onnx(tuned_model)
+    else:
+        if args.json_for_surgery:
+            print("Graph surgery has been requested by JSON files: \n", args.json_for_surgery)
+        tuned_model = args.tuned_model or model_file.split('.onnx')[0] + '_tuned.onnx'
+        cached = False
+        if args.cache_dir:
+            # Same input ONNX, requests and surgery code give the same output
+            cache = ArtifactCache(args.cache_dir)
+            key, inputs = cache.key('graph_surgery', {'onnx': model_file, 'jsons': args.json_for_surgery or [],
+                                                      'code': source_files('tools/onnx/onnx_utils.py', 'tools/onnx/graph/node')},
+                                    {'dynamic_batch': dynamic_batch})
+            cached = cache.fetch(key, tuned_model)
+        if not cached:
+            t = time.time()
+            gs = GraphSurgery(model_file, args.json_for_surgery, dynamic_batch, tuned_model)
+            gs.do_graph_surgeon()
+            if args.cache_dir:
+                cache.store(key, inputs, tuned_model, time.time() - t)
+        if args.surgery_only:
+            return
+        onnx_model = load_onnx(tuned_model)
 
     model_name = model_file.split('.onnx')[0].split('/')[-1]
     input_dim = get_input_dim(model_name)
@@ -113,7 +155,8 @@ def main():
     calib_path  = "trt_output/calib/"
     engine_name = model_name + "_" + args.gpu_core + "_" + args.precision
 
-    if args.json_for_surgery != "":
+    # Engines with and without surgery requests must not overwrite each other
+    if args.json_for_surgery:
         engine_name = engine_name + ".gs"
 
     calib_name  = engine_name + ".cache"
@@ -129,7 +172,7 @@ def main():
     # Build TensorRT engine and get its context
     engine, context = build_TRTengine(onnx_model, (input_dim[2], input_dim[3]), \
             args.batch, precision_flags[args.precision], args.calib_dataset, calib_file_path, \
-            core_flage[args.gpu_core], args.num_category, args.verbose)
+            core_flage[args.gpu_core], args.num_category, args.verbose, args.refittable)
     if engine is None:
         raise SystemExit('ERROR: failed to build the TensorRT engine!')
 
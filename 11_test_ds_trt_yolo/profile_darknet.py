@@ -0,0 +1,81 @@
+# profile_darknet.py
+
+#############################################################################
+#  Copyright (c) 2021, NVIDIA CORPORATION. All rights reserved.             #
+#                                                                           #
+#  Licensed under the Apache License, Version 2.0 (the "License");          #
+#  you may not use this file except in compliance with the License.         #
+#  You may obtain a copy of the License at                                  #
+#                                                                           #
+#      http://www.apache.org/licenses/LICENSE-2.0                           #
+#                                                                           #
+#  Unless required by applicable law or agreed to in writing, software      #
+#  distributed under the License is distributed on an "AS IS" BASIS,        #
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+#  See the License for the specific language governing permissions and      #
+#  limitations under the License.                                           #
+#############################################################################
+
+import json
+import torch
+import argparse
+
+from tools.onnx.net.darknet import Darknet
+
+# Main function
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-c', '--config_file', type=str, required=True,
+        help=('Put YOLO model configuration file path'
+              'Samples are like models/yolovX-[288|416|608].cfg'))
+    parser.add_argument(
+        '-m', '--model_file', type=str,
+        help='Put YOLO model file path, random weights without it (the timings do not depend on them)')
+    parser.add_argument(
+        '-b', '--batch_size', type=int, default=1,
+        help='Batch size [1]')
+    parser.add_argument(
+        '-s', '--input_size', type=int,
+        help='Network input size (square) [the size of the cfg]')
+    parser.add_argument(
+        '-n', '--iterations', type=int, default=10,
+        help='Timed iterations [10]')
+    parser.add_argument(
+        '--warmup', type=int, default=2,
+        help='Untimed iterations before the timed ones [2]')
+    parser.add_argument(
+        '--no_fuse', default=False, action="store_true",
+        help='Profile the BatchNorm layers as they are instead of folding them into the convolutions')
+    parser.add_argument(
+        '--top', type=int, default=20,
+        help='Print the N most expensive layers [20]')
+    parser.add_argument(
+        '--trace', type=str,
+        help='Write the timed iterations to this Chrome trace JSON file (chrome://tracing, ui.perfetto.dev)')
+    parser.add_argument(
+        '--json', type=str,
+        help='Write the per-layer and per-type reports to this JSON file')
+    args = parser.parse_args()
+
+    model = Darknet(args.config_file).eval()
+    if args.model_file:
+        model.load_weights(args.model_file)
+    if not args.no_fuse:
+        model.fuse_conv_bn()
+
+    height = args.input_size or model.height
+    width = args.input_size or model.width
+    x = torch.randn(args.batch_size, 3, height, width)
+    profiler = model.profile(x, args.iterations, args.warmup)
+
+    print('%s %dx%d batch %d' % (args.config_file, height, width, args.batch_size))
+    profiler.print_report(args.top)
+    if args.trace:
+        profiler.write_chrome_trace(args.trace)
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump({'layers': profiler.report(), 'types': profiler.report_by_type()}, fp, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+# refit_trt.py
+
+#############################################################################
+#  Copyright (c) 2021, NVIDIA CORPORATION. All rights reserved.             #
+#                                                                           #
+#  Licensed under the Apache License, Version 2.0 (the "License");          #
+#  you may not use this file except in compliance with the License.         #
+#  You may obtain a copy of the License at                                  #
+#                                                                           #
+#      http://www.apache.org/licenses/LICENSE-2.0                           #
+#                                                                           #
+#  Unless required by applicable law or agreed to in writing, software      #
+#  distributed under the License is distributed on an "AS IS" BASIS,        #
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+#  See the License for the specific language governing permissions and      #
+#  limitations under the License.                                           #
+#############################################################################
+
+import os
+import time
+import argparse
+
+from tools.tensorrt.trt_utils import refit_TRTengine, save_TRTengine
+from tools.onnx.onnx_weights import load_refit_manifest
+
+# Main function
+def main():
+    """Refit TensorRT engines with the new weights of swap_weights.py --refit_manifest."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-e', '--engine_files', type=str, nargs='+', required=True,
+        help=('Put the engines built with onnx_to_trt.py --refittable from the swapped ONNX file'
+              'Samples are like trt_output/engine/yolovX_{batch}_3_{height}_{width}_[static|dynamic]_CUDA_FP16.trt'))
+    parser.add_argument(
+        '-r', '--refit_manifest', type=str, required=True,
+        help='Put the manifest of swap_weights.py --refit_manifest like models/onnx/yolovX_..._dynamic.refit.json')
+    parser.add_argument(
+        '-o', '--engine_path', type=str,
+        help='Output directory of the refitted engines [replace the input engines]')
+    parser.add_argument(
+        '-v', '--verbose', action='store_true',
+        help='Enable verbose output logs (for debug)')
+    args = parser.parse_args()
+
+    for path in args.engine_files + [args.refit_manifest]:
+        if not os.path.isfile(path):
+            raise SystemExit('ERROR: File (%s) not found!' % path)
+
+    named_weights = load_refit_manifest(args.refit_manifest)
+    for engine_file in args.engine_files:
+        if '_INT8' in os.path.basename(engine_file):
+            print('WARNING: %s keeps the INT8 calibration of the old weights, build it again if the accuracy drops'
+                  % engine_file)
+        t = time.time()
+        engine = refit_TRTengine(engine_file, named_weights, args.verbose)
+        if engine is None:
+            raise SystemExit('ERROR: failed to refit the TensorRT engine %s!' % engine_file)
+        output_file = os.path.join(args.engine_path, os.path.basename(engine_file)) if args.engine_path else engine_file
+        if args.engine_path:
+            os.makedirs(args.engine_path, exist_ok=True)
+        save_TRTengine(engine, output_file)
+        print('Refitted in %.1f s: %s' % (time.time() - t, output_file))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# specialize_onnx.py
+
+#############################################################################
+#  Copyright (c) 2021, NVIDIA CORPORATION. All rights reserved.             #
+#                                                                           #
+#  Licensed under the Apache License, Version 2.0 (the "License");          #
+#  you may not use this file except in compliance with the License.         #
+#  You may obtain a copy of the License at                                  #
+#                                                                           #
+#      http://www.apache.org/licenses/LICENSE-2.0                           #
+#                                                                           #
+#  Unless required by applicable law or agreed to in writing, software      #
+#  distributed under the License is distributed on an "AS IS" BASIS,        #
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+#  See the License for the specific language governing permissions and      #
+#  limitations under the License.                                           #
+#############################################################################
+
+import os
+import time
+import argparse
+
+from tools.onnx.net.darknet_cfg import parse_input_size
+from tools.onnx.onnx_specialize import parse_onnx_file_name, specialize_onnx, check_parity
+
+# Main function
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-x', '--onnx_file', type=str, required=True,
+        help=('Put the dynamic batch ONNX file exported by yolo_to_onnx.py'
+              'Samples are like models/onnx/yolovX_-1_3_{height}_{width}_dynamic.onnx'))
+    parser.add_argument(
+        '-b', '--batch_sizes', type=int, nargs='+', default=[-1],
+        help='Static batch sizes to write, 0/-1 keeps the dynamic batch [-1]')
+    parser.add_argument(
+        '-s', '--input_sizes', type=str, nargs='+',
+        help='Input sizes to write like 416 or 416x608 (height x width), multiples of 32 [the size of the export]')
+    parser.add_argument(
+        '-o', '--onnx_path', type=str,
+        help='Output directory of the variants [the directory of the ONNX file]')
+    parser.add_argument(
+        '--check', default=False, action="store_true",
+        help=('Compare the outputs of every variant by onnxruntime with the traced export of the same name'
+              ' in --reference_dir, or with the dynamic batch export for its own input size'))
+    parser.add_argument(
+        '--reference_dir', type=str,
+        help='Directory of traced exports (yolo_to_onnx.py) for --check')
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.onnx_file):
+        raise SystemExit('ERROR: ONNX file (%s) not found!' % args.onnx_file)
+    _, _, height, width, _ = parse_onnx_file_name(args.onnx_file)
+    sizes = [parse_input_size(size) for size in args.input_sizes] if args.input_sizes else [(height, width)]
+    onnx_path = os.path.join(args.onnx_path or os.path.dirname(args.onnx_file), '')
+    os.makedirs(onnx_path, exist_ok=True)
+
+    summary = []
+    for new_height, new_width in sizes:
+        for batch in args.batch_sizes:
+            t = time.time()
+            onnx_file_name = specialize_onnx(args.onnx_file, batch, new_height, new_width, onnx_path)
+            seconds = time.time() - t
+            parity = ''
+            if args.check:
+                reference_file = os.path.join(args.reference_dir or '', onnx_file_name)
+                if args.reference_dir and os.path.isfile(reference_file):
+                    diffs = check_parity(onnx_path + onnx_file_name, reference_file)
+                elif (new_height, new_width) == (height, width):
+                    reference_file = args.onnx_file
+                    diffs = check_parity(onnx_path + onnx_file_name, reference_file)
+                else:
+                    diffs = None
+                parity = 'no reference' if diffs is None else \
+                         'max abs diff %s vs %s' % (', '.join('%s %.3g' % item for item in diffs.items()),
+                                                    os.path.basename(reference_file))
+            summary.append((onnx_file_name, batch, new_height, new_width, seconds, parity))
+
+    print('%-56s %6s %11s %10s  %s' % ('onnx file', 'batch', 'input', 'rewrite(s)', 'parity' if args.check else ''))
+    for onnx_file_name, batch, new_height, new_width, seconds, parity in summary:
+        print('%-56s %6s %11s %10.1f  %s' % (onnx_file_name, batch if batch > 0 else 'dynamic',
+                                             '%dx%d' % (new_height, new_width), seconds, parity))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+# swap_weights.py
+
+#############################################################################
+#  Copyright (c) 2021, NVIDIA CORPORATION. All rights reserved.             #
+#                                                                           #
+#  Licensed under the Apache License, Version 2.0 (the "License");          #
+#  you may not use this file except in compliance with the License.         #
+#  You may obtain a copy of the License at                                  #
+#                                                                           #
+#      http://www.apache.org/licenses/LICENSE-2.0                           #
+#                                                                           #
+#  Unless required by applicable law or agreed to in writing, software      #
+#  distributed under the License is distributed on an "AS IS" BASIS,        #
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+#  See the License for the specific language governing permissions and      #
+#  limitations under the License.                                           #
+#############################################################################
+
+import os
+import time
+import onnx
+import argparse
+import onnxruntime
+import numpy as np
+
+from tools.onnx.net.darknet_cfg import Darknet_cfg
+from tools.onnx.onnx_weights import conv_weight_shapes, read_conv_weights, swap_weights, write_refit_manifest
+
+# Function for comparing an ONNX file with the Darknet model of the new weights on one random input
+def check_with_darknet(onnx_file, config_file, model_file, sessions, seed=0):
+    """Graphs onnxruntime cannot run (TensorRT plugins of the graph surgery) are skipped.
+    # Returns
+        dict of output name -> max abs difference, None if skipped
+    """
+    from tools.cpu_runtime import DarknetSession
+    try:
+        session = onnxruntime.InferenceSession(onnx_file, providers=['CPUExecutionProvider'])
+    except Exception:
+        return None
+    names = [output.name for output in session.get_outputs()]
+    compact = 'scores' in names
+    if compact not in sessions:
+        sessions[compact] = DarknetSession(config_file, model_file, mode='eager', compact=compact)
+    shape = [d if isinstance(d, int) else 2 for d in session.get_inputs()[0].shape]
+    x = np.random.default_rng(seed).random(shape, dtype=np.float32)
+    outputs = session.run(None, {session.get_inputs()[0].name: x})
+    expected = sessions[compact].run(names, {'input': x})
+    return dict((name, float(np.abs(a.astype(np.float64) - b.reshape(a.shape)).max()))
+                for name, a, b in zip(names, outputs, expected))
+
+# Main function
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-x', '--onnx_files', type=str, nargs='+', required=True,
+        help=('Put the ONNX files exported from the same cfg with the BatchNorm folded'
+              ' (any batch, input size or graph surgery output)'
+              'Samples are like models/onnx/yolovX_{batch}_3_{height}_{width}_[static|dynamic].onnx'))
+    parser.add_argument(
+        '-c', '--config_file', type=str, required=True,
+        help=('Put YOLO model configuration file path'
+              'Samples are like models/yolovX-[288|416|608].cfg'))
+    parser.add_argument(
+        '-m', '--model_file', type=str, required=True,
+        help='Put the new YOLO weights file of the same cfg (a retrain)')
+    parser.add_argument(
+        '-o', '--onnx_path', type=str,
+        help='Output directory of the swapped ONNX files [replace the input files]')
+    parser.add_argument(
+        '--refit_manifest', default=False, action="store_true",
+        help=('Also write {onnx}.refit.json/.npy with the new weights only,'
+              ' for refit_trt.py on engines built with onnx_to_trt.py --refittable'))
+    parser.add_argument(
+        '--check', default=False, action="store_true",
+        help='Compare the outputs of every swapped ONNX file by onnxruntime with Darknet of the new weights')
+    args = parser.parse_args()
+
+    for path in args.onnx_files + [args.config_file, args.model_file]:
+        if not os.path.isfile(path):
+            raise SystemExit('ERROR: File (%s) not found!' % path)
+
+    blocks = Darknet_cfg().parse_cfg(args.config_file)
+    layers = None
+    sessions = {}
+    summary = []
+    for onnx_file in args.onnx_files:
+        t = time.time()
+        model = onnx.load(onnx_file)
+        if layers is None:
+            # Read once for every file, the conv shapes are the same in all exports of the cfg
+            layers = read_conv_weights(args.config_file, args.model_file, conv_weight_shapes(model.graph, blocks))
+        tensors = swap_weights(model, args.config_file, args.model_file, layers)
+        output_file = os.path.join(args.onnx_path, os.path.basename(onnx_file)) if args.onnx_path else onnx_file
+        if args.onnx_path:
+            os.makedirs(args.onnx_path, exist_ok=True)
+        onnx.save(model, output_file + '.tmp')
+        os.replace(output_file + '.tmp', output_file)
+        # The export info of yolo_to_onnx.py lists the old weights, the demo must not reuse the file for them
+        if os.path.isfile(output_file + '.json'):
+            os.remove(output_file + '.json')
+        changed = ''
+        if args.refit_manifest:
+            manifest_file, names = write_refit_manifest(model, tensors, output_file, args.model_file)
+            changed = '%d' % len(names)
+        seconds = time.time() - t
+        parity = ''
+        if args.check:
+            diffs = check_with_darknet(output_file, args.config_file, args.model_file, sessions)
+            parity = 'skipped' if diffs is None else ', '.join('%s %.3g' % item for item in diffs.items())
+        summary.append((output_file, len(tensors), changed, seconds, parity))
+
+    print('%-64s %8s %8s %8s  %s' % ('onnx file', 'tensors', 'changed', 'swap(s)', 'max abs diff' if args.check else ''))
+    for output_file, num, changed, seconds, parity in summary:
+        print('%-64s %8d %8s %8.1f  %s' % (output_file, num, changed, seconds, parity))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+# artifact_cache.py
+
+#############################################################################
+#  Copyright (c) 2021, NVIDIA CORPORATION. All rights reserved.             #
+#                                                                           #
+#  Licensed under the Apache License, Version 2.0 (the "License");          #
+#  you may not use this file except in compliance with the License.         #
+#  You may obtain a copy of the License at                                  #
+#                                                                           #
+#      http://www.apache.org/licenses/LICENSE-2.0                           #
+#                                                                           #
+#  Unless required by applicable law or agreed to in writing, software      #
+#  distributed under the License is distributed on an "AS IS" BASIS,        #
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+#  See the License for the specific language governing permissions and      #
+#  limitations under the License.                                           #
+#############################################################################
+
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+from contextlib import contextmanager
+
+MANIFEST_FILE = 'manifest.json'
+
+# Function for the sha256 of a file, read in chunks
+def file_sha256(path, chunk_size=1 << 20):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+# Root of the conversion scripts, the sources below are relative to it
+SOURCE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Function for the python sources of some files and directories, part of the keys when the code changes the output
+def source_files(*paths):
+    files = []
+    for path in paths:
+        path = os.path.join(SOURCE_ROOT, path)
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith('.py'))
+        else:
+            files.append(path)
+    return files
+
+# Function for an atomic copy, never a hard link: the tools rewrite their outputs in place
+def _copy_file(src, dst):
+    os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+    tmp = dst + '.tmp%d' % os.getpid()
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+# Content addressed cache of conversion outputs (ONNX exports, graph surgery outputs)
+class ArtifactCache(object):
+    """The key of an artifact is the sha256 of its inputs: the content of the
+    files (cfg, weights, ONNX, surgery jsons) and the options of the step.
+    Artifacts are stored as {cache_dir}/{key[:2]}/{key}{ext}, the manifest
+    records their provenance and the time the step took. Processes of the
+    build orchestrator share the manifest under a file lock.
+    """
+    def __init__(self, cache_dir='models/cache'):
+        self.cache_dir = cache_dir
+        self.manifest_file = os.path.join(cache_dir, MANIFEST_FILE)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @contextmanager
+    def _manifest(self, write=False):
+        with open(os.path.join(self.cache_dir, '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX if write else fcntl.LOCK_SH)
+            try:
+                manifest = {'artifacts': {}, 'digests': {}}
+                if os.path.isfile(self.manifest_file):
+                    with open(self.manifest_file) as fp:
+                        manifest = json.load(fp)
+                yield manifest
+                if write:
+                    tmp = self.manifest_file + '.tmp%d' % os.getpid()
+                    with open(tmp, 'w') as fp:
+                        json.dump(manifest, fp, indent=2, sort_keys=True)
+                    os.replace(tmp, self.manifest_file)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    # Function for the sha256 of a file, rehashed only when its size or mtime changed
+    def digest(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self._manifest() as manifest:
+            known = manifest['digests'].get(path)
+        if known and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return known[2]
+        sha = file_sha256(path)
+        with self._manifest(write=True) as manifest:
+            manifest['digests'][path] = [stat.st_size, stat.st_mtime_ns, sha]
+        return sha
+
+    # Function for the key of an artifact
+    def key(self, step, files, options):
+        """
+        # Args
+            step: name of the conversion step, like 'onnx_export' or 'graph_surgery'
+            files: dict of role -> file path (or list of paths), hashed by content
+            options: dict of the JSON serializable options of the step
+        # Returns
+            key: hex sha256, inputs: dict of the hashed inputs for the manifest
+        """
+        inputs = {'step': step, 'options': options, 'files': {}}
+        digests = {}
+        for role, paths in files.items():
+            if paths is None:
+                continue
+            if isinstance(paths, (list, tuple)):
+                digests[role] = [self.digest(p) for p in paths]
+                inputs['files'][role] = [[p, d] for p, d in zip(paths, digests[role])]
+            else:
+                digests[role] = self.digest(paths)
+                inputs['files'][role] = [paths, digests[role]]
+        # File names are provenance only, the key depends on their content
+        blob = json.dumps({'step': step, 'options': options, 'files': digests}, sort_keys=True)
+        return hashlib.sha256(blob.encode()).hexdigest(), inputs
+
+    def _path(self, key, ext):
+        return os.path.join(self.cache_dir, key[:2], key + ext)
+
+    # Function for placing a cached artifact at dst, returns False on a miss
+    def fetch(self, key, dst):
+        path = self._path(key, os.path.splitext(dst)[1])
+        if not os.path.isfile(path):
+            return False
+        with self._manifest() as manifest:
+            sha = manifest['artifacts'].get(key, {}).get('sha256')
+        # An up-to-date dst (from the last run) is not copied again
+        if not (sha and os.path.isfile(dst) and self.digest(dst) == sha):
+            _copy_file(path, dst)
+        with self._manifest(write=True) as manifest:
+            entry = manifest['artifacts'].get(key)
+            if entry is not None:
+                entry['hits'] = entry.get('hits', 0) + 1
+                entry['last_used'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+                entry['saved_seconds'] = entry.get('saved_seconds', 0.0) + entry['seconds']
+        print('Reusing cached %s for %s' % (path, dst))
+        return True
+
+    # Function for adding the output file of a step to the cache
+    def store(self, key, inputs, src, seconds):
+        path = self._path(key, os.path.splitext(src)[1])
+        _copy_file(src, path)
+        sha = self.digest(src)
+        with self._manifest(write=True) as manifest:
+            manifest['artifacts'][key] = {
+                'file'      : os.path.relpath(path, self.cache_dir),
+                'output'    : src,
+                'bytes'     : os.path.getsize(path),
+                'sha256'    : sha,
+                'inputs'    : inputs,
+                'seconds'   : seconds,
+                'created'   : time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'hits'      : 0,
+            }
+        return path
@@ -0,0 +1,281 @@
+# build_matrix.py
+
+#############################################################################
+#  Copyright (c) 2021, NVIDIA CORPORATION. All rights reserved.             #
+#                                                                           #
+#  Licensed under the Apache License, Version 2.0 (the "License");          #
+#  you may not use this file except in compliance with the License.         #
+#  You may obtain a copy of the License at                                  #
+#                                                                           #
+#      http://www.apache.org/licenses/LICENSE-2.0                           #
+#                                                                           #
+#  Unless required by applicable law or agreed to in writing, software      #
+#  distributed under the License is distributed on an "AS IS" BASIS,        #
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+#  See the License for the specific language governing permissions and      #
+#  limitations under the License.                                           #
+#############################################################################
+
+import os
+import sys
+import time
+import json
+import random
+import itertools
+import threading
+import subprocess
+
+from tools.onnx.net.darknet_cfg import Darknet_cfg, get_onnx_file_name
+
+# Keys of a build group, a missing key falls back to the top level of the matrix
+GROUP_DEFAULTS = {
+    'precisions' : ['FP16'],
+    'cores'      : ['CUDA'],
+    'surgery'    : [None],
+}
+
+# Memory estimate of one job of each kind in MiB, "memory_mb" of the matrix overrides them
+JOB_MEMORY_MB = {
+    'export'  : 3072,
+    'surgery' : 1024,
+    'build'   : 4096,
+}
+
+# Job states
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+class Job(object):
+    def __init__(self, name, kind, cmd, deps=(), memory_mb=0, outputs=()):
+        self.name = name
+        self.kind = kind
+        self.cmd = cmd
+        self.deps = list(deps)
+        self.memory_mb = memory_mb
+        self.outputs = list(outputs)
+        self.status = PENDING
+        self.start = None
+        self.seconds = 0.0
+        self.error = None
+
+# Function for the surgery jsons of a matrix entry, None or "" is no request
+def _surgery_jsons(surgery):
+    if not surgery:
+        return []
+    return [surgery] if isinstance(surgery, str) else list(surgery)
+
+# Function for expanding a declarative build matrix into deduplicated jobs
+def expand_matrix(matrix):
+    """The matrix is a dict with the defaults of its "builds" groups:
+        {"models_dir": "models", "calib_dataset": "calib_database", "cache_dir": "models/cache", "specialize": true,
+         "exporter": "traced",
+         "precisions": ["INT8"], "surgery": [null, "tools/onnx/graph/surgery/add_batchedNMSPlugin.json"],
+         "builds": [{"models": ["yolov4-608"], "batches": [[4, 4, 4], [4, 6, 8]], "cores": ["CUDA", "DLA0"]}]}
+    Every group builds models x batches x precisions x cores x surgery.
+    [B, B, B] batches use the static batch B export, the others the dynamic one.
+    One export job per model serves all of its batches, one surgery job per
+    (ONNX, jsons) serves the builds of every core and precision.
+    "exporter": "direct" writes the exports with darknet_to_onnx.py without torch,
+    "cache_dir" and "specialize" apply to the "traced" exports of yolo_to_onnx.py.
+    # Returns
+        jobs: list of Job in dependency order
+    """
+    models_dir = matrix.get('models_dir', 'models')
+    onnx_dir = 'models/onnx'
+    calib_dataset = matrix.get('calib_dataset', 'calib_database')
+    memory_mb = dict(JOB_MEMORY_MB, **matrix.get('memory_mb', {}))
+    python = matrix.get('python', sys.executable)
+    # ArtifactCache of the exports and surgery outputs, unchanged inputs are not converted again
+    cache = ['--cache_dir', matrix['cache_dir']] if matrix.get('cache_dir') else []
+    # Static batches rewritten from the traced dynamic batch export instead of traced one by one
+    specialize = ['--specialize'] if matrix.get('specialize') else []
+    # "direct" builds the exports from the cfg and weights without torch (darknet_to_onnx.py)
+    direct = matrix.get('exporter', 'traced') == 'direct'
+
+    exports = {}    # model -> {batch size: ONNX file}
+    surgeries = {}  # (onnx file, jsons) -> Job
+    builds = {}     # engine name -> Job
+    for group in matrix['builds']:
+        keys = ['models', 'batches', 'precisions', 'cores', 'surgery']
+        values = [group.get(key, matrix.get(key, GROUP_DEFAULTS.get(key))) for key in keys]
+        for key, value in zip(keys, values):
+            if value is None:
+                raise ValueError('ERROR: build group %s has no "%s"!' % (group, key))
+        for model, batch, precision, core, surgery in itertools.product(*values):
+            batch = [int(b) for b in batch]
+            dynamic = batch[0] != batch[2]
+            if dynamic and 'DLA' in core:
+                raise ValueError('ERROR: %s %s, for DLA batch should be ( MIN == OPT == MAX)!' % (model, core))
+            net = Darknet_cfg().parse_cfg(os.path.join(models_dir, model + '.cfg'))[0]
+            export_batch = -1 if dynamic else batch[2]
+            onnx_file = os.path.join(onnx_dir, get_onnx_file_name(
+                model + '.weights', int(net['height']), int(net['width']), export_batch))
+            exports.setdefault(model, {})[export_batch] = onnx_file
+
+            # Same naming as GraphSurgery and onnx_to_trt.py, with the requests in the surgery output
+            jsons = _surgery_jsons(surgery)
+            onnx_name = onnx_file.split('.onnx')[0]
+            key = (onnx_file, tuple(jsons))
+            if key not in surgeries:
+                stems = ''.join('_' + os.path.basename(j).split('.json')[0] for j in jsons)
+                tuned_file = onnx_name + stems + '_tuned.onnx'
+                cmd = [python, 'onnx_to_trt.py', '-i', onnx_file, '-b'] + [str(b) for b in batch] + \
+                      ['-t', tuned_file, '--surgery_only'] + cache
+                if jsons:
+                    cmd += ['-j'] + jsons
+                surgeries[key] = Job('surgery:' + os.path.basename(tuned_file).split('.onnx')[0], 'surgery', cmd,
+                                     ['export:' + model], memory_mb['surgery'], [tuned_file])
+
+            engine_name = os.path.basename(onnx_name) + '_' + core + '_' + precision + ('.gs' if jsons else '')
+            cmd = [python, 'onnx_to_trt.py', '-i', onnx_file, '-p', precision, '-c', calib_dataset, '-g', core,
+                   '-b'] + [str(b) for b in batch] + ['-t', surgeries[key].outputs[0], '--skip_surgery']
+            if jsons:
+                cmd += ['-j'] + jsons
+            if matrix.get('verbose', False):
+                cmd.append('-v')
+            if engine_name in builds:
+                # The same build listed by several groups, different builds must not overwrite one engine
+                if builds[engine_name].cmd != cmd:
+                    raise ValueError('ERROR: builds of %s differ (%s)!' % (engine_name, ' '.join(cmd)))
+                continue
+            builds[engine_name] = Job('build:' + engine_name, 'build', cmd, [surgeries[key].name],
+                                      memory_mb['build'], ['trt_output/engine/' + engine_name + '.trt'])
+
+    jobs = []
+    for model, onnx_files in exports.items():
+        batches = sorted(onnx_files, reverse=True)
+        # One process loads the weights once for all batch sizes (yolo_to_onnx.py writes to models/onnx/)
+        cmd = [python, 'darknet_to_onnx.py' if direct else 'yolo_to_onnx.py',
+               '-m', os.path.join(models_dir, model + '.weights'),
+               '-c', os.path.join(models_dir, model + '.cfg'), '-b'] + [str(b) for b in batches]
+        cmd += ['-o', onnx_dir + '/'] if direct else cache + specialize
+        jobs.append(Job('export:' + model, 'export', cmd, [], memory_mb['export'],
+                        [onnx_files[b] for b in batches]))
+    return jobs + list(surgeries.values()) + list(builds.values())
+
+# Function for the memory available to new processes in MiB
+def available_memory_mb():
+    try:
+        with open('/proc/meminfo') as fp:
+            for line in fp:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 2.0 ** 20
+
+# Function for running the command of a job, the output goes to its log file
+def run_command(job, log_dir=None):
+    if log_dir is None:
+        subprocess.run(job.cmd, check=True)
+        return
+    os.makedirs(log_dir, exist_ok=True)
+    log_file = os.path.join(log_dir, job.name.replace(':', '_') + '.log')
+    with open(log_file, 'w') as fp:
+        result = subprocess.run(job.cmd, stdout=fp, stderr=subprocess.STDOUT)
+    if result.returncode != 0:
+        raise RuntimeError('exit code %d, see %s' % (result.returncode, log_file))
+
+# Runner of the scheduler tests on CPU, sleeps instead of running the commands
+class MockRunner(object):
+    """seconds: dict of the simulated duration per job kind,
+    fail: substring of the job names that fail."""
+    def __init__(self, seconds=None, fail=None, jitter=0.2, seed=0):
+        self.seconds = dict({'export': 0.2, 'surgery': 0.05, 'build': 0.5}, **(seconds or {}))
+        self.fail = fail
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def __call__(self, job):
+        with self.lock:
+            scale = 1.0 + self.jitter * (2 * self.random.random() - 1)
+        time.sleep(self.seconds[job.kind] * scale)
+        if self.fail and self.fail in job.name:
+            raise RuntimeError('mock failure')
+
+# Runs the jobs in dependency order on a worker pool bounded by memory
+class Scheduler(object):
+    """A job starts when its dependencies are done, a worker is free and its
+    memory estimate fits into the budget next to the running jobs. The first
+    job always starts, so a job larger than the budget still runs (alone).
+    Dependents of a failed job are skipped, not run against stale outputs.
+    """
+    def __init__(self, jobs, runner, max_workers=2, memory_budget_mb=None):
+        self.jobs = jobs
+        self.runner = runner
+        self.max_workers = max_workers
+        self.memory_budget_mb = memory_budget_mb if memory_budget_mb is not None else 0.8 * available_memory_mb()
+        self.by_name = dict((job.name, job) for job in jobs)
+        for job in jobs:
+            for dep in job.deps:
+                if dep not in self.by_name:
+                    raise ValueError('ERROR: %s depends on the unknown job %s!' % (job.name, dep))
+        self.cond = threading.Condition()
+        self.peak_memory_mb = 0
+        self.peak_workers = 0
+
+    def _work(self, job):
+        try:
+            self.runner(job)
+            status = DONE
+        except Exception as e:
+            job.error = str(e)
+            status = FAILED
+        with self.cond:
+            job.seconds = time.time() - job.start
+            job.status = status
+            self.cond.notify_all()
+
+    def _ready(self, job):
+        return job.status == PENDING and all(self.by_name[dep].status == DONE for dep in job.deps)
+
+    def run(self):
+        t = time.time()
+        with self.cond:
+            while True:
+                # Skip everything downstream of a failure
+                for job in self.jobs:
+                    if job.status == PENDING and any(self.by_name[dep].status in (FAILED, SKIPPED) for dep in job.deps):
+                        job.status = SKIPPED
+                running = [job for job in self.jobs if job.status == RUNNING]
+                used_mb = sum(job.memory_mb for job in running)
+                for job in self.jobs:
+                    if len(running) >= self.max_workers:
+                        break
+                    if self._ready(job) and (not running or used_mb + job.memory_mb <= self.memory_budget_mb):
+                        job.status = RUNNING
+                        job.start = time.time()
+                        running.append(job)
+                        used_mb += job.memory_mb
+                        threading.Thread(target=self._work, args=(job, ), name=job.name, daemon=True).start()
+                self.peak_memory_mb = max(self.peak_memory_mb, used_mb)
+                self.peak_workers = max(self.peak_workers, len(running))
+                if not running:
+                    break
+                self.cond.wait()
+        return time.time() - t
+
+    def print_report(self, seconds=None):
+        print('%-64s %-8s %-8s %10s %10s' % ('job', 'kind', 'status', 'start(s)', 'time(s)'))
+        origin = min([job.start for job in self.jobs if job.start is not None] or [0])
+        for job in self.jobs:
+            print('%-64s %-8s %-8s %10s %10.1f%s' % (
+                job.name, job.kind, job.status, '%.1f' % (job.start - origin) if job.start else '-', job.seconds,
+                '  ' + job.error if job.error else ''))
+        counts = dict((status, sum(job.status == status for job in self.jobs))
+                      for status in (DONE, FAILED, SKIPPED, PENDING))
+        serial = sum(job.seconds for job in self.jobs)
+        print('%d jobs: %d done, %d failed, %d skipped' % (len(self.jobs), counts[DONE], counts[FAILED], counts[SKIPPED]))
+        if seconds:
+            print('wall %.1f s for %.1f s of jobs, peak %d workers and %.0f MiB of %.0f MiB budget' % (
+                seconds, serial, self.peak_workers, self.peak_memory_mb, self.memory_budget_mb))
+
+    def write_report(self, json_file):
+        with open(json_file, 'w') as fp:
+            json.dump([{'name': job.name, 'kind': job.kind, 'status': job.status, 'start': job.start,
+                        'seconds': job.seconds, 'error': job.error, 'cmd': job.cmd, 'deps': job.deps,
+                        'outputs': job.outputs} for job in self.jobs], fp, indent=2)
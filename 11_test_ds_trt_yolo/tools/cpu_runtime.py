@@ -0,0 +1,100 @@
+# cpu_runtime.py
+
+#############################################################################
+#  Copyright (c) 2021, NVIDIA CORPORATION. All rights reserved.             #
+#                                                                           #
+#  Licensed under the Apache License, Version 2.0 (the "License");          #
+#  you may not use this file except in compliance with the License.         #
+#  You may obtain a copy of the License at                                  #
+#                                                                           #
+#      http://www.apache.org/licenses/LICENSE-2.0                           #
+#                                                                           #
+#  Unless required by applicable law or agreed to in writing, software      #
+#  distributed under the License is distributed on an "AS IS" BASIS,        #
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+#  See the License for the specific language governing permissions and      #
+#  limitations under the License.                                           #
+#############################################################################
+
+import io
+import warnings
+from contextlib import redirect_stdout
+
+import torch
+
+from tools.onnx.net.darknet import Darknet
+
+RUNTIME_MODES = ['eager', 'torchscript']
+
+# Function for the torch CPU thread pools, 0 keeps the torch default
+def set_cpu_threads(intra_op_threads=0, inter_op_threads=0):
+    if intra_op_threads > 0:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads > 0:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError:
+            # Only possible before the first inter-op parallel work of the process
+            print('WARNING: inter-op threads are already set to %d' % torch.get_num_interop_threads())
+
+# Input and output description like onnxruntime.NodeArg
+class RuntimeArg(object):
+    def __init__(self, name, shape, type='tensor(float)'):
+        self.name = name
+        self.shape = shape
+        self.type = type
+
+# CPU inference of a Darknet model behind the onnxruntime.InferenceSession interface
+class DarknetSession(object):
+    """Drop-in for the sessions of detect_batch() and onnx_stream.py on hosts without TensorRT.
+    mode='torchscript' traces the fused model once per input shape and freezes it,
+    mode='eager' runs Darknet.forward() as it is.
+    """
+    def __init__(self, config_file, model_file=None, batch_size=-1, mode='torchscript', compact=False,
+                 intra_op_threads=0, inter_op_threads=0, weights_cache=False):
+        if mode not in RUNTIME_MODES:
+            raise ValueError('ERROR: unknown runtime mode %s, use one of %s!' % (mode, RUNTIME_MODES))
+        set_cpu_threads(intra_op_threads, inter_op_threads)
+        with redirect_stdout(io.StringIO()):
+            self.model = Darknet(config_file).eval()
+            if model_file:
+                self.model.load_weights(model_file, cache=weights_cache)
+        self.model.fuse_conv_bn()
+        output_names = ['boxes', 'confs']
+        if compact:
+            self.model.set_compact_output(True)
+            output_names = ['boxes', 'scores', 'classes']
+        self.mode = mode
+        # Frozen TorchScript modules by input shape, the traced Yolo decode is specialized to it
+        self.scripted = {}
+
+        batch = batch_size if batch_size > 0 else 'batch_size'
+        self.inputs = [RuntimeArg('input', [batch, 3, self.model.height, self.model.width])]
+        self.outputs = [RuntimeArg(name, [batch]) for name in output_names]
+
+    def get_inputs(self):
+        return self.inputs
+
+    def get_outputs(self):
+        return self.outputs
+
+    # Function for the frozen TorchScript module of an input shape
+    def get_scripted(self, x):
+        key = tuple(x.shape)
+        if key not in self.scripted:
+            with warnings.catch_warnings():
+                # The traced shapes are the constants of this input shape on purpose
+                warnings.simplefilter('ignore')
+                traced = torch.jit.trace(self.model, x, check_trace=False, strict=False)
+                self.scripted[key] = torch.jit.freeze(traced.eval())
+        return self.scripted[key]
+
+    def run(self, output_names, input_feed):
+        x = torch.from_numpy(input_feed[self.inputs[0].name])
+        with torch.no_grad():
+            if self.mode == 'torchscript':
+                outputs = self.get_scripted(x)(x)
+            else:
+                outputs = self.model(x)
+        names = [output.name for output in self.outputs]
+        return [outputs[names.index(name)].numpy() for name in (output_names or names)]
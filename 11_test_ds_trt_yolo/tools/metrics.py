@@ -0,0 +1,130 @@
+# metrics.py
+
+#############################################################################
+#  Copyright (c) 2021, NVIDIA CORPORATION. All rights reserved.             #
+#                                                                           #
+#  Licensed under the Apache License, Version 2.0 (the "License");          #
+#  you may not use this file except in compliance with the License.         #
+#  You may obtain a copy of the License at                                  #
+#                                                                           #
+#      http://www.apache.org/licenses/LICENSE-2.0                           #
+#                                                                           #
+#  Unless required by applicable law or agreed to in writing, software      #
+#  distributed under the License is distributed on an "AS IS" BASIS,        #
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+#  See the License for the specific language governing permissions and      #
+#  limitations under the License.                                           #
+#############################################################################
+
+import json
+import time
+import threading
+import numpy as np
+
+from collections import deque
+from contextlib import contextmanager
+
+# Latency samples of one stage, the newest max_samples are kept for the percentiles
+class LatencyStats(object):
+    def __init__(self, max_samples=10000):
+        self.samples = deque(maxlen=max_samples)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def summary(self):
+        if self.count == 0:
+            return {'count': 0}
+        p50, p95, p99 = np.percentile(np.fromiter(self.samples, dtype=np.float64), [50, 95, 99])
+        return {
+            'count'   : self.count,
+            'mean_ms' : self.total / self.count * 1000,
+            'p50_ms'  : p50 * 1000,
+            'p95_ms'  : p95 * 1000,
+            'p99_ms'  : p99 * 1000,
+            'max_ms'  : self.max * 1000,
+        }
+
+# A registry of per-stage latencies and counters
+class MetricsRegistry(object):
+    """MetricsRegistry
+    Stages report latencies with observe() or timer(), counts with increment().
+    Every record is also passed to the registered callbacks as
+    callback(kind, name, value) with kind 'latency' (seconds) or 'counter'.
+    """
+
+    def __init__(self, max_samples=10000):
+        self.max_samples = max_samples
+        self.latencies = {}
+        self.counters = {}
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        self.callbacks.remove(callback)
+
+    def observe(self, name, seconds):
+        with self.lock:
+            if name not in self.latencies:
+                self.latencies[name] = LatencyStats(self.max_samples)
+            self.latencies[name].observe(seconds)
+        for callback in self.callbacks:
+            callback('latency', name, seconds)
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+        for callback in self.callbacks:
+            callback('counter', name, value)
+
+    @contextmanager
+    def timer(self, name):
+        t = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - t)
+
+    def reset(self):
+        with self.lock:
+            self.latencies = {}
+            self.counters = {}
+
+    def summary(self):
+        with self.lock:
+            return {
+                'latency'  : {name: stats.summary() for name, stats in self.latencies.items()},
+                'counters' : dict(self.counters),
+            }
+
+    def to_json(self, json_file=None):
+        stats = json.dumps(self.summary(), indent=2)
+        if json_file:
+            with open(json_file, 'w') as fp:
+                fp.write(stats)
+        return stats
+
+    def print_summary(self):
+        summary = self.summary()
+        print('%-32s %8s %9s %9s %9s %9s' % ('stage', 'count', 'p50(ms)', 'p95(ms)', 'p99(ms)', 'max(ms)'))
+        for name, stats in sorted(summary['latency'].items()):
+            if stats['count'] > 0:
+                print('%-32s %8d %9.3f %9.3f %9.3f %9.3f' % (
+                    name, stats['count'], stats['p50_ms'], stats['p95_ms'], stats['p99_ms'], stats['max_ms']))
+        for name, value in sorted(summary['counters'].items()):
+            print('%-32s %8d' % (name, value))
+
+# Default registry used by post_processing and do_inference
+_registry = MetricsRegistry()
+
+def get_metrics():
+    return _registry
@@ -16,38 +16,53 @@
 #  limitations under the License.                                           #
 #############################################################################
 
-from torch import from_numpy
+import torch.nn as nn
+from torch import from_numpy, no_grad, rsqrt
+
+# Function for pointing a parameter or buffer at buf[start:start + num] without a copy,
+# buf may be a np.memmap so that the weights stay in the page cache of the file
+def load_tensor(buf, start, module, name):
+    tensor = getattr(module, name)
+    num = tensor.numel()
+    value = from_numpy(buf[start:start + num]).view(tensor.shape)
+    if tensor.device.type != 'cpu' or tensor.dtype != value.dtype:
+        tensor.data.copy_(value)
+    elif name in module._parameters:
+        tensor.data = value
+    else:
+        module._buffers[name] = value
+    return start + num
 
 def load_conv(buf, start, conv_model):
-    num_w = conv_model.weight.numel()
-    num_b = conv_model.bias.numel()
-    conv_model.bias.data.copy_(from_numpy(buf[start:start + num_b]));
-    start = start + num_b
-    conv_model.weight.data.copy_(from_numpy(buf[start:start + num_w]).reshape(conv_model.weight.data.shape));
-    start = start + num_w
+    start = load_tensor(buf, start, conv_model, 'bias')
+    start = load_tensor(buf, start, conv_model, 'weight')
     return start
 
 def load_conv_bn(buf, start, conv_model, bn_model):
-    num_w = conv_model.weight.numel()
-    num_b = bn_model.bias.numel()
-    bn_model.bias.data.copy_(from_numpy(buf[start:start + num_b]));
-    start = start + num_b
-    bn_model.weight.data.copy_(from_numpy(buf[start:start + num_b]));
-    start = start + num_b
-    bn_model.running_mean.copy_(from_numpy(buf[start:start + num_b]));
-    start = start + num_b
-    bn_model.running_var.copy_(from_numpy(buf[start:start + num_b]));
-    start = start + num_b
-    conv_model.weight.data.copy_(from_numpy(buf[start:start + num_w]).reshape(conv_model.weight.data.shape));
-    start = start + num_w
+    start = load_tensor(buf, start, bn_model, 'bias')
+    start = load_tensor(buf, start, bn_model, 'weight')
+    start = load_tensor(buf, start, bn_model, 'running_mean')
+    start = load_tensor(buf, start, bn_model, 'running_var')
+    start = load_tensor(buf, start, conv_model, 'weight')
     return start
 
 def load_fc(buf, start, fc_model):
-    num_w = fc_model.weight.numel()
-    num_b = fc_model.bias.numel()
-    fc_model.bias.data.copy_(from_numpy(buf[start:start + num_b]));
-    start = start + num_b
-    fc_model.weight.data.copy_(from_numpy(buf[start:start + num_w]));
-    start = start + num_w
+    start = load_tensor(buf, start, fc_model, 'bias')
+    start = load_tensor(buf, start, fc_model, 'weight')
     return start
 
+# Function for folding an eval mode BatchNorm2d into the preceding Conv2d
+def fuse_conv_bn(conv_model, bn_model):
+    """Returns a new Conv2d with bias computing bn_model(conv_model(x))."""
+    fused = nn.Conv2d(conv_model.in_channels, conv_model.out_channels, conv_model.kernel_size,
+                      conv_model.stride, conv_model.padding, conv_model.dilation, conv_model.groups, bias=True)
+    with no_grad():
+        # Computed in float64, the folded weights are rounded only once
+        scale = bn_model.weight.double() * rsqrt(bn_model.running_var.double() + bn_model.eps)
+        weight = conv_model.weight.double() * scale.reshape(-1, 1, 1, 1)
+        bias = bn_model.bias.double() - bn_model.running_mean.double() * scale
+        if conv_model.bias is not None:
+            bias = bias + conv_model.bias.double() * scale
+        fused.weight.copy_(weight)
+        fused.bias.copy_(bias)
+    return fused.to(conv_model.weight.device)
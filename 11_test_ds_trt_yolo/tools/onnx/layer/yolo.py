@@ -16,145 +16,77 @@
 #  limitations under the License.                                           #
 #############################################################################
 
+import torch
 import torch.nn as nn
-from torch import cat, sigmoid, exp, tensor, float32 
+from torch import cat, sigmoid, exp
 import numpy as np
 
+# Function for the decode constants of one Yolo layer, normalized to [0, 1]
+def yolo_decode_constants(H, W, anchors, num_anchors, scale_x_y, device=None, dtype=torch.float32):
+    """
+    # Returns
+        grid:       [1, 1, 2, H, W] C-x / W, C-y / H with the scale_x_y offset folded in
+        grid_scale: [1, 1, 2, 1, 1] scale_x_y / W, scale_x_y / H
+        anchor_wh:  [1, num_anchors, 2, 1, 1] P-w / W, P-h / H
+    """
+    # Built with numpy, so that they are plain constants of a traced graph
+    size = np.array([W, H], dtype=np.float64).reshape(1, 1, 2, 1, 1)
+    grid_y, grid_x = np.meshgrid(np.arange(H), np.arange(W), indexing='ij')
+    grid = (np.stack((grid_x, grid_y)).reshape(1, 1, 2, H, W) - 0.5 * (scale_x_y - 1)) / size
+    grid_scale = scale_x_y / size
+    anchor_wh = np.array(anchors[:num_anchors * 2], dtype=np.float64).reshape(1, num_anchors, 2, 1, 1) / size
+    return tuple(torch.tensor(a, device=device, dtype=dtype) for a in (grid, grid_scale, anchor_wh))
+
 def yolo_forward_dynamic(output, conf_thresh, num_classes, anchors, num_anchors, \
-                            scale_x_y, only_objectness=1, validation=False):
+                            scale_x_y, only_objectness=1, validation=False, constants=None,
+                            compact=False, compact_thresh=None):
     # Output would be invalid if it does not satisfy this assert
     # assert (output.size(1) == (5 + num_classes) * num_anchors)
 
-    # print(output.size())
-
-    # Slice the second dimension (channel) of output into:
-    # [ 2, 2, 1, num_classes, 2, 2, 1, num_classes, 2, 2, 1, num_classes ]
-    # And then into
-    # bxy = [ 6 ] bwh = [ 6 ] det_conf = [ 3 ] cls_conf = [ num_classes * 3 ]
-    # batch = output.size(0)
-    # H = output.size(2)
-    # W = output.size(3)
-
-    bxy_list = []
-    bwh_list = []
-    det_confs_list = []
-    cls_confs_list = []
-
-    for i in range(num_anchors):
-        begin = i * (5 + num_classes)
-        end = (i + 1) * (5 + num_classes)
-        
-        bxy_list.append(output[:, begin : begin + 2])
-        bwh_list.append(output[:, begin + 2 : begin + 4])
-        det_confs_list.append(output[:, begin + 4 : begin + 5])
-        cls_confs_list.append(output[:, begin + 5 : end])
-
-    # Shape: [batch, num_anchors * 2, H, W]
-    bxy = cat(bxy_list, dim=1)
-    # Shape: [batch, num_anchors * 2, H, W]
-    bwh = cat(bwh_list, dim=1)
-
-    # Shape: [batch, num_anchors, H, W]
-    det_confs = cat(det_confs_list, dim=1)
-    # Shape: [batch, num_anchors * H * W]
-    det_confs = det_confs.view(output.size(0), num_anchors * output.size(2) * output.size(3))
-
-    # Shape: [batch, num_anchors * num_classes, H, W]
-    cls_confs = cat(cls_confs_list, dim=1)
-    # Shape: [batch, num_anchors, num_classes, H * W]
-    cls_confs = cls_confs.view(output.size(0), num_anchors, num_classes, output.size(2) * output.size(3))
-    # Shape: [batch, num_anchors, num_classes, H * W] --> [batch, num_anchors * H * W, num_classes] 
-    cls_confs = cls_confs.permute(0, 1, 3, 2).reshape(output.size(0), num_anchors * output.size(2) * output.size(3), num_classes)
-
-    # Apply sigmoid(), exp() and softmax() to slices
-    #
-    bxy = sigmoid(bxy) * scale_x_y - 0.5 * (scale_x_y - 1)
-    bwh = exp(bwh)
-    det_confs = sigmoid(det_confs)
-    cls_confs = sigmoid(cls_confs)
-
-    # Prepare C-x, C-y, P-w, P-h (None of them are torch related)
-    grid_x = np.expand_dims(np.expand_dims(np.expand_dims(np.linspace(0, output.size(3) - 1, output.size(3)), axis=0).repeat(output.size(2), 0), axis=0), axis=0)
-    grid_y = np.expand_dims(np.expand_dims(np.expand_dims(np.linspace(0, output.size(2) - 1, output.size(2)), axis=1).repeat(output.size(3), 1), axis=0), axis=0)
-    # grid_x = torch.linspace(0, W - 1, W).reshape(1, 1, 1, W).repeat(1, 1, H, 1)
-    # grid_y = torch.linspace(0, H - 1, H).reshape(1, 1, H, 1).repeat(1, 1, 1, W)
-
-    anchor_w = []
-    anchor_h = []
-    for i in range(num_anchors):
-        anchor_w.append(anchors[i * 2])
-        anchor_h.append(anchors[i * 2 + 1])
-
-    device = None
-    cuda_check = output.is_cuda
-    if cuda_check:
-        device = output.get_device()
-
-    bx_list = []
-    by_list = []
-    bw_list = []
-    bh_list = []
-
-    # Apply C-x, C-y, P-w, P-h
-    for i in range(num_anchors):
-        ii = i * 2
-        # Shape: [batch, 1, H, W]
-        bx = bxy[:, ii : ii + 1] + tensor(grid_x, device=device, dtype=float32)
-        # Shape: [batch, 1, H, W]
-        by = bxy[:, ii + 1 : ii + 2] + tensor(grid_y, device=device, dtype=float32)
-        # Shape: [batch, 1, H, W]
-        bw = bwh[:, ii : ii + 1] * anchor_w[i]
-        # Shape: [batch, 1, H, W]
-        bh = bwh[:, ii + 1 : ii + 2] * anchor_h[i]
-
-        bx_list.append(bx)
-        by_list.append(by)
-        bw_list.append(bw)
-        bh_list.append(bh)
+    # The spatial size is static in the exported models, only the batch stays dynamic (-1)
+    H = int(output.size(2))
+    W = int(output.size(3))
+    if constants is None:
+        constants = yolo_decode_constants(H, W, anchors, num_anchors, scale_x_y, output.device, output.dtype)
+    grid, grid_scale, anchor_wh = constants
+
+    # Shape: [batch, num_anchors * (5 + num_classes), H, W] --> [batch, num_anchors, 5 + num_classes, H, W]
+    # Channels of every anchor: [ x, y, w, h, det_conf, cls_conf * num_classes ]
+    output = output.view(-1, num_anchors, 5 + num_classes, H, W)
 
+    # Apply sigmoid(), exp() and C-x, C-y, P-w, P-h, normalized to [0, 1]
+    # Shape: [batch, num_anchors, 2, H, W]
+    bxy = sigmoid(output[:, :, 0:2]) * grid_scale + grid
+    bwh = exp(output[:, :, 2:4]) * anchor_wh
 
     ########################################
     #   Figure out bboxes from slices     #
     ########################################
-    
-    # Shape: [batch, num_anchors, H, W]
-    bx = cat(bx_list, dim=1)
-    # Shape: [batch, num_anchors, H, W]
-    by = cat(by_list, dim=1)
-    # Shape: [batch, num_anchors, H, W]
-    bw = cat(bw_list, dim=1)
-    # Shape: [batch, num_anchors, H, W]
-    bh = cat(bh_list, dim=1)
-
-    # Shape: [batch, 2 * num_anchors, H, W]
-    bx_bw = cat((bx, bw), dim=1)
-    # Shape: [batch, 2 * num_anchors, H, W]
-    by_bh = cat((by, bh), dim=1)
-
-    # normalize coordinates to [0, 1]
-    bx_bw /= output.size(3)
-    by_bh /= output.size(2)
-
-    # Shape: [batch, num_anchors * H * W, 1]
-    bx = bx_bw[:, :num_anchors].view(output.size(0), num_anchors * output.size(2) * output.size(3), 1)
-    by = by_bh[:, :num_anchors].view(output.size(0), num_anchors * output.size(2) * output.size(3), 1)
-    bw = bx_bw[:, num_anchors:].view(output.size(0), num_anchors * output.size(2) * output.size(3), 1)
-    bh = by_bh[:, num_anchors:].view(output.size(0), num_anchors * output.size(2) * output.size(3), 1)
-
-    bx1 = bx - bw * 0.5
-    by1 = by - bh * 0.5
-    bx2 = bx1 + bw
-    by2 = by1 + bh
-
-    # Shape: [batch, num_anchors * h * w, 4] -> [batch, num_anchors * h * w, 1, 4]
-    boxes = cat((bx1, by1, bx2, by2), dim=2).view(output.size(0), num_anchors * output.size(2) * output.size(3), 1, 4)
-    # boxes = boxes.repeat(1, 1, num_classes, 1)
-
-    # boxes:     [batch, num_anchors * H * W, 1, 4]
-    # cls_confs: [batch, num_anchors * H * W, num_classes]
-    # det_confs: [batch, num_anchors * H * W]
-    det_confs = det_confs.view(output.size(0), num_anchors * output.size(2) * output.size(3), 1)
-    confs = cls_confs * det_confs
+
+    bxy1 = bxy - bwh * 0.5
+    bxy2 = bxy1 + bwh
+
+    # Shape: [batch, num_anchors, 4, H, W] -> [batch, num_anchors * H * W, 1, 4]
+    boxes = cat((bxy1, bxy2), dim=2).permute(0, 1, 3, 4, 2).reshape(-1, num_anchors * H * W, 1, 4)
+
+    if compact:
+        # Top-1 class only, sigmoid() is monotonic so the argmax of the logits is the best class
+        # Shape: [batch, num_anchors, H, W] -> [batch, num_anchors * H * W]
+        cls_logit, cls_id = output[:, :, 5:].max(dim=2)
+        scores = (sigmoid(cls_logit) * sigmoid(output[:, :, 4])).reshape(-1, num_anchors * H * W)
+        classes = cls_id.int().reshape(-1, num_anchors * H * W)
+        if compact_thresh is not None:
+            # Scores below the threshold are set to 0
+            scores = scores * (scores > compact_thresh).to(scores.dtype)
+
+        # boxes:   [batch, num_anchors * H * W, 4]
+        # scores:  [batch, num_anchors * H * W]
+        # classes: [batch, num_anchors * H * W] int32
+        return boxes.view(-1, num_anchors * H * W, 4), scores, classes
+
+    # Shape: [batch, num_anchors, num_classes, H, W] -> [batch, num_anchors * H * W, num_classes]
+    confs = sigmoid(output[:, :, 5:]) * sigmoid(output[:, :, 4:5])
+    confs = confs.permute(0, 1, 3, 4, 2).reshape(-1, num_anchors * H * W, num_classes)
 
     # boxes: [batch, num_anchors * H * W, 1, 4]
     # confs: [batch, num_anchors * H * W, num_classes]
@@ -165,6 +97,8 @@ class Yolo(nn.Module):
     ''' Yolo layer
     model_out: while inference,is post-processing inside or outside the model
         true:outside
+    compact: output the top-1 score and class of every box instead of all class confs,
+        compact_thresh (if not None) sets the scores below it to 0
     '''
     def __init__(self, anchor_mask=[], num_classes=0, anchors=[], num_anchors=1, stride=32, model_out=False):
         super(Yolo, self).__init__()
@@ -183,14 +117,33 @@ class Yolo(nn.Module):
         self.scale_x_y = 1
 
         self.model_out = model_out
+        self.compact = False
+        self.compact_thresh = None
+
+        # Decode constants, rebuilt only when the key (H, W, device, dtype, anchors) changes
+        self.constants_key = None
+        self.register_buffer('grid', torch.empty(0), persistent=False)
+        self.register_buffer('grid_scale', torch.empty(0), persistent=False)
+        self.register_buffer('anchor_wh', torch.empty(0), persistent=False)
+
+    def get_decode_constants(self, output):
+        key = (int(output.size(2)), int(output.size(3)), output.device, output.dtype,
+               tuple(self.anchor_mask), tuple(self.anchors), self.stride, self.scale_x_y)
+        if key != self.constants_key:
+            masked_anchors = []
+            for m in self.anchor_mask:
+                masked_anchors += self.anchors[m * self.anchor_step:(m + 1) * self.anchor_step]
+            masked_anchors = [anchor / self.stride for anchor in masked_anchors]
+            self.grid, self.grid_scale, self.anchor_wh = yolo_decode_constants(
+                key[0], key[1], masked_anchors, len(self.anchor_mask), self.scale_x_y, output.device, output.dtype)
+            self.constants_key = key
+        return self.grid, self.grid_scale, self.anchor_wh
 
     def forward(self, output, target=None):
         if self.training:
             return output
-        masked_anchors = []
-        for m in self.anchor_mask:
-            masked_anchors += self.anchors[m * self.anchor_step:(m + 1) * self.anchor_step]
-        masked_anchors = [anchor / self.stride for anchor in masked_anchors]
 
-        return yolo_forward_dynamic(output, self.thresh, self.num_classes, masked_anchors, len(self.anchor_mask),scale_x_y=self.scale_x_y)
+        return yolo_forward_dynamic(output, self.thresh, self.num_classes, None, len(self.anchor_mask),
+                                    scale_x_y=self.scale_x_y, constants=self.get_decode_constants(output),
+                                    compact=self.compact, compact_thresh=self.compact_thresh)
 
@@ -1,5 +1,8 @@
+import os
+import json
 import torch.nn as nn
 import numpy as np
+from functools import partial
 from tools.utils import get_region_boxes
 from torch.nn.functional import relu, leaky_relu 
 from torch import IntTensor, cat, from_numpy
@@ -12,6 +15,17 @@ from tools.onnx.layer.upsample import Upsample_expand
 from tools.onnx.layer.load_layer import *
 from tools.onnx.layer.activation import Mish
 
+# Tensors of the sidecar weight cache start on 64 byte boundaries
+WEIGHTS_CACHE_ALIGN = 16
+
+# Op kinds of the compiled execution plan
+OP_MODULE = 0       # x = module(x)
+OP_ROUTE = 1        # x = outputs[layer]
+OP_ROUTE_GROUP = 2  # x = channel group of outputs[layer]
+OP_CONCAT = 3       # x = cat of outputs[layers]
+OP_SHORTCUT = 4     # x = activation(outputs[from] + outputs[ind - 1])
+OP_YOLO = 5         # boxes of module(x)
+
 # support route shortcut and reorg
 class Darknet(nn.Module):
     def __init__(self, config_file, inference=False):
@@ -33,77 +47,141 @@ class Darknet(nn.Module):
 
         self.header = IntTensor([0, 0, 0, 0])
         self.seen = 0
+        self.fused = False
 
-    def forward(self, x):
-        ind = -2
-        self.loss = None
-        outputs = dict()
-        out_boxes = []
-        for block in self.blocks:
-            ind = ind + 1
+        # Execution plan of forward(), call compile_plan() again after replacing modules
+        self.plan = self.compile_plan()
+        # DarknetProfiler timing the route/shortcut/yolo steps, see profile()
+        self.profiler = None
 
-            if block['type'] == 'net':
-                continue
-            elif block['type'] in ['convolutional', 'maxpool', 'reorg', 'upsample', 'avgpool', 'softmax', 'connected']:
-                print("INDEX : %d"%ind)
-                x = self.models[ind](x)
-                outputs[ind] = x
+    # Function for the layer outputs that a route or shortcut block reads back
+    def get_layer_inputs(self, ind, block):
+        if block['type'] == 'route':
+            layers = block['layers'].split(',')
+            return [int(i) if int(i) > 0 else int(i) + ind for i in layers]
+        elif block['type'] == 'shortcut':
+            from_layer = int(block['from'])
+            return [from_layer if from_layer > 0 else from_layer + ind, ind - 1]
+        return []
+
+    # Function for the liveness of the layer outputs kept by forward()
+    def plan_liveness(self, blocks):
+        """Every output is dropped right after its last route/shortcut consumer,
+        outputs that are never read back are dropped right after their layer.
+        # Returns
+            release_after: list, release_after[ind] are the outputs dead after layer ind
+        """
+        num_layers = len(blocks) - 1
+        last_use = list(range(num_layers))
+        for ind, block in enumerate(blocks[1:]):
+            for layer in self.get_layer_inputs(ind, block):
+                last_use[layer] = max(last_use[layer], ind)
+        release_after = [[] for _ in range(num_layers)]
+        for layer, ind in enumerate(last_use):
+            release_after[ind].append(layer)
+        return release_after
+
+    # Function for compiling the blocks once into the execution plan of forward()
+    def compile_plan(self, keep_all=False):
+        """Resolve the cfg strings once, forward() then only runs the plan.
+        # Args
+            keep_all: keep every layer output for the whole pass (no liveness)
+        # Returns
+            plan: list of (op, ind, module, inputs, arg, store, release)
+                op:      one of the OP_* kinds
+                inputs:  resolved layers read by a route or shortcut
+                arg:     (groups, group_id) of OP_ROUTE_GROUP, activation of OP_SHORTCUT
+                store:   keep the output in outputs for a later route or shortcut
+                release: outputs dead after this layer
+        """
+        release_after = self.plan_liveness(self.blocks)
+        plan = []
+        for ind, block in enumerate(self.blocks[1:]):
+            inputs = self.get_layer_inputs(ind, block)
+            module = None
+            arg = None
+            if block['type'] in ['convolutional', 'maxpool', 'reorg', 'upsample', 'avgpool', 'softmax', 'connected']:
+                op = OP_MODULE
+                module = self.models[ind]
             elif block['type'] == 'route':
-                layers = block['layers'].split(',')
-                layers = [int(i) if int(i) > 0 else int(i) + ind for i in layers]
-                if len(layers) == 1:
+                if len(inputs) == 1:
                     if 'groups' not in block.keys() or int(block['groups']) == 1:
-                        x = outputs[layers[0]]
-                        outputs[ind] = x
+                        op = OP_ROUTE
                     else:
-                        groups = int(block['groups'])
-                        group_id = int(block['group_id'])
-                        _, b, _, _ = outputs[layers[0]].shape
-                        x = outputs[layers[0]][:, b // groups * group_id:b // groups * (group_id + 1)]
-                        outputs[ind] = x
-                elif len(layers) == 2:
-                    x1 = outputs[layers[0]]
-                    x2 = outputs[layers[1]]
-                    x = cat((x1, x2), 1)
-                    outputs[ind] = x
-                elif len(layers) == 4:
-                    x1 = outputs[layers[0]]
-                    x2 = outputs[layers[1]]
-                    x3 = outputs[layers[2]]
-                    x4 = outputs[layers[3]]
-                    x = cat((x1, x2, x3, x4), 1)
-                    outputs[ind] = x
+                        op = OP_ROUTE_GROUP
+                        arg = (int(block['groups']), int(block['group_id']))
                 else:
-                    print("rounte number > 2 ,is {}".format(len(layers)))
-
+                    op = OP_CONCAT
             elif block['type'] == 'shortcut':
-                from_layer = int(block['from'])
-                activation = block['activation']
-                from_layer = from_layer if from_layer > 0 else from_layer + ind
-                x1 = outputs[from_layer]
-                x2 = outputs[ind - 1]
-                x = x1 + x2
-                if activation == 'leaky':
-                    x = leaky_relu(x, 0.1, inplace=True)
-                elif activation == 'relu':
-                    x = relu(x, inplace=True)
-                outputs[ind] = x
-            elif block['type'] == 'region':
-                continue
-                if self.loss:
-                    self.loss = self.loss + self.models[ind](x)
-                else:
-                    self.loss = self.models[ind](x)
-                outputs[ind] = None
+                op = OP_SHORTCUT
+                if block['activation'] == 'leaky':
+                    arg = partial(leaky_relu, negative_slope=0.1, inplace=True)
+                elif block['activation'] == 'relu':
+                    arg = partial(relu, inplace=True)
             elif block['type'] == 'yolo':
-                boxes = self.models[ind](x)
-                out_boxes.append(boxes)
-            elif block['type'] == 'cost':
+                op = OP_YOLO
+                module = self.models[ind]
+            elif block['type'] in ['region', 'cost']:
                 continue
             else:
                 print('unknown type %s' % (block['type']))
+                continue
+            if keep_all:
+                plan.append((op, ind, module, inputs, arg, op != OP_YOLO, []))
+            else:
+                release = [layer for layer in release_after[ind] if layer != ind]
+                plan.append((op, ind, module, inputs, arg, ind not in release_after[ind], release))
+        return plan
+
+    def forward(self, x):
+        self.loss = None
+        outputs = dict()
+        out_boxes = []
+        profiler = self.profiler
+        for op, ind, module, inputs, arg, store, release in self.plan:
+            if op == OP_MODULE:
+                x = module(x)
+            else:
+                if profiler is not None:
+                    profiler.begin(ind)
+                if op == OP_ROUTE:
+                    x = outputs[inputs[0]]
+                elif op == OP_ROUTE_GROUP:
+                    groups, group_id = arg
+                    _, b, _, _ = outputs[inputs[0]].shape
+                    x = outputs[inputs[0]][:, b // groups * group_id:b // groups * (group_id + 1)]
+                elif op == OP_CONCAT:
+                    x = cat([outputs[layer] for layer in inputs], 1)
+                elif op == OP_SHORTCUT:
+                    x = outputs[inputs[0]] + outputs[inputs[1]]
+                    if arg is not None:
+                        x = arg(x)
+                else:
+                    out_boxes.append(module(x))
+                if profiler is not None:
+                    profiler.end(ind, out_boxes[-1] if op == OP_YOLO else x)
+            if store:
+                outputs[ind] = x
+            for layer in release:
+                outputs.pop(layer, None)
         return get_region_boxes(out_boxes)
 
+    # Function for the per-layer CPU profile of forward(x) over warm iterations
+    def profile(self, x, iterations=10, warmup=2):
+        """
+        # Returns
+            profiler: DarknetProfiler, see its report(), print_report() and write_chrome_trace()
+        """
+        from tools.onnx.net.darknet_profile import DarknetProfiler
+        return DarknetProfiler(self).run(x, iterations, warmup)
+
+    # Function for switching every Yolo layer to the compact top-1 score and class outputs
+    def set_compact_output(self, compact=True, conf_thresh=None):
+        for model in self.models:
+            if isinstance(model, Yolo):
+                model.compact = compact
+                model.compact_thresh = conf_thresh
+
     def print_network(self):
         self.darknet.print_cfg()
 
@@ -287,13 +365,92 @@ class Darknet(nn.Module):
 
         return models
 
-    def load_weights(self, model_file):
-        fp = open(model_file, 'rb')
-        header = np.fromfile(fp, count=5, dtype=np.int32)
+    # Function for folding every BatchNorm into its convolution, for inference and export after load_weights()
+    def fuse_conv_bn(self):
+        if self.fused:
+            return
+        for ind, block in enumerate(self.blocks[1:]):
+            if block['type'] == 'convolutional' and int(block['batch_normalize']):
+                # conv{id}, bn{id}[, activation{id}] -> conv{id}[, activation{id}]
+                children = list(self.models[ind].named_children())
+                fused = nn.Sequential()
+                fused.add_module(children[0][0], fuse_conv_bn(children[0][1], children[1][1]))
+                for name, module in children[2:]:
+                    fused.add_module(name, module)
+                self.models[ind] = fused
+        self.fused = True
+        self.plan = self.compile_plan()
+
+    # Function for the sidecar cache files of a weights file: the .npy blob and its .json index
+    def get_weights_cache_files(self, model_file):
+        return model_file + '.cache.npy', model_file + '.cache.json'
+
+    # Function for the float tensors kept in the weights cache, in state_dict order
+    def get_cached_tensors(self):
+        return [(name, t) for name, t in self.state_dict(keep_vars=True).items() if t.dtype.is_floating_point]
+
+    # Function for mapping the sidecar cache straight into the parameters, returns False if it is stale
+    def load_weights_cache(self, model_file):
+        blob_file, index_file = self.get_weights_cache_files(model_file)
+        if not os.path.isfile(blob_file) or not os.path.isfile(index_file):
+            return False
+        with open(index_file) as fp:
+            index = json.load(fp)
+        stat = os.stat(model_file)
+        if index['source'] != [stat.st_size, stat.st_mtime]:
+            return False
+        tensors = self.get_cached_tensors()
+        if [[name, list(t.shape)] for name, t in tensors] != [[name, shape] for name, _, shape in index['tensors']]:
+            return False
+
+        buf = np.load(blob_file, mmap_mode='c')
+        modules = dict(self.named_modules())
+        for name, offset, _ in index['tensors']:
+            module_name, _, tensor_name = name.rpartition('.')
+            load_tensor(buf, offset, modules[module_name], tensor_name)
+        self.header = IntTensor(index['header'])
+        self.seen = self.header[3]
+        return True
+
+    # Function for writing the sidecar cache of the loaded weights, one aligned float32 blob plus an index
+    def save_weights_cache(self, model_file):
+        blob_file, index_file = self.get_weights_cache_files(model_file)
+        entries = []
+        offset = 0
+        for name, t in self.get_cached_tensors():
+            entries.append([name, offset, list(t.shape)])
+            offset += (t.numel() + WEIGHTS_CACHE_ALIGN - 1) // WEIGHTS_CACHE_ALIGN * WEIGHTS_CACHE_ALIGN
+        blob = np.lib.format.open_memmap(blob_file + '.tmp', mode='w+', dtype=np.float32, shape=(offset,))
+        for (name, offset, _), (_, t) in zip(entries, self.get_cached_tensors()):
+            blob[offset:offset + t.numel()] = t.detach().cpu().numpy().ravel()
+        blob.flush()
+        del blob
+        stat = os.stat(model_file)
+        index = {'source': [stat.st_size, stat.st_mtime], 'header': self.header.tolist(), 'tensors': entries}
+        with open(index_file + '.tmp', 'w') as fp:
+            json.dump(index, fp)
+        os.replace(blob_file + '.tmp', blob_file)
+        os.replace(index_file + '.tmp', index_file)
+
+    def load_weights(self, model_file, mmap=True, cache=False):
+        """Parameters become views of the weights instead of copies.
+        # Args
+            mmap: map the weights file with np.memmap instead of reading it into memory
+            cache: map the sidecar cache (see save_weights_cache()) if it is up to date,
+                   otherwise load the weights file and write the cache
+        """
+        if self.fused:
+            raise SystemExit('ERROR: load_weights() needs the BatchNorm layers, load before fuse_conv_bn()!')
+        if cache and self.load_weights_cache(model_file):
+            return
+        header = np.fromfile(model_file, count=5, dtype=np.int32)
         self.header = from_numpy(header)
         self.seen = self.header[3]
-        buf = np.fromfile(fp, dtype=np.float32)
-        fp.close()
+        if mmap:
+            # Copy on write, the parameters stay writable without touching the file
+            buf = np.memmap(model_file, dtype=np.float32, mode='c', offset=header.nbytes)
+        else:
+            buf = np.fromfile(model_file, dtype=np.float32, offset=header.nbytes)
 
         start = 0
         ind = -2
@@ -339,5 +496,5 @@ class Darknet(nn.Module):
             else:
                 print('unknown type %s' % (block['type']))
 
-
-
+        if cache:
+            self.save_weights_cache(model_file)
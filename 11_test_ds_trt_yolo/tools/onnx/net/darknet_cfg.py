@@ -1,5 +1,26 @@
 import os
 
+# Function for the exported ONNX file name of a Darknet model
+def get_onnx_file_name(model_file, height, width, batch_size, compact=False):
+    model_name_parts = model_file.split('.weights')[0].split('/')[-1].split('-')
+    model_name = model_name_parts[0]
+    for _str in model_name_parts:
+        if _str.isalpha():
+            model_name += "-" + _str
+    suffix = "_compact" if compact else ""
+    if batch_size <= 0:
+        return "{}_-1_3_{}_{}_dynamic{}.onnx".format(model_name, height, width, suffix)
+    return "{}_{}_3_{}_{}_static{}.onnx".format(model_name, batch_size, height, width, suffix)
+
+# Function for parsing an input size, 608 or 416x608 (height x width)
+def parse_input_size(size):
+    if isinstance(size, int):
+        return size, size
+    height, _, width = str(size).lower().partition('x')
+    if not height.isdigit() or not (width or height).isdigit():
+        raise ValueError('ERROR: input size %s is not like 608 or 416x608!' % size)
+    return int(height), int(width or height)
+
 class Darknet_cfg():
     def __init__(self, config_file=""):
         self.blocks = [] 
@@ -0,0 +1,210 @@
+# darknet_cost.py
+
+#############################################################################
+#  Copyright (c) 2021, NVIDIA CORPORATION. All rights reserved.             #
+#                                                                           #
+#  Licensed under the Apache License, Version 2.0 (the "License");          #
+#  you may not use this file except in compliance with the License.         #
+#  You may obtain a copy of the License at                                  #
+#                                                                           #
+#      http://www.apache.org/licenses/LICENSE-2.0                           #
+#                                                                           #
+#  Unless required by applicable law or agreed to in writing, software      #
+#  distributed under the License is distributed on an "AS IS" BASIS,        #
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+#  See the License for the specific language governing permissions and      #
+#  limitations under the License.                                           #
+#############################################################################
+
+import csv
+import json
+
+from tools.onnx.net.darknet_cfg import Darknet_cfg
+
+# Columns of the per-layer CSV report
+LAYER_FIELDS = ['index', 'type', 'input_shape', 'output_shape', 'params', 'macs', 'flops',
+                'activation_bytes', 'live_bytes']
+
+# Function for the output size of a Darknet maxpool, like the modules built by Darknet.create_network()
+def _maxpool_size(size, pool_size, stride):
+    if stride == 1 and pool_size % 2:
+        return size
+    elif stride == pool_size:
+        return size // stride
+    # tools.onnx.layer.maxpool.MaxPool pads like darknet
+    p = pool_size // 2
+    padding = (pool_size - 1) // 2 * 2
+    if ((size - 1) // stride) != ((size + 2 * p - pool_size) // stride):
+        padding += 1
+    return (size + padding - pool_size) // stride + 1
+
+# Function for the static cost of every layer of a Darknet cfg
+def analyze_cfg(config_file, batch_size=1, height=None, width=None, dtype_bytes=4):
+    """Shapes, parameters, MACs and activation memory without building the model.
+    # Args
+        height, width: network input size, the [net] block of the cfg if None
+        dtype_bytes: bytes per activation element, 4 for float32 and 2 for float16
+    # Returns
+        report dict: cfg, batch_size, height, width, layers (list of dicts with LAYER_FIELDS)
+                     and total (params, macs, flops, activation_bytes, peak_live_bytes)
+    """
+    blocks = Darknet_cfg().parse_cfg(config_file)
+    net = blocks[0]
+    height = int(net['height']) if height is None else height
+    width = int(net['width']) if width is None else width
+    channels = int(net.get('channels', 3))
+
+    # Shapes are (C, H, W) without the batch
+    shapes = []
+    layers = []
+    readers = {}
+    # The layer whose memory holds each output, a route of one layer is a view of its source
+    owners = []
+    prev = (channels, height, width)
+    for ind, block in enumerate(blocks[1:]):
+        kind = block['type']
+        in_shape = prev
+        c, h, w = prev
+        params = 0
+        macs = 0
+        ops = 0
+        # False for the outputs that are views of another output (no new memory)
+        allocates = True
+        owner = ind
+        inputs = []
+        if kind == 'convolutional':
+            filters = int(block['filters'])
+            size = int(block['size'])
+            stride = int(block['stride'])
+            groups = int(block.get('groups', 1))
+            pad = (size - 1) // 2 if int(block['pad']) else 0
+            out_h = (h + 2 * pad - size) // stride + 1
+            out_w = (w + 2 * pad - size) // stride + 1
+            params = filters * (c // groups) * size * size
+            # BatchNorm: weight, bias, running mean and var, otherwise the conv bias
+            params += 4 * filters if int(block['batch_normalize']) else filters
+            macs = batch_size * filters * out_h * out_w * (c // groups) * size * size
+            prev = (filters, out_h, out_w)
+            if block['activation'] != 'linear':
+                ops = batch_size * filters * out_h * out_w
+        elif kind == 'maxpool':
+            size = int(block['size'])
+            stride = int(block['stride'])
+            prev = (c, _maxpool_size(h, size, stride), _maxpool_size(w, size, stride))
+            ops = batch_size * prev[0] * prev[1] * prev[2] * size * size
+        elif kind == 'avgpool':
+            prev = (c, 1, 1)
+            ops = batch_size * c * h * w
+        elif kind == 'upsample':
+            stride = int(block['stride'])
+            prev = (c, h * stride, w * stride)
+        elif kind == 'reorg':
+            stride = int(block['stride'])
+            prev = (c * stride * stride, h // stride, w // stride)
+        elif kind == 'connected':
+            filters = int(block['output'])
+            params = c * h * w * filters + filters
+            macs = batch_size * c * h * w * filters
+            prev = (filters, 1, 1)
+        elif kind == 'route':
+            inputs = [int(i) if int(i) > 0 else int(i) + ind for i in block['layers'].split(',')]
+            if len(inputs) == 1:
+                c, h, w = shapes[inputs[0]]
+                groups = int(block.get('groups', 1))
+                prev = (c // groups, h, w)
+                allocates = False
+                owner = owners[inputs[0]]
+            else:
+                sizes = set(shapes[i][1:] for i in inputs)
+                if len(sizes) != 1:
+                    raise ValueError('ERROR: route %d concatenates different sizes %s!' % (ind, sorted(sizes)))
+                prev = (sum(shapes[i][0] for i in inputs), ) + shapes[inputs[0]][1:]
+        elif kind == 'shortcut':
+            from_layer = int(block['from'])
+            inputs = [from_layer if from_layer > 0 else from_layer + ind, ind - 1]
+            prev = shapes[inputs[0]]
+            ops = batch_size * prev[0] * prev[1] * prev[2]
+        elif kind == 'yolo':
+            num_anchors = len(block['mask'].split(','))
+            num_classes = int(block['classes'])
+            # boxes [batch, A * H * W, 1, 4] and confs [batch, A * H * W, num_classes]
+            prev = (num_anchors * (4 + num_classes), h, w)
+            ops = batch_size * c * h * w
+        elif kind in ['softmax', 'cost', 'region']:
+            allocates = kind == 'softmax'
+        else:
+            print('unknown type %s' % kind)
+            allocates = False
+
+        for layer in inputs:
+            readers[owners[layer]] = ind
+        # The input of the next layer is a view, its source stays live until then
+        if ind > 0 and owners[ind - 1] != ind - 1:
+            readers[owners[ind - 1]] = ind
+        owners.append(owner)
+        shapes.append(prev)
+        num = batch_size * prev[0] * prev[1] * prev[2]
+        layers.append({
+            'index'            : ind,
+            'type'             : kind,
+            'input_shape'      : [batch_size] + list(in_shape),
+            'output_shape'     : [batch_size] + list(prev),
+            'params'           : params,
+            'macs'             : macs,
+            'flops'            : 2 * macs + ops,
+            'activation_bytes' : num * dtype_bytes if allocates else 0,
+        })
+
+    # Live memory while each layer runs, with the liveness of Darknet.forward():
+    # its input and output, the outputs read back later and the yolo outputs so far.
+    # The input is the memory of the previous output, or of the source of a view
+    peak = 0
+    kept = {}
+    detections = 0
+    release = {}
+    for layer in layers:
+        ind = layer['index']
+        source = owners[ind - 1] if ind > 0 else None
+        in_bytes = layers[source]['activation_bytes'] if source is not None and source not in kept else 0
+        layer['live_bytes'] = sum(kept.values()) + detections + in_bytes + layer['activation_bytes']
+        peak = max(peak, layer['live_bytes'])
+        for dead in release.pop(ind, []):
+            del kept[dead]
+        if layer['type'] == 'yolo':
+            detections += layer['activation_bytes']
+        elif ind in readers:
+            kept[ind] = layer['activation_bytes']
+            release.setdefault(readers[ind], []).append(ind)
+
+    return {
+        'cfg'        : config_file,
+        'batch_size' : batch_size,
+        'height'     : height,
+        'width'      : width,
+        'layers'     : layers,
+        'total'      : {
+            'params'           : sum(layer['params'] for layer in layers),
+            'macs'             : sum(layer['macs'] for layer in layers),
+            'flops'            : sum(layer['flops'] for layer in layers),
+            'activation_bytes' : sum(layer['activation_bytes'] for layer in layers),
+            'peak_live_bytes'  : peak,
+        },
+    }
+
+# Function for the layers sorted by a cost column, most expensive first
+def rank_layers(report, key='macs', top=10):
+    return sorted(report['layers'], key=lambda layer: layer[key], reverse=True)[:top]
+
+def write_json(reports, json_file):
+    with open(json_file, 'w') as fp:
+        json.dump(reports, fp, indent=2)
+
+def write_csv(reports, csv_file):
+    with open(csv_file, 'w', newline='') as fp:
+        writer = csv.writer(fp)
+        writer.writerow(['cfg', 'batch_size', 'height', 'width'] + LAYER_FIELDS)
+        for report in reports:
+            for layer in report['layers']:
+                row = [report['cfg'], report['batch_size'], report['height'], report['width']]
+                row += ['x'.join(str(d) for d in layer[f]) if f.endswith('shape') else layer[f] for f in LAYER_FIELDS]
+                writer.writerow(row)
@@ -0,0 +1,196 @@
+# darknet_profile.py
+
+#############################################################################
+#  Copyright (c) 2021, NVIDIA CORPORATION. All rights reserved.             #
+#                                                                           #
+#  Licensed under the Apache License, Version 2.0 (the "License");          #
+#  you may not use this file except in compliance with the License.         #
+#  You may obtain a copy of the License at                                  #
+#                                                                           #
+#      http://www.apache.org/licenses/LICENSE-2.0                           #
+#                                                                           #
+#  Unless required by applicable law or agreed to in writing, software      #
+#  distributed under the License is distributed on an "AS IS" BASIS,        #
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+#  See the License for the specific language governing permissions and      #
+#  limitations under the License.                                           #
+#############################################################################
+
+import json
+import time
+
+import torch
+from torch.overrides import TorchFunctionMode
+
+from tools.onnx.net.darknet import OP_MODULE
+
+# Function for the tensors of a (nested) tuple, list or dict
+def _flatten_tensors(value):
+    if isinstance(value, torch.Tensor):
+        return [value]
+    elif isinstance(value, (tuple, list)):
+        return [t for v in value for t in _flatten_tensors(v)]
+    elif isinstance(value, dict):
+        return [t for v in value.values() for t in _flatten_tensors(v)]
+    return []
+
+def _tensor_bytes(value):
+    return sum(t.numel() * t.element_size() for t in _flatten_tensors(value))
+
+# Counts the torch calls returning a tensor with new storage, views and in-place results are not allocations
+class _AllocationCounter(TorchFunctionMode):
+    def __init__(self, profiler):
+        super(_AllocationCounter, self).__init__()
+        self.profiler = profiler
+
+    def __torch_function__(self, func, types, args=(), kwargs=None):
+        kwargs = kwargs or {}
+        out = func(*args, **kwargs)
+        ind = self.profiler.current
+        if ind is not None:
+            inputs = set(t.untyped_storage().data_ptr() for t in _flatten_tensors((args, kwargs)))
+            for t in _flatten_tensors(out):
+                storage = t.untyped_storage()
+                if storage.data_ptr() not in inputs:
+                    inputs.add(storage.data_ptr())
+                    count, nbytes = self.profiler.allocations.get(ind, (0, 0))
+                    self.profiler.allocations[ind] = (count + 1, nbytes + storage.nbytes())
+        return out
+
+# Per-layer CPU profile of Darknet.forward()
+class DarknetProfiler(object):
+    """Modules of the plan are timed with forward hooks on model.models,
+    route/shortcut/yolo steps by forward() itself through begin()/end().
+    The allocations are counted in one extra pass, outside of the timed iterations.
+    """
+    def __init__(self, model):
+        self.model = model
+        self.types = dict((ind, block['type']) for ind, block in enumerate(model.blocks[1:]))
+        self.current = None
+        self.iteration = 0
+        self.start = 0.0
+        self.origin = 0.0
+        self.events = []          # (iteration, ind, start, seconds) of the timed iterations
+        self.forwards = []        # (start, seconds) of the timed forward passes
+        self.output_bytes = {}
+        self.allocations = {}     # ind -> (count, bytes) of one forward pass
+        self.hooks = []
+
+    def begin(self, ind):
+        self.current = ind
+        self.start = time.perf_counter()
+
+    def end(self, ind, output):
+        seconds = time.perf_counter() - self.start
+        self.events.append((self.iteration, ind, self.start, seconds))
+        self.output_bytes[ind] = _tensor_bytes(output)
+        self.current = None
+
+    def attach(self):
+        for op, ind, module, inputs, arg, store, release in self.model.plan:
+            if op == OP_MODULE:
+                self.hooks.append(module.register_forward_pre_hook(lambda m, i, ind=ind: self.begin(ind)))
+                self.hooks.append(module.register_forward_hook(lambda m, i, o, ind=ind: self.end(ind, o)))
+        self.model.profiler = self
+
+    def detach(self):
+        for hook in self.hooks:
+            hook.remove()
+        self.hooks = []
+        self.model.profiler = None
+
+    # Function for profiling the forward pass of x
+    def run(self, x, iterations=10, warmup=2):
+        self.attach()
+        try:
+            with torch.no_grad():
+                for _ in range(warmup):
+                    self.model(x)
+                self.events = []
+                self.forwards = []
+                self.origin = time.perf_counter()
+                for i in range(iterations):
+                    self.iteration = i
+                    t = time.perf_counter()
+                    self.model(x)
+                    self.forwards.append((t, time.perf_counter() - t))
+                # The counting pass is slower, keep its timings out of the report
+                timed = len(self.events)
+                self.allocations = {}
+                with _AllocationCounter(self):
+                    self.model(x)
+                del self.events[timed:]
+        finally:
+            self.detach()
+        return self
+
+    # Function for the per-layer statistics, most expensive first
+    def report(self, sort='total_ms'):
+        """
+        # Returns
+            layers: list of dicts, index, type, calls, total_ms, mean_ms, min_ms, share (of the forward time),
+                    output_bytes, allocations and allocated_bytes (per forward pass)
+        """
+        times = {}
+        for iteration, ind, start, seconds in self.events:
+            times.setdefault(ind, []).append(seconds)
+        forward_seconds = sum(seconds for start, seconds in self.forwards) or 1.0
+        layers = []
+        for ind, seconds in times.items():
+            count, nbytes = self.allocations.get(ind, (0, 0))
+            layers.append({
+                'index'           : ind,
+                'type'            : self.types[ind],
+                'calls'           : len(seconds),
+                'total_ms'        : sum(seconds) * 1000,
+                'mean_ms'         : sum(seconds) * 1000 / len(seconds),
+                'min_ms'          : min(seconds) * 1000,
+                'share'           : sum(seconds) / forward_seconds,
+                'output_bytes'    : self.output_bytes[ind],
+                'allocations'     : count,
+                'allocated_bytes' : nbytes,
+            })
+        return sorted(layers, key=lambda layer: layer[sort], reverse=True)
+
+    # Function for the statistics summed per layer type (convolutional, maxpool, upsample, ...)
+    def report_by_type(self):
+        types = {}
+        for layer in self.report():
+            total = types.setdefault(layer['type'], {'type': layer['type'], 'layers': 0, 'total_ms': 0.0,
+                                                     'share': 0.0, 'allocations': 0, 'allocated_bytes': 0})
+            total['layers'] += 1
+            for key in ['total_ms', 'share', 'allocations', 'allocated_bytes']:
+                total[key] += layer[key]
+        return sorted(types.values(), key=lambda total: total['total_ms'], reverse=True)
+
+    def print_report(self, top=20):
+        iterations = len(self.forwards)
+        mean_ms = sum(seconds for start, seconds in self.forwards) * 1000 / max(iterations, 1)
+        print('forward %.3f ms (mean of %d iterations)' % (mean_ms, iterations))
+        print('%5s %-14s %10s %10s %7s %12s %7s %12s' % (
+            'index', 'type', 'mean(ms)', 'min(ms)', 'share', 'output(KiB)', 'allocs', 'alloc(KiB)'))
+        for layer in self.report()[:top]:
+            print('%5d %-14s %10.3f %10.3f %6.1f%% %12.1f %7d %12.1f' % (
+                layer['index'], layer['type'], layer['mean_ms'], layer['min_ms'], 100 * layer['share'],
+                layer['output_bytes'] / 1024.0, layer['allocations'], layer['allocated_bytes'] / 1024.0))
+        print()
+        print('%-14s %6s %10s %7s %7s %12s' % ('type', 'layers', 'mean(ms)', 'share', 'allocs', 'alloc(KiB)'))
+        for total in self.report_by_type():
+            print('%-14s %6d %10.3f %6.1f%% %7d %12.1f' % (
+                total['type'], total['layers'], total['total_ms'] / max(iterations, 1), 100 * total['share'],
+                total['allocations'], total['allocated_bytes'] / 1024.0))
+
+    # Function for the timed iterations in the Chrome trace format (chrome://tracing, Perfetto)
+    def write_chrome_trace(self, trace_file):
+        events = []
+        for i, (start, seconds) in enumerate(self.forwards):
+            events.append({'name': 'forward', 'cat': 'forward', 'ph': 'X', 'pid': 0, 'tid': 0,
+                           'ts': (start - self.origin) * 1e6, 'dur': seconds * 1e6, 'args': {'iteration': i}})
+        for iteration, ind, start, seconds in self.events:
+            count, nbytes = self.allocations.get(ind, (0, 0))
+            events.append({'name': '%d %s' % (ind, self.types[ind]), 'cat': self.types[ind], 'ph': 'X',
+                           'pid': 0, 'tid': 0, 'ts': (start - self.origin) * 1e6, 'dur': seconds * 1e6,
+                           'args': {'index': ind, 'iteration': iteration, 'output_bytes': self.output_bytes[ind],
+                                    'allocations': count, 'allocated_bytes': nbytes}})
+        with open(trace_file, 'w') as fp:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fp)
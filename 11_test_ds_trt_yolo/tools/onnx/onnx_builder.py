@@ -0,0 +1,332 @@
+# onnx_builder.py
+
+#############################################################################
+#  Copyright (c) 2021, NVIDIA CORPORATION. All rights reserved.             #
+#                                                                           #
+#  Licensed under the Apache License, Version 2.0 (the "License");          #
+#  you may not use this file except in compliance with the License.         #
+#  You may obtain a copy of the License at                                  #
+#                                                                           #
+#      http://www.apache.org/licenses/LICENSE-2.0                           #
+#                                                                           #
+#  Unless required by applicable law or agreed to in writing, software      #
+#  distributed under the License is distributed on an "AS IS" BASIS,        #
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+#  See the License for the specific language governing permissions and      #
+#  limitations under the License.                                           #
+#############################################################################
+
+import os
+import numpy as np
+
+from onnx import helper, numpy_helper, ModelProto, GraphProto, TensorProto
+from tools.onnx.net.darknet_cfg import Darknet_cfg, get_onnx_file_name
+from tools.onnx.onnx_weights import read_conv_layer
+
+ONNX_OPSET = 12
+ONNX_IR_VERSION = 7     # the IR version of the opset 12 exports of torch.onnx
+
+# Function for the decode constants of one Yolo layer, the numpy part of yolo_decode_constants() (layer/yolo.py)
+def yolo_decode_arrays(H, W, anchors, num_anchors, scale_x_y):
+    size = np.array([W, H], dtype=np.float64).reshape(1, 1, 2, 1, 1)
+    grid_y, grid_x = np.meshgrid(np.arange(H), np.arange(W), indexing='ij')
+    grid = (np.stack((grid_x, grid_y)).reshape(1, 1, 2, H, W) - 0.5 * (scale_x_y - 1)) / size
+    grid_scale = scale_x_y / size
+    anchor_wh = np.array(anchors[:num_anchors * 2], dtype=np.float64).reshape(1, num_anchors, 2, 1, 1) / size
+    return tuple(a.astype(np.float32) for a in (grid, grid_scale, anchor_wh))
+
+class DarknetOnnxBuilder(object):
+    ''' ONNX graph of a Darknet cfg and weights without torch
+    The nodes and initializers are named like the torch.onnx exports of
+    Darknet (/models.{index}/conv{id}/Conv, models.{index}.conv{id}.weight),
+    so swap_weights.py, specialize_onnx.py and the graph surgery work on both.
+    The conv weights are written to the file one layer at a time: an ONNX file
+    is a protobuf message, and concatenated messages are parsed as one whose
+    repeated fields (graph.initializer) are appended.
+    '''
+    def __init__(self, config_file, model_file):
+        self.config_file = config_file
+        self.model_file = model_file
+        self.blocks = Darknet_cfg().parse_cfg(config_file)
+
+    # Function for a name unique in the graph, like the node names of torch.onnx
+    def unique(self, prefix, op_type):
+        key = (prefix, op_type)
+        count = self.counts.get(key, 0)
+        self.counts[key] = count + 1
+        return '%s/%s' % (prefix, op_type) if count == 0 else '%s/%s_%d' % (prefix, op_type, count)
+
+    def add_node(self, prefix, op_type, inputs, **attrs):
+        name = self.unique(prefix, op_type)
+        self.nodes.append(helper.make_node(op_type, inputs, [name + '_output_0'], name=name, **attrs))
+        return name + '_output_0'
+
+    def add_constant(self, prefix, value):
+        name = self.unique(prefix, 'Constant') + '_output_0'
+        self.initializers.append(numpy_helper.from_array(np.asarray(value), name))
+        return name
+
+    # Function for writing a weight straight to the file, it is not kept in the graph
+    def write_weight(self, name, value):
+        fragment = ModelProto(graph=GraphProto(initializer=[numpy_helper.from_array(value, name)]))
+        self.fp.write(fragment.SerializeToString())
+
+    def add_slice(self, prefix, x, start, end, axis):
+        return self.add_node(prefix, 'Slice', [x] + [self.add_constant(prefix, np.array([v], dtype=np.int64))
+                                                     for v in (start, end, axis, 1)])
+
+    def add_reshape(self, prefix, x, shape):
+        return self.add_node(prefix, 'Reshape', [x, self.add_constant(prefix, np.array(shape, dtype=np.int64))])
+
+    def add_activation(self, prefix, x, activation, conv_id=''):
+        if activation == 'leaky':
+            return self.add_node('%s/leaky%s' % (prefix, conv_id), 'LeakyRelu', [x], alpha=0.1)
+        elif activation == 'relu':
+            return self.add_node('%s/relu%s' % (prefix, conv_id), 'Relu', [x])
+        elif activation == 'mish':
+            # x * tanh(softplus(x)) as Mish of layer/activation.py, Mish is not in opset 12
+            prefix = '%s/mish%s' % (prefix, conv_id)
+            softplus = self.add_node(prefix, 'Softplus', [x])
+            return self.add_node(prefix, 'Mul', [x, self.add_node(prefix, 'Tanh', [softplus])])
+        elif activation != 'linear':
+            print("convalution have no activate {}".format(activation))
+        return x
+
+    def add_conv(self, ind, block, x, shape):
+        self.conv_id += 1
+        prefix = '/models.%d/conv%d' % (ind, self.conv_id)
+        C, H, W = shape
+        filters = int(block['filters'])
+        size = int(block['size'])
+        stride = int(block['stride'])
+        pad = (size - 1) // 2 if int(block['pad']) else 0
+        # Only this layer is mapped, the pages of the whole file would count as resident once read
+        num = (4 if int(block['batch_normalize']) else 1) * filters + filters * C * size * size
+        if self.start + num > self.num_weights:
+            raise ValueError('ERROR: the weights end at %d, the conv layer %d needs %d more!'
+                             % (self.num_weights, ind, self.start + num - self.num_weights))
+        buf = np.memmap(self.model_file, dtype=np.float32, mode='r',
+                        offset=self.offset + 4 * self.start, shape=(num,))
+        weight, bias, _ = read_conv_layer(buf, 0, block, [filters, C, size, size])
+        del buf
+        self.start += num
+        names = ['models.%d.conv%d.weight' % (ind, self.conv_id), 'models.%d.conv%d.bias' % (ind, self.conv_id)]
+        self.write_weight(names[0], weight)
+        self.write_weight(names[1], bias)
+        del weight, bias
+        x = self.add_node(prefix, 'Conv', [x] + names, dilations=[1, 1], group=1, kernel_shape=[size, size],
+                          pads=[pad] * 4, strides=[stride, stride])
+        x = self.add_activation('/models.%d' % ind, x, block['activation'], self.conv_id)
+        return x, (filters, (H + 2 * pad - size) // stride + 1, (W + 2 * pad - size) // stride + 1)
+
+    def add_maxpool(self, ind, block, x, shape):
+        prefix = '/models.%d' % ind
+        C, H, W = shape
+        size = int(block['size'])
+        stride = int(block['stride'])
+        if stride == 1 and size % 2:
+            pads = [size // 2] * 4
+        elif stride == size:
+            pads = [0] * 4
+        else:
+            # Zero padding of the darknet output size, see MaxPool of layer/maxpool.py
+            p = size // 2
+            pads = [(size - 1) // 2] * 4
+            if (H - 1) // stride != (H + 2 * p - size) // stride:
+                pads[2] += 1
+            if (W - 1) // stride != (W + 2 * p - size) // stride:
+                pads[3] += 1
+            x = self.add_node(prefix, 'Pad', [x, self.add_constant(prefix, np.array(
+                [0, 0, pads[0], pads[1], 0, 0, pads[2], pads[3]], dtype=np.int64)),
+                self.add_constant(prefix, np.array(0, dtype=np.float32))], mode='constant')
+            H, W = H + pads[0] + pads[2], W + pads[1] + pads[3]
+            pads = [0] * 4
+        x = self.add_node(prefix, 'MaxPool', [x], ceil_mode=0, dilations=[1, 1], kernel_shape=[size, size],
+                          pads=pads, strides=[stride, stride])
+        return x, (C, (H + pads[0] + pads[2] - size) // stride + 1, (W + pads[1] + pads[3] - size) // stride + 1)
+
+    def add_upsample(self, ind, block, x, shape):
+        prefix = '/models.%d' % ind
+        C, H, W = shape
+        stride = int(block['stride'])
+        # Nearest of the floor source pixel, the same values as Upsample_expand of layer/upsample.py
+        roi = self.add_constant(prefix, np.array([], dtype=np.float32))
+        scales = self.add_constant(prefix, np.array([1, 1, stride, stride], dtype=np.float32))
+        x = self.add_node(prefix, 'Resize', [x, roi, scales], mode='nearest',
+                          coordinate_transformation_mode='asymmetric', nearest_mode='floor')
+        return x, (C, H * stride, W * stride)
+
+    def add_yolo(self, ind, block, x, shape, stride, compact, compact_thresh):
+        prefix = '/models.%d' % ind
+        C, H, W = shape
+        anchors = [float(i) for i in block['anchors'].split(',')]
+        anchor_mask = [int(i) for i in block['mask'].split(',')]
+        num_classes = int(block['classes'])
+        anchor_step = len(anchors) // int(block['num'])
+        scale_x_y = float(block['scale_x_y']) if 'scale_x_y' in block else 1.0
+        masked_anchors = []
+        for m in anchor_mask:
+            masked_anchors += anchors[m * anchor_step:(m + 1) * anchor_step]
+        masked_anchors = [anchor / stride for anchor in masked_anchors]
+        A = len(anchor_mask)
+        N = A * H * W
+        grid, grid_scale, anchor_wh = yolo_decode_arrays(H, W, masked_anchors, A, scale_x_y)
+
+        # Same ops as yolo_forward_dynamic() of layer/yolo.py
+        output = self.add_reshape(prefix, x, [-1, A, 5 + num_classes, H, W])
+        bxy = self.add_node(prefix, 'Sigmoid', [self.add_slice(prefix, output, 0, 2, 2)])
+        bxy = self.add_node(prefix, 'Mul', [bxy, self.add_constant(prefix, grid_scale)])
+        bxy = self.add_node(prefix, 'Add', [bxy, self.add_constant(prefix, grid)])
+        bwh = self.add_node(prefix, 'Exp', [self.add_slice(prefix, output, 2, 4, 2)])
+        bwh = self.add_node(prefix, 'Mul', [bwh, self.add_constant(prefix, anchor_wh)])
+        bxy1 = self.add_node(prefix, 'Sub', [bxy, self.add_node(prefix, 'Mul', [
+            bwh, self.add_constant(prefix, np.array(0.5, dtype=np.float32))])])
+        bxy2 = self.add_node(prefix, 'Add', [bxy1, bwh])
+        boxes = self.add_node(prefix, 'Transpose', [self.add_node(prefix, 'Concat', [bxy1, bxy2], axis=2)],
+                              perm=[0, 1, 3, 4, 2])
+
+        if compact:
+            cls = self.add_slice(prefix, output, 5, np.iinfo(np.int64).max, 2)
+            cls_logit = self.add_node(prefix, 'ReduceMax', [cls], axes=[2], keepdims=0)
+            cls_id = self.add_node(prefix, 'ArgMax', [cls], axis=2, keepdims=0)
+            det_conf = self.add_constant(prefix, np.array(4, dtype=np.int64))
+            det_conf = self.add_node(prefix, 'Gather', [output, det_conf], axis=2)
+            scores = self.add_node(prefix, 'Mul', [self.add_node(prefix, 'Sigmoid', [cls_logit]),
+                                                   self.add_node(prefix, 'Sigmoid', [det_conf])])
+            scores = self.add_reshape(prefix, scores, [-1, N])
+            classes = self.add_node(prefix, 'Cast', [cls_id], to=TensorProto.INT32)
+            classes = self.add_reshape(prefix, classes, [-1, N])
+            if compact_thresh is not None:
+                # Scores below the threshold are set to 0
+                keep = self.add_node(prefix, 'Greater', [scores, self.add_constant(
+                    prefix, np.array(compact_thresh, dtype=np.float32))])
+                keep = self.add_node(prefix, 'Cast', [keep], to=TensorProto.FLOAT)
+                scores = self.add_node(prefix, 'Mul', [scores, keep])
+            boxes = self.add_reshape(prefix, boxes, [-1, N, 4])
+            return [boxes, scores, classes], N
+
+        boxes = self.add_reshape(prefix, boxes, [-1, N, 1, 4])
+        confs = self.add_node(prefix, 'Mul', [
+            self.add_node(prefix, 'Sigmoid', [self.add_slice(prefix, output, 5, np.iinfo(np.int64).max, 2)]),
+            self.add_node(prefix, 'Sigmoid', [self.add_slice(prefix, output, 4, 5, 2)])])
+        confs = self.add_node(prefix, 'Transpose', [confs], perm=[0, 1, 3, 4, 2])
+        confs = self.add_reshape(prefix, confs, [-1, N, num_classes])
+        return [boxes, confs], N
+
+    # Function for writing the ONNX file of one (batch, input size) variant
+    def build(self, onnx_file, batch_size=-1, height=None, width=None, compact=False, compact_thresh=None):
+        """Same graph semantics as yolo_to_onnx.py (the folded BatchNorm), the
+        weights file is mapped and only one conv layer is in memory at a time.
+        # Args
+            batch_size: static batch size, 0/-1 for the dynamic batch
+            height, width: input size, the net block of the cfg if None
+        """
+        net = self.blocks[0]
+        height, width = height or int(net['height']), width or int(net['width'])
+        batch = batch_size if batch_size > 0 else 'batch_size'
+        self.nodes = []
+        self.initializers = []
+        self.counts = {}
+        self.conv_id = 0
+        self.offset = np.fromfile(self.model_file, count=5, dtype=np.int32).nbytes
+        self.num_weights = (os.path.getsize(self.model_file) - self.offset) // 4
+        self.start = 0
+
+        x = 'input'
+        shape = (int(net['channels']), height, width)
+        # Tensor, (channels, height, width) and stride of every layer, the stride as create_network() of Darknet
+        outputs, shapes, strides = [], [], []
+        stride = 1
+        heads = []
+        try:
+            with open(onnx_file + '.tmp', 'wb') as self.fp:
+                for ind, block in enumerate(self.blocks[1:]):
+                    prefix = '/models.%d' % ind
+                    if block['type'] == 'convolutional':
+                        x, shape = self.add_conv(ind, block, x, shape)
+                        stride = int(block['stride']) * stride
+                    elif block['type'] == 'maxpool':
+                        x, shape = self.add_maxpool(ind, block, x, shape)
+                        stride = int(block['stride']) * stride
+                    elif block['type'] == 'upsample':
+                        x, shape = self.add_upsample(ind, block, x, shape)
+                        stride = stride // int(block['stride'])
+                    elif block['type'] == 'route':
+                        layers = [int(i) if int(i) > 0 else int(i) + ind for i in block['layers'].split(',')]
+                        stride = strides[layers[0]]
+                        if len(layers) > 1:
+                            x = self.add_node(prefix, 'Concat', [outputs[layer] for layer in layers], axis=1)
+                            shape = (sum(shapes[layer][0] for layer in layers),) + shapes[layers[0]][1:]
+                        elif 'groups' not in block or int(block['groups']) == 1:
+                            x, shape = outputs[layers[0]], shapes[layers[0]]
+                        else:
+                            groups, group_id = int(block['groups']), int(block['group_id'])
+                            C = shapes[layers[0]][0] // groups
+                            x = self.add_slice(prefix, outputs[layers[0]], C * group_id, C * (group_id + 1), 1)
+                            shape = (C,) + shapes[layers[0]][1:]
+                            stride = stride // groups
+                    elif block['type'] == 'shortcut':
+                        from_layer = int(block['from'])
+                        from_layer = from_layer if from_layer > 0 else from_layer + ind
+                        x = self.add_node(prefix, 'Add', [outputs[from_layer], outputs[ind - 1]])
+                        if block['activation'] in ['leaky', 'relu']:
+                            x = self.add_activation(prefix, x, block['activation'])
+                        stride = strides[ind - 1]
+                    elif block['type'] == 'yolo':
+                        heads.append(self.add_yolo(ind, block, x, shape, stride, compact, compact_thresh))
+                    else:
+                        raise ValueError('ERROR: %s layers are not supported by the ONNX builder,'
+                                         ' use yolo_to_onnx.py!' % block['type'])
+                    outputs.append(x)
+                    shapes.append(shape)
+                    strides.append(stride)
+                if self.start != self.num_weights:
+                    raise ValueError('ERROR: %s has %d weights, %s needs %d!'
+                                     % (self.model_file, self.num_weights, self.config_file, self.start))
+                if not heads:
+                    raise ValueError('ERROR: %s has no yolo layer!' % self.config_file)
+
+                N = sum(num for _, num in heads)
+                if compact:
+                    output_info = [('boxes', TensorProto.FLOAT, [batch, N, 4]),
+                                   ('scores', TensorProto.FLOAT, [batch, N]),
+                                   ('classes', TensorProto.INT32, [batch, N])]
+                else:
+                    num_classes = int(self.blocks[-1]['classes'])
+                    output_info = [('boxes', TensorProto.FLOAT, [batch, N, 1, 4]),
+                                   ('confs', TensorProto.FLOAT, [batch, N, num_classes])]
+                for i, (name, _, _) in enumerate(output_info):
+                    self.nodes.append(helper.make_node('Concat', [tensors[i] for tensors, _ in heads], [name],
+                                                       name=self.unique('', 'Concat'), axis=1))
+
+                input_shape = [batch, int(net['channels']), height, width]
+                graph = helper.make_graph(
+                    self.nodes, 'darknet',
+                    [helper.make_tensor_value_info('input', TensorProto.FLOAT, input_shape)],
+                    [helper.make_tensor_value_info(name, dtype, dims) for name, dtype, dims in output_info],
+                    self.initializers)
+                model = helper.make_model(graph, producer_name='darknet_to_onnx',
+                                          opset_imports=[helper.make_opsetid('', ONNX_OPSET)])
+                model.ir_version = ONNX_IR_VERSION
+                # The graph after the weights, the parser merges it with the weight fragments
+                self.fp.write(model.SerializeToString())
+        except Exception:
+            # No partial file is left behind
+            os.remove(onnx_file + '.tmp')
+            raise
+        os.replace(onnx_file + '.tmp', onnx_file)
+        return onnx_file
+
+# Function for building the ONNX file of a Darknet cfg and weights without torch
+def build_onnx(config_file, model_file, batch_size=-1, height=None, width=None, onnx_path='models/onnx/',
+               compact=False, compact_thresh=None):
+    """
+    # Returns
+        onnx_file_name, named like the exports of yolo_to_onnx.py
+    """
+    builder = DarknetOnnxBuilder(config_file, model_file)
+    height, width = height or int(builder.blocks[0]['height']), width or int(builder.blocks[0]['width'])
+    onnx_file_name = get_onnx_file_name(model_file, height, width, batch_size, compact)
+    os.makedirs(onnx_path, exist_ok=True)
+    builder.build(os.path.join(onnx_path, onnx_file_name), batch_size, height, width, compact, compact_thresh)
+    return onnx_file_name
@@ -0,0 +1,302 @@
+# onnx_specialize.py
+
+#############################################################################
+#  Copyright (c) 2021, NVIDIA CORPORATION. All rights reserved.             #
+#                                                                           #
+#  Licensed under the Apache License, Version 2.0 (the "License");          #
+#  you may not use this file except in compliance with the License.         #
+#  You may obtain a copy of the License at                                  #
+#                                                                           #
+#      http://www.apache.org/licenses/LICENSE-2.0                           #
+#                                                                           #
+#  Unless required by applicable law or agreed to in writing, software      #
+#  distributed under the License is distributed on an "AS IS" BASIS,        #
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+#  See the License for the specific language governing permissions and      #
+#  limitations under the License.                                           #
+#############################################################################
+
+import os
+import re
+import onnx
+import onnxruntime
+import numpy as np
+
+from onnx import helper, numpy_helper, shape_inference
+from onnx.reference import ReferenceEvaluator
+from tools.onnx.net.darknet_cfg import get_onnx_file_name
+
+ONNX_FILE_PATTERN = re.compile(r'^(.+)_(-1|\d+)_3_(\d+)_(\d+)_(static|dynamic)(_compact)?\.onnx$')
+
+# Function for the model name, batch size, input size and compact flag of an exported ONNX file name
+def parse_onnx_file_name(onnx_file):
+    match = ONNX_FILE_PATTERN.match(os.path.basename(onnx_file))
+    if match is None:
+        raise ValueError('ERROR: %s is not named like yolovX_{batch}_3_{height}_{width}_[static|dynamic].onnx!'
+                         % onnx_file)
+    model_name, batch_size, height, width, _, compact = match.groups()
+    return model_name, int(batch_size), int(height), int(width), compact is not None
+
+# Function for the values of the initializers and Constant nodes of a graph
+def _constant_values(graph):
+    values = dict((t.name, numpy_helper.to_array(t)) for t in graph.initializer)
+    for node in graph.node:
+        if node.op_type == 'Constant' and node.attribute[0].name == 'value':
+            values[node.output[0]] = numpy_helper.to_array(node.attribute[0].t)
+    return values
+
+def _consumers(graph):
+    consumers = {}
+    for node in graph.node:
+        for name in node.input:
+            consumers.setdefault(name, []).append(node)
+    return consumers
+
+# Function for the decode constants of one Yolo head at a new grid size
+def _respecialize_constant(value, num_anchors, H, W, new_H, new_W):
+    """The traced decode bakes the grid size into
+        the reshapes [-1, A, 5 + C, H, W], [-1, A * H * W, ...],
+        grid       [1, 1, 2, H, W]  (C-x - offset) / W, (C-y - offset) / H,
+        grid_scale [1, 1, 2, 1, 1]  scale_x_y / W, scale_x_y / H,
+        anchor_wh  [1, A, 2, 1, 1]  anchor_w / W, anchor_h / H,
+    see yolo_decode_constants() of tools/onnx/layer/yolo.py.
+    # Returns
+        the value for new_H x new_W, None for the other constants
+    """
+    if value.dtype == np.int64 and value.ndim == 1:
+        if len(value) == 5 and value[0] == -1 and value[1] == num_anchors and list(value[3:]) == [H, W]:
+            return np.array([-1, num_anchors, value[2], new_H, new_W], dtype=np.int64)
+        if len(value) >= 2 and value[0] == -1 and value[1] == num_anchors * H * W:
+            return np.concatenate(([-1, num_anchors * new_H * new_W], value[2:])).astype(np.int64)
+    elif value.dtype == np.float32 and value.ndim == 5:
+        if value.shape == (1, 1, 2, H, W):
+            # The offset of scale_x_y is the first cell of the grid
+            offset_x, offset_y = value[0, 0, 0, 0, 0] * W, value[0, 0, 1, 0, 0] * H
+            grid_y, grid_x = np.meshgrid(np.arange(new_H), np.arange(new_W), indexing='ij')
+            grid = np.stack(((grid_x + offset_x) / new_W, (grid_y + offset_y) / new_H))
+            return grid.reshape(1, 1, 2, new_H, new_W).astype(np.float32)
+        if value.shape[0] == 1 and value.shape[1] in (1, num_anchors) and value.shape[2:] == (2, 1, 1):
+            ratio = np.array([W / new_W, H / new_H], dtype=np.float64).reshape(1, 1, 2, 1, 1)
+            return (value * ratio).astype(np.float32)
+    return None
+
+# Function for rewriting the decode constants of every Yolo head for a new input size
+def _respecialize_heads(graph, height, width, new_height, new_width):
+    values = _constant_values(graph)
+    consumers = _consumers(graph)
+    heads = 0
+    for node in list(graph.node):
+        # A head starts with the reshape of the conv output to [-1, A, 5 + C, H, W]
+        shape = values.get(node.input[1]) if node.op_type == 'Reshape' else None
+        if shape is None or shape.ndim != 1 or len(shape) != 5 or shape[0] != -1:
+            continue
+        num_anchors, H, W = int(shape[1]), int(shape[3]), int(shape[4])
+        if height % H or width % W or height // H != width // W:
+            continue
+        stride = height // H
+        if new_height % stride or new_width % stride:
+            raise ValueError('ERROR: input size %dx%d is not a multiple of the stride %d of the Yolo head!'
+                             % (new_height, new_width, stride))
+        new_H, new_W = new_height // stride, new_width // stride
+
+        # Every node downstream of the head reshape up to the outputs belongs to the head
+        head_nodes, visited, stack = [], set(), [node]
+        while stack:
+            head_node = stack.pop()
+            if head_node.output[0] in visited:
+                continue
+            visited.add(head_node.output[0])
+            head_nodes.append(head_node)
+            for name in head_node.output:
+                stack += consumers.get(name, [])
+        renamed = {}
+        for head_node in head_nodes:
+            for i, name in enumerate(head_node.input):
+                if name not in values:
+                    continue
+                if name not in renamed:
+                    value = _respecialize_constant(values[name], num_anchors, H, W, new_H, new_W)
+                    if value is None:
+                        renamed[name] = name
+                        continue
+                    # A new initializer, the original may be shared with another head
+                    renamed[name] = '%s_%dx%d' % (name, new_H, new_W)
+                    graph.initializer.append(numpy_helper.from_array(value, renamed[name]))
+                head_node.input[i] = renamed[name]
+        heads += 1
+    if heads == 0:
+        raise ValueError('ERROR: no Yolo head with a [-1, A, 5 + C, H, W] reshape found in the graph!')
+    return heads
+
+# Function for shape inference on the graph without the weights, it serializes the model otherwise
+def _infer_shapes(model, max_elements=1024):
+    graph = model.graph
+    weights = [t for t in graph.initializer if np.prod(t.dims) > max_elements]
+    skeleton = helper.make_model(
+        helper.make_graph(graph.node, graph.name,
+                          list(graph.input) + [helper.make_tensor_value_info(t.name, t.data_type, t.dims)
+                                               for t in weights],
+                          graph.output,
+                          [t for t in graph.initializer if np.prod(t.dims) <= max_elements]),
+        opset_imports=model.opset_import, ir_version=model.ir_version)
+    return shape_inference.infer_shapes(skeleton, data_prop=True)
+
+# Function for one round of fold_constants()
+def _fold_once(model):
+    graph = model.graph
+    inferred = _infer_shapes(model)
+    static_shapes = {}
+    for info in list(inferred.graph.input) + list(inferred.graph.value_info) + list(inferred.graph.output):
+        tensor_type = info.type.tensor_type
+        if tensor_type.HasField('shape') and all(d.HasField('dim_value') for d in tensor_type.shape.dim):
+            static_shapes[info.name] = [d.dim_value for d in tensor_type.shape.dim]
+
+    known = set(t.name for t in graph.initializer)
+    shape_values = {}
+    folded = []
+    for node in graph.node:
+        if node.op_type == 'Shape' and node.input[0] in static_shapes:
+            attrs = dict((a.name, helper.get_attribute_value(a)) for a in node.attribute)
+            shape = static_shapes[node.input[0]][attrs.get('start', 0):attrs.get('end')]
+            shape_values[node.output[0]] = np.array(shape, dtype=np.int64)
+        elif all(not name or name in known for name in node.input):
+            folded.append(node)
+        else:
+            continue
+        known.update(node.output)
+    if not folded and not shape_values:
+        return 0
+
+    # Nodes are told apart by their first output
+    folded_names = set(node.output[0] for node in folded) | set(shape_values)
+    kept = [node for node in graph.node if node.output[0] not in folded_names]
+    needed = set(name for node in kept for name in node.input) | set(o.name for o in graph.output)
+    outputs = [name for node in folded for name in node.output if name in needed]
+
+    values = dict((name, value) for name, value in shape_values.items() if name in needed)
+    if outputs:
+        # The folded nodes as one model, fed with the static shapes
+        used = set(name for node in folded for name in node.input)
+        evaluator = ReferenceEvaluator(helper.make_model(
+            helper.make_graph(folded, 'fold_constants',
+                              [helper.make_tensor_value_info(name, onnx.TensorProto.INT64, value.shape)
+                               for name, value in shape_values.items() if name in used],
+                              [helper.make_tensor_value_info(name, onnx.TensorProto.UNDEFINED, None)
+                               for name in outputs],
+                              [t for t in graph.initializer if t.name in used]),
+            opset_imports=model.opset_import, ir_version=model.ir_version))
+        feeds = dict((name, value) for name, value in shape_values.items() if name in used)
+        values.update(zip(outputs, evaluator.run(None, feeds)))
+
+    del graph.node[:]
+    graph.node.extend(kept)
+    for name, value in values.items():
+        graph.initializer.append(numpy_helper.from_array(np.asarray(value), name))
+    return len(folded_names)
+
+# Function for replacing the shape computations of a static graph by initializers
+def fold_constants(model):
+    """Shape ops of tensors whose shape is static after shape inference become
+    constants, then every node computing only from constants is evaluated once
+    with the ONNX reference evaluator. Folded pads (maxpool) make more shapes
+    static, so shapes are inferred again until nothing is left to fold.
+    # Returns
+        number of folded nodes
+    """
+    total = 0
+    while True:
+        folded = _fold_once(model)
+        if folded == 0:
+            return total
+        total += folded
+
+# Function for removing the nodes and initializers no output depends on anymore
+def _remove_unused(graph):
+    used = set(o.name for o in graph.output)
+    nodes = []
+    for node in reversed(graph.node):
+        if any(name in used for name in node.output):
+            nodes.append(node)
+            used.update(node.input)
+    del graph.node[:]
+    graph.node.extend(reversed(nodes))
+    initializers = [t for t in graph.initializer if t.name in used]
+    del graph.initializer[:]
+    graph.initializer.extend(initializers)
+
+def _set_dim(dim, value):
+    if isinstance(value, int) and value > 0:
+        dim.dim_value = value
+    else:
+        dim.dim_param = str(value)
+
+# Function for a static batch and/or input size variant of a dynamic batch export
+def specialize_model(model, batch_size=-1, height=None, width=None):
+    """The graph is rewritten instead of traced again (yolo_to_onnx.py):
+    input and output dims are set, the Yolo decode constants are recomputed
+    for a new input size, shape inference runs again and the shape
+    computations of a static batch are folded.
+    # Args
+        model: onnx.ModelProto of a dynamic batch export, changed in place
+        batch_size: static batch size, 0/-1 keeps the dynamic batch
+        height, width: new input size, the size of the export if None
+    # Returns
+        model
+    """
+    graph = model.graph
+    input_shape = graph.input[0].type.tensor_type.shape.dim
+    if input_shape[0].HasField('dim_value'):
+        raise ValueError('ERROR: %s has a static batch, specialize the dynamic batch export!' % graph.input[0].name)
+    in_height, in_width = input_shape[2].dim_value, input_shape[3].dim_value
+    height, width = height or in_height, width or in_width
+
+    if (height, width) != (in_height, in_width):
+        _respecialize_heads(graph, in_height, in_width, height, width)
+        _set_dim(input_shape[2], height)
+        _set_dim(input_shape[3], width)
+    batch = batch_size if batch_size > 0 else input_shape[0].dim_param
+    _set_dim(input_shape[0], batch)
+
+    # The outputs and intermediate shapes are inferred again
+    for output in graph.output:
+        output.type.tensor_type.ClearField('shape')
+    del graph.value_info[:]
+    if batch_size > 0:
+        fold_constants(model)
+    _remove_unused(graph)
+    inferred = _infer_shapes(model)
+    onnx.checker.check_model(inferred)
+    for output, inferred_output in zip(graph.output, inferred.graph.output):
+        output.CopyFrom(inferred_output)
+        _set_dim(output.type.tensor_type.shape.dim[0], batch)
+    return model
+
+# Function for writing a static batch and/or input size variant of a dynamic batch ONNX file
+def specialize_onnx(onnx_file, batch_size=-1, height=None, width=None, onnx_path=None):
+    """
+    # Returns
+        onnx_file_name of the variant, named like the exports of yolo_to_onnx.py
+    """
+    model_name, source_batch, source_height, source_width, compact = parse_onnx_file_name(onnx_file)
+    height, width = height or source_height, width or source_width
+    onnx_file_name = get_onnx_file_name(model_name, height, width, batch_size, compact)
+    onnx_path = onnx_path or os.path.dirname(onnx_file) + '/'
+    model = specialize_model(onnx.load(onnx_file), batch_size, height, width)
+    onnx.save(model, onnx_path + onnx_file_name)
+    return onnx_file_name
+
+# Function for the max abs difference of the outputs of two ONNX files on one random input
+def check_parity(onnx_file, reference_file, batch_size=2, seed=0):
+    """The input shape is the one of onnx_file, reference_file may be the dynamic batch source.
+    # Args
+        batch_size: batch of the input when onnx_file has a dynamic batch
+    # Returns
+        dict of output name -> max abs difference
+    """
+    sessions = [onnxruntime.InferenceSession(f, providers=['CPUExecutionProvider'])
+                for f in (onnx_file, reference_file)]
+    shape = [d if isinstance(d, int) else batch_size for d in sessions[0].get_inputs()[0].shape]
+    x = np.random.default_rng(seed).random(shape, dtype=np.float32)
+    outputs = [session.run(None, {session.get_inputs()[0].name: x}) for session in sessions]
+    return dict((output.name, float(np.abs(a.astype(np.float64) - b).max()))
+                for output, a, b in zip(sessions[0].get_outputs(), *outputs))
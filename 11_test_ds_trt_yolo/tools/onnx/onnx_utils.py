@@ -51,9 +51,9 @@ def check_onnx_model(onnx_model):
 
 # A Class for the ONNX graph surgery 
 class GraphSurgery():
-    def __init__(self, onnx_model_file, req_jsons, dynamic_batch):
+    def __init__(self, onnx_model_file, req_jsons, dynamic_batch, onnx_model_fixed_file=None):
         self.onnx_model_file = onnx_model_file
-        self.onnx_model_fixed_file = self.onnx_model_file.split('.onnx')[0] + '_tuned.onnx'
+        self.onnx_model_fixed_file = onnx_model_fixed_file or self.onnx_model_file.split('.onnx')[0] + '_tuned.onnx'
         self.onnx_model = onnx.load(onnx_model_file)
         self.onnx_model_fixed = None
         self.req_jsons  = req_jsons
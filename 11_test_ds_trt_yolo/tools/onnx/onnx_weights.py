@@ -0,0 +1,208 @@
+# onnx_weights.py
+
+#############################################################################
+#  Copyright (c) 2021, NVIDIA CORPORATION. All rights reserved.             #
+#                                                                           #
+#  Licensed under the Apache License, Version 2.0 (the "License");          #
+#  you may not use this file except in compliance with the License.         #
+#  You may obtain a copy of the License at                                  #
+#                                                                           #
+#      http://www.apache.org/licenses/LICENSE-2.0                           #
+#                                                                           #
+#  Unless required by applicable law or agreed to in writing, software      #
+#  distributed under the License is distributed on an "AS IS" BASIS,        #
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+#  See the License for the specific language governing permissions and      #
+#  limitations under the License.                                           #
+#############################################################################
+
+import os
+import re
+import json
+import hashlib
+import numpy as np
+
+from onnx import numpy_helper
+from tools.onnx.net.darknet_cfg import Darknet_cfg
+
+BN_EPS = 1e-5   # nn.BatchNorm2d of Darknet.create_network()
+
+# Function for the Conv node of every Darknet convolutional layer of an exported graph
+def conv_layers(graph, blocks):
+    """Traced exports name the nodes like /models.{index}/conv{id}/Conv, the
+    Conv nodes of other graphs are matched with the layers in their order.
+    # Returns
+        dict of layer index -> Conv node
+    """
+    indices = [ind for ind, block in enumerate(blocks[1:]) if block['type'] == 'convolutional']
+    convs = [node for node in graph.node if node.op_type == 'Conv']
+    named = [re.search(r'/models\.(\d+)/', node.name) for node in convs]
+    if all(named):
+        layers = dict((int(match.group(1)), node) for match, node in zip(named, convs))
+    else:
+        layers = dict(zip(indices, convs))
+    if sorted(layers) != indices:
+        raise ValueError('ERROR: the Conv nodes of the graph are not the %d convolutional layers of the cfg!'
+                         % len(indices))
+    return layers
+
+# Function for the conv weight shape of every convolutional layer of an exported graph
+def conv_weight_shapes(graph, blocks):
+    initializers = dict((t.name, t) for t in graph.initializer)
+    return dict((ind, list(initializers[node.input[1]].dims)) for ind, node in conv_layers(graph, blocks).items())
+
+# Function for reading one convolutional layer of a mapped weights file, with its BatchNorm folded
+def read_conv_layer(buf, start, block, shape):
+    """Same layout and folding as Darknet.load_weights() and fuse_conv_bn().
+    # Args
+        buf: float32 weights after the header (np.memmap)
+        start: offset of the layer in buf
+        shape: conv weight shape [filters, channels, size, size]
+    # Returns
+        weight, bias: float32 arrays, start: offset of the next layer
+    """
+    filters = shape[0]
+    num = int(np.prod(shape))
+    if start + (4 * filters if int(block['batch_normalize']) else filters) + num > buf.size:
+        raise ValueError('ERROR: the weights end at %d, the conv layer %s needs more!' % (buf.size, list(shape)))
+
+    def read(start, num):
+        return buf[start:start + num].astype(np.float64), start + num
+
+    if int(block['batch_normalize']):
+        beta, start = read(start, filters)
+        gamma, start = read(start, filters)
+        mean, start = read(start, filters)
+        var, start = read(start, filters)
+        weight, start = read(start, num)
+        scale = gamma / np.sqrt(var + BN_EPS)
+        weight = weight.reshape(shape) * scale.reshape(-1, 1, 1, 1)
+        bias = beta - mean * scale
+    else:
+        bias, start = read(start, filters)
+        weight, start = read(start, num)
+        weight = weight.reshape(shape)
+    return weight.astype(np.float32), bias.astype(np.float32), start
+
+# Function for reading the convolutional layers of a weights file, with their BatchNorm folded
+def read_conv_weights(config_file, model_file, shapes):
+    """The file is mapped and read one layer at a time.
+    # Args
+        shapes: dict of layer index -> conv weight shape (from the graph)
+    # Returns
+        header: the 5 int32 of the file,
+        layers: dict of layer index -> (weight, bias) float32 arrays
+    """
+    blocks = Darknet_cfg().parse_cfg(config_file)
+    header = np.fromfile(model_file, count=5, dtype=np.int32)
+    buf = np.memmap(model_file, dtype=np.float32, mode='r', offset=header.nbytes)
+
+    start = 0
+    layers = {}
+    for ind, block in enumerate(blocks[1:]):
+        if block['type'] == 'connected':
+            raise ValueError('ERROR: connected layers are not in the exported graphs!')
+        if block['type'] != 'convolutional':
+            continue
+        weight, bias, start = read_conv_layer(buf, start, block, shapes[ind])
+        layers[ind] = (weight, bias)
+    if start != buf.size:
+        raise ValueError('ERROR: %s has %d weights, %s needs %d!' % (model_file, buf.size, config_file, start))
+    return header, layers
+
+# Function for replacing the conv weights of a loaded ONNX model
+def swap_weights(model, config_file, model_file, layers=None):
+    """The graph is not traced again, only the initializers of the Conv nodes
+    are replaced, so exports of any batch or input size (onnx_specialize.py)
+    and graph surgery outputs keep their structure.
+    # Args
+        model: onnx.ModelProto, changed in place
+        layers: the (header, layers) of read_conv_weights() to share between models, read if None
+    # Returns
+        tensors: list of (initializer name, layer index, 'kernel' or 'bias') of the replaced weights
+    """
+    graph = model.graph
+    blocks = Darknet_cfg().parse_cfg(config_file)
+    convs = conv_layers(graph, blocks)
+    initializers = dict((t.name, t) for t in graph.initializer)
+    for ind, node in convs.items():
+        if len(node.input) < 3 or node.input[2] not in initializers:
+            raise ValueError(('ERROR: Conv node %s has no bias initializer, only exports with the BatchNorm folded'
+                              ' into the convs are supported (yolo_to_onnx.py without --no_fuse)!') % node.name)
+    if layers is None:
+        layers = read_conv_weights(config_file, model_file, conv_weight_shapes(graph, blocks))
+    _, layers = layers
+
+    tensors = []
+    replaced = set()
+    for ind in sorted(convs):
+        node = convs[ind]
+        for i, (role, value) in zip([1, 2], [('kernel', layers[ind][0]), ('bias', layers[ind][1])]):
+            name = node.input[i]
+            if list(initializers[name].dims) != list(value.shape):
+                raise ValueError('ERROR: layer %d %s is %s in the graph, %s in the weights!'
+                                 % (ind, role, list(initializers[name].dims), list(value.shape)))
+            if name in replaced:
+                # An initializer shared by two layers, the second one gets its own
+                name = '%s_%d' % (name, ind)
+                graph.initializer.append(numpy_helper.from_array(value, name))
+                node.input[i] = name
+            else:
+                initializers[name].CopyFrom(numpy_helper.from_array(value, name))
+            replaced.add(name)
+            tensors.append((name, ind, role))
+    return tensors
+
+# Function for the refit manifest files of an ONNX file: the .npy blob and its .json index
+def get_refit_manifest_files(onnx_file):
+    name = os.path.splitext(onnx_file)[0]
+    return name + '.refit.npy', name + '.refit.json'
+
+# Function for writing the weights of the swapped initializers, what a refittable engine needs
+def write_refit_manifest(model, tensors, onnx_file, model_file):
+    """The manifest holds the weights only, refit_trt.py sets them as the named weights
+    (ONNX initializer names) of engines built with onnx_to_trt.py --refittable.
+    # Returns
+        manifest_file, changed: names whose sha256 differs from the previous manifest (all if none)
+    """
+    blob_file, manifest_file = get_refit_manifest_files(onnx_file)
+    previous = {}
+    if os.path.isfile(manifest_file):
+        with open(manifest_file) as fp:
+            previous = dict((entry[0], entry[5]) for entry in json.load(fp)['tensors'])
+
+    values = dict((t.name, t) for t in model.graph.initializer)
+    entries = []
+    offset = 0
+    for name, ind, role in tensors:
+        shape = list(values[name].dims)
+        entries.append([name, ind, role, offset, shape])
+        offset += int(np.prod(shape))
+    blob = np.lib.format.open_memmap(blob_file + '.tmp', mode='w+', dtype=np.float32, shape=(offset,))
+    for entry in entries:
+        value = numpy_helper.to_array(values[entry[0]]).ravel()
+        blob[entry[3]:entry[3] + value.size] = value
+        entry.append(hashlib.sha256(value.tobytes()).hexdigest())
+    blob.flush()
+    del blob
+
+    manifest = {'onnx': os.path.basename(onnx_file), 'weights': model_file,
+                'blob': os.path.basename(blob_file), 'tensors': entries}
+    with open(manifest_file + '.tmp', 'w') as fp:
+        json.dump(manifest, fp, indent=1)
+    os.replace(blob_file + '.tmp', blob_file)
+    os.replace(manifest_file + '.tmp', manifest_file)
+    changed = [entry[0] for entry in entries if previous.get(entry[0]) != entry[5]]
+    return manifest_file, changed
+
+# Function for the named weights of a refit manifest, views of the mapped blob
+def load_refit_manifest(manifest_file):
+    """
+    # Returns
+        list of (initializer name, float32 array)
+    """
+    with open(manifest_file) as fp:
+        manifest = json.load(fp)
+    blob = np.load(os.path.join(os.path.dirname(manifest_file), manifest['blob']), mmap_mode='r')
+    return [(name, blob[offset:offset + int(np.prod(shape))].reshape(shape))
+            for name, ind, role, offset, shape, sha in manifest['tensors']]
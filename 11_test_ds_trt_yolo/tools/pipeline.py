@@ -0,0 +1,188 @@
+# pipeline.py
+
+#############################################################################
+#  Copyright (c) 2021, NVIDIA CORPORATION. All rights reserved.             #
+#                                                                           #
+#  Licensed under the Apache License, Version 2.0 (the "License");          #
+#  you may not use this file except in compliance with the License.         #
+#  You may obtain a copy of the License at                                  #
+#                                                                           #
+#      http://www.apache.org/licenses/LICENSE-2.0                           #
+#                                                                           #
+#  Unless required by applicable law or agreed to in writing, software      #
+#  distributed under the License is distributed on an "AS IS" BASIS,        #
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+#  See the License for the specific language governing permissions and      #
+#  limitations under the License.                                           #
+#############################################################################
+
+import os
+import glob
+import time
+import queue
+import threading
+
+from tools.metrics import get_metrics
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+# End of stream marker passed through the queues
+_END = object()
+
+# Function for listing the images of a directory or a glob pattern
+def list_images(path):
+    if os.path.isdir(path):
+        files = [os.path.join(path, f) for f in os.listdir(path)]
+    else:
+        files = glob.glob(path)
+    return sorted(f for f in files if f.lower().endswith(IMAGE_EXTENSIONS))
+
+# Function for reading BGR frames from a video file, an image directory or a glob pattern
+def read_frames(path):
+    """Yield (name, frame, fps), a uint8 BGR frame and the frame rate of a video, 0 for images."""
+    import cv2
+    if os.path.isdir(path) or not os.path.isfile(path) or path.lower().endswith(IMAGE_EXTENSIONS):
+        image_files = list_images(path)
+        # A mistyped file name is not an empty glob pattern
+        if not image_files and not os.path.isdir(path) and not os.path.isfile(path):
+            raise SystemExit('ERROR: Input (%s) not found!' % path)
+        for image_file in image_files:
+            frame = cv2.imread(image_file)
+            if frame is None:
+                print('WARNING: failed to read %s' % image_file)
+                continue
+            yield image_file, frame, 0
+    else:
+        capture = cv2.VideoCapture(path)
+        if not capture.isOpened():
+            raise SystemExit('ERROR: failed to open video (%s)!' % path)
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        index = 0
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            yield '%s:%d' % (path, index), frame, fps
+            index += 1
+        capture.release()
+
+# Multi-threaded pipeline: one thread per stage, stages connected by bounded queues
+class Pipeline(object):
+    """Pipeline
+    The source is an iterable of items, every stage is a function item -> item
+    running in its own thread. Returning None from a stage drops the item.
+    Items that are dicts with a 'num_frames' key are counted for the FPS.
+    """
+
+    def __init__(self, queue_size=4, metrics=None, source_name='decode'):
+        self.queue_size = queue_size
+        self.source_name = source_name
+        self.metrics = metrics if metrics is not None else get_metrics()
+        self.stages = []
+        self.error = None
+
+    def add_stage(self, name, func):
+        self.stages.append((name, func))
+        return self
+
+    def _feed(self, source, out_queue):
+        try:
+            source = iter(source)
+            while self.error is None:
+                t = time.time()
+                item = next(source, _END)
+                if item is _END:
+                    break
+                self.metrics.observe('pipeline.' + self.source_name, time.time() - t)
+                out_queue.put(item)
+        # SystemExit of the source (input not found) too, raised again by run()
+        except (Exception, SystemExit) as e:
+            self.error = e
+        out_queue.put(_END)
+
+    def _work(self, name, func, in_queue, out_queue):
+        while True:
+            item = in_queue.get()
+            if item is _END:
+                break
+            # Keep draining after an error so that upstream stages never block
+            if self.error is not None:
+                continue
+            try:
+                with self.metrics.timer('pipeline.' + name):
+                    item = func(item)
+            except (Exception, SystemExit) as e:
+                self.error = e
+                continue
+            if item is None:
+                continue
+            if out_queue is not None:
+                out_queue.put(item)
+            elif isinstance(item, dict):
+                self.num_frames += item.get('num_frames', 0)
+        if out_queue is not None:
+            out_queue.put(_END)
+
+    def run(self, source, monitor_interval=0.1):
+        """Run the source through all stages.
+        # Returns
+            stats dict: frames, seconds, fps and the mean/max depth of the input queue of every stage
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        threads = [threading.Thread(target=self._feed, args=(source, queues[0]), name='pipeline.' + self.source_name)]
+        for i, (name, func) in enumerate(self.stages):
+            out_queue = queues[i + 1] if i + 1 < len(queues) else None
+            threads.append(threading.Thread(target=self._work, args=(name, func, queues[i], out_queue),
+                                            name='pipeline.' + name))
+
+        self.error = None
+        self.num_frames = 0
+        depth_sum = [0] * len(queues)
+        depth_max = [0] * len(queues)
+        num_samples = 0
+
+        t = time.time()
+        for thread in threads:
+            thread.start()
+        while threads[-1].is_alive():
+            for i, q in enumerate(queues):
+                depth = q.qsize()
+                depth_sum[i] += depth
+                depth_max[i] = max(depth_max[i], depth)
+            num_samples += 1
+            threads[-1].join(monitor_interval)
+        for thread in threads:
+            thread.join()
+        seconds = time.time() - t
+
+        if self.error is not None:
+            raise self.error
+
+        stats = {
+            'frames'  : self.num_frames,
+            'seconds' : seconds,
+            'fps'     : self.num_frames / seconds if seconds > 0 else 0.0,
+            'queues'  : {},
+        }
+        for i, (name, _) in enumerate(self.stages):
+            stats['queues'][name] = {
+                'mean_depth' : depth_sum[i] / max(num_samples, 1),
+                'max_depth'  : depth_max[i],
+                'capacity'   : self.queue_size,
+            }
+        return stats
+
+    def print_stats(self, stats):
+        print('Frames %d in %.2f s, sustained FPS %.2f' % (stats['frames'], stats['seconds'], stats['fps']))
+        latency = self.metrics.summary()['latency']
+        print('%-16s %10s %10s %10s %10s' % ('stage', 'p50(ms)', 'p99(ms)', 'queue avg', 'queue max'))
+        for name in [self.source_name] + list(stats['queues']):
+            stage = latency.get('pipeline.' + name, {'count': 0})
+            p50 = stage['p50_ms'] if stage['count'] else 0.0
+            p99 = stage['p99_ms'] if stage['count'] else 0.0
+            if name in stats['queues']:
+                depth = stats['queues'][name]
+                print('%-16s %10.2f %10.2f %10.2f %6d/%-3d' % (
+                    name, p50, p99, depth['mean_depth'], depth['max_depth'], depth['capacity']))
+            else:
+                print('%-16s %10.2f %10.2f' % (name, p50, p99))
@@ -0,0 +1,97 @@
+# preprocess.py
+
+#############################################################################
+#  Copyright (c) 2021, NVIDIA CORPORATION. All rights reserved.             #
+#                                                                           #
+#  Licensed under the Apache License, Version 2.0 (the "License");          #
+#  you may not use this file except in compliance with the License.         #
+#  You may obtain a copy of the License at                                  #
+#                                                                           #
+#      http://www.apache.org/licenses/LICENSE-2.0                           #
+#                                                                           #
+#  Unless required by applicable law or agreed to in writing, software      #
+#  distributed under the License is distributed on an "AS IS" BASIS,        #
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+#  See the License for the specific language governing permissions and      #
+#  limitations under the License.                                           #
+#############################################################################
+
+import cv2
+import numpy as np
+
+# Pixel value of the letterbox padding, before scaling to [0, 1]
+LETTERBOX_PAD = 128
+
+# uint8 -> value / 255 lookup tables of the non float32 buffers, numpy casts to float16 slowly
+_luts = {}
+
+def _get_lut(dtype):
+    if dtype not in _luts:
+        _luts[dtype] = (np.arange(256, dtype=np.float32) / 255.0).astype(dtype)
+    return _luts[dtype]
+
+# Function for writing one image straight into a preallocated network input
+def preprocess_into(img, out, letterbox=False):
+    """Resize one BGR image and write it as RGB / 255 into out.
+    Only the resized uint8 image is allocated, BGR->RGB, HWC->CHW,
+    the dtype conversion and the scaling are fused into the write to out.
+    # Args
+        img: uint8 numpy array of shape either (img_h, img_w, 3) or (img_h, img_w)
+        out: float32 or float16 numpy array of shape (3, H, W), e.g. one item of a batch buffer
+        letterbox: keep the aspect ratio and pad the borders with LETTERBOX_PAD
+    # Returns
+        meta dict for restore_boxes(): scale (x, y), pad (left, top), input_hw, image_hw
+    """
+    input_h, input_w = out.shape[1], out.shape[2]
+    img_h, img_w = img.shape[0], img.shape[1]
+
+    if letterbox:
+        scale = min(input_w / img_w, input_h / img_h)
+        new_w = min(int(round(img_w * scale)), input_w)
+        new_h = min(int(round(img_h * scale)), input_h)
+        left = (input_w - new_w) // 2
+        top = (input_h - new_h) // 2
+        pad = LETTERBOX_PAD / 255.0
+        out[:, :top] = pad
+        out[:, top + new_h:] = pad
+        out[:, top:top + new_h, :left] = pad
+        out[:, top:top + new_h, left + new_w:] = pad
+    else:
+        new_w, new_h, left, top = input_w, input_h, 0, 0
+
+    resized = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    region = out[:, top:top + new_h, left:left + new_w]
+    lut = None if out.dtype == np.float32 else _get_lut(out.dtype)
+    for c in range(3):
+        # RGB channel c is BGR channel 2 - c
+        channel = resized if resized.ndim == 2 else resized[:, :, 2 - c]
+        if lut is None:
+            np.multiply(channel, np.float32(1.0 / 255.0), out=region[c])
+        else:
+            np.take(lut, channel, out=region[c], mode='clip')
+
+    return {
+        'scale'    : (new_w / img_w, new_h / img_h),
+        'pad'      : (left, top),
+        'input_hw' : (input_h, input_w),
+        'image_hw' : (img_h, img_w),
+    }
+
+# Function for writing a list of images into a preallocated (N, 3, H, W) batch buffer
+def preprocess_batch(imgs, out, letterbox=False):
+    """Returns the list of meta dicts, one per image (len(imgs) <= N)."""
+    if len(imgs) > out.shape[0]:
+        raise ValueError('ERROR: %d images do not fit a batch of %d!' % (len(imgs), out.shape[0]))
+    return [preprocess_into(img, out[i], letterbox) for i, img in enumerate(imgs)]
+
+# Function for mapping normalized network boxes back to normalized boxes of the original image
+def restore_boxes(boxes, meta):
+    """boxes: numpy array of shape (num, 4) x1 y1 x2 y2 normalized to the network input"""
+    input_h, input_w = meta['input_hw']
+    img_h, img_w = meta['image_hw']
+    scale_x, scale_y = meta['scale']
+    left, top = meta['pad']
+    restored = np.empty_like(boxes)
+    restored[:, 0::2] = (boxes[:, 0::2] * input_w - left) / (scale_x * img_w)
+    restored[:, 1::2] = (boxes[:, 1::2] * input_h - top) / (scale_y * img_h)
+    return restored
@@ -23,23 +23,22 @@ import pycuda.autoinit
 import pycuda.driver as cuda
 import tensorrt as trt
 
+from tools.preprocess import preprocess_into
+
 # Preprocess function for input image
-def _preprocess_yolo(img, input_shape):
+def _preprocess_yolo(img, input_shape, letterbox=False):
     """Preprocess an image before TRT YOLO inferencing.
     # Args
         img: uint8 numpy array of shape either (img_h, img_w, 3)
              or (img_h, img_w)
         input_shape: a tuple of (H, W)
+        letterbox: keep the aspect ratio and pad the image
     # Returns
         preprocessed img: float32 numpy array of shape (3, H, W)
     """
-    if img.ndim == 2:
-        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
-    img = cv2.resize(img, (input_shape[1], input_shape[0]))
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    img = img.transpose((2, 0, 1)).astype(np.float32)
-    img /= 255.0
-    return img
+    out = np.empty((3, input_shape[0], input_shape[1]), dtype=np.float32)
+    preprocess_into(img, out, letterbox)
+    return out
 
 # Entropy Calibrator
 class YOLOEntropyCalibrator(trt.IInt8EntropyCalibrator2):
@@ -49,7 +48,7 @@ class YOLOEntropyCalibrator(trt.IInt8EntropyCalibrator2):
     calibration data for YOLO models accordingly.
     """
 
-    def __init__(self, img_dir, net_hw, cache_file, batch_size=1):
+    def __init__(self, img_dir, net_hw, cache_file, batch_size=1, letterbox=False):
         if not os.path.isdir(img_dir):
             raise FileNotFoundError('%s does not exist' % img_dir)
         if len(net_hw) != 2 or net_hw[0] % 32 or net_hw[1] % 32:
@@ -61,6 +60,7 @@ class YOLOEntropyCalibrator(trt.IInt8EntropyCalibrator2):
         self.net_hw = net_hw
         self.cache_file = cache_file
         self.batch_size = batch_size
+        self.letterbox = letterbox
         self.blob_size = 3 * net_hw[0] * net_hw[1] * np.dtype('float32').itemsize * batch_size
 
         self.jpgs = [f for f in os.listdir(img_dir) if f.endswith('.jpg')]
@@ -70,7 +70,9 @@ class YOLOEntropyCalibrator(trt.IInt8EntropyCalibrator2):
             print('WARNING: found less than 500 images in %s!' % img_dir)
         self.current_index = 0
 
-        # Allocate enough memory for a whole batch.
+        # Allocate enough memory for a whole batch, images are preprocessed
+        # straight into the page-locked host buffer.
+        self.host_input = cuda.pagelocked_empty((batch_size, 3, net_hw[0], net_hw[1]), np.float32)
         self.device_input = cuda.mem_alloc(self.blob_size)
 
     def __del__(self):
@@ -84,17 +86,15 @@ class YOLOEntropyCalibrator(trt.IInt8EntropyCalibrator2):
             return None
         current_batch = int(self.current_index / self.batch_size)
 
-        batch = []
         for i in range(self.batch_size):
             img_path = os.path.join(
                 self.img_dir, self.jpgs[self.current_index + i])
             img = cv2.imread(img_path)
             assert img is not None, 'failed to read %s' % img_path
-            batch.append(_preprocess_yolo(img, self.net_hw))
-        batch = np.stack(batch)
-        assert batch.nbytes == self.blob_size
+            preprocess_into(img, self.host_input[i], self.letterbox)
+        assert self.host_input.nbytes == self.blob_size
 
-        cuda.memcpy_htod(self.device_input, np.ascontiguousarray(batch))
+        cuda.memcpy_htod(self.device_input, self.host_input)
         self.current_index += self.batch_size
         return [self.device_input]
 
@@ -16,12 +16,14 @@
 #  limitations under the License.                                           #
 #############################################################################
 
+import time
 import tensorrt as trt
 import pycuda.driver as cuda
 import pycuda.autoinit
 import numpy as np
 
 from tools.tensorrt.calibrator import YOLOEntropyCalibrator
+from tools.metrics import get_metrics
 
 # TensorRT Config Flag maps 
 network_flags = {
@@ -47,7 +49,7 @@ def save_TRTengine(trt_engine, trt_engine_path):
     print('Serialized the TensorRT engine to file: %s' % trt_engine_path)
 
 # Build TensorRT engine from ONNX Graph function
-def build_TRTengine(onnx_model, input_hw, batch, precision, calib_dataset, calib_file_path, core_id, num_category, verbose=False):
+def build_TRTengine(onnx_model, input_hw, batch, precision, calib_dataset, calib_file_path, core_id, num_category, verbose=False, refittable=False):
     print('calib_dataset: ' + calib_dataset)
     print('input_hw: ', input_hw)
     print('calib_out: ', calib_file_path)
@@ -100,6 +102,11 @@ def build_TRTengine(onnx_model, input_hw, batch, precision, calib_dataset, calib
             #config.set_flag(trt.BuilderFlag.STRICT_TYPES)
             print('Using DLA%d !!!' % core_id)
 
+        if refittable:
+            # Weights named by the ONNX initializers can be replaced later (refit_TRTengine)
+            print('Refittable engine')
+            config.set_flag(builder_flags['refittable'])
+
         # Check Input/output Tensors
         for j in range(network.num_inputs):
             print("input[\t", j, "] : ", network.get_input(j).name)
@@ -116,6 +123,43 @@ def build_TRTengine(onnx_model, input_hw, batch, precision, calib_dataset, calib
         context = engine.create_execution_context()
     return engine, context
 
+# Refit the weights of a TensorRT engine built with refittable=True
+def refit_TRTengine(trt_engine_path, named_weights, verbose=False):
+    """The engine is not built again, its weights are replaced by name
+    (ONNX initializer names, see tools/onnx/onnx_weights.py).
+    # Args
+        named_weights: list of (name, float32 array)
+    # Returns
+        engine, or None if the engine is not refittable or misses weights
+    """
+    TRT_LOGGER=trt.Logger(trt.Logger.VERBOSE) if verbose else trt.Logger()
+    trt.init_libnvinfer_plugins(TRT_LOGGER, '')
+    with open(trt_engine_path, 'rb') as f, trt.Runtime(TRT_LOGGER) as runtime:
+        engine = runtime.deserialize_cuda_engine(f.read())
+    if engine is None or not engine.refittable:
+        print('ERROR: %s is not a refittable engine, build it with onnx_to_trt.py --refittable' % trt_engine_path)
+        return None
+
+    refitter = trt.Refitter(engine, TRT_LOGGER)
+    engine_weights = set(refitter.get_all_weights())
+    # The arrays must stay alive until refit_cuda_engine()
+    arrays = []
+    for name, value in named_weights:
+        if name not in engine_weights:
+            # Folded into another weight by the builder, or not a weight of this engine
+            continue
+        arrays.append(np.ascontiguousarray(value, dtype=np.float32))
+        refitter.set_named_weights(name, trt.Weights(arrays[-1]))
+    missing = refitter.get_missing_weights()
+    if len(missing):
+        print('ERROR: %d weights of the engine are not in the manifest: %s' % (len(missing), ', '.join(missing[:8])))
+        return None
+    if not refitter.refit_cuda_engine():
+        print('ERROR: Failed to refit the TensorRT engine.')
+        return None
+    print('Refitted %d weights of %s' % (len(arrays), trt_engine_path))
+    return engine
+
 # Simple helper data class that's a little nicer to use than a 2-tuple.
 class HostDeviceMem(object):
     def __init__(self, name, host_mem, device_mem):
@@ -179,8 +223,11 @@ def allocate_buffers(engine, context, inputs):
 # TensorRT inference function
 # This function is generalized for multiple inputs/outputs.
 # inputs and outputs are expected to be lists of HostDeviceMem objects.
-def do_inference(context, bindings, inputs, outputs, stream):
-    print("Start to run TRT inference...")
+# The latency is recorded as 'trt.inference' in metrics (tools.metrics default registry if None).
+def do_inference(context, bindings, inputs, outputs, stream, metrics=None, verbose=False):
+    if verbose:
+        print("Start to run TRT inference...")
+    t = time.time()
     # Transfer input data to the GPU.
     [cuda.memcpy_htod_async(inp.device, inp.host, stream) for inp in inputs]
 
@@ -193,6 +240,11 @@ def do_inference(context, bindings, inputs, outputs, stream):
     # Synchronize the stream
     stream.synchronize()
 
+    if metrics is None:
+        metrics = get_metrics()
+    metrics.observe('trt.inference', time.time() - t)
+
     # Return only the host outputs.
-    print("TRT inference done.")
+    if verbose:
+        print("TRT inference done.")
     return [out.host for out in outputs]
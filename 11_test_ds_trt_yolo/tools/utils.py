@@ -16,10 +16,21 @@
 #  limitations under the License.                                           #
 #############################################################################
 
+import os
 import time
 import math
 import numpy as np
 from torch import cat
+from tools.metrics import get_metrics
+
+# Max number of grid cells per axis used by nms_grid_cpu
+NMS_GRID_MAX_CELLS = 64
+
+# Candidates per class of Matrix NMS without a top_k (SOLOv2), it builds N x N matrices per class
+MATRIX_NMS_TOP_K = 500
+
+# Detection record of post_processing, one row per box (normalized x1 y1 x2 y2)
+DETECTION_DTYPE = np.dtype([('box', np.float32, (4,)), ('score', np.float32), ('class_id', np.int32)])
 
 # Function for getting input dimension
 def get_input_dim(model_name):
@@ -38,7 +49,7 @@ def get_input_dim(model_name):
     return [b, ch, h, w]
 
 # Function for drawing Detector's output
-def plot_boxes_cv2(img, boxes, savename=None, class_names=None, color=None):
+def plot_boxes_cv2(img, boxes, savename=None, class_names=None, color=None, verbose=True):
     import cv2
     img = np.copy(img)
     colors = np.array([[1, 0, 1], [0, 0, 1], [0, 1, 1], [0, 1, 0], [1, 1, 0], [1, 0, 0]], dtype=np.float32)
@@ -53,21 +64,23 @@ def plot_boxes_cv2(img, boxes, savename=None, class_names=None, color=None):
 
     width = img.shape[1]
     height = img.shape[0]
-    for i in range(len(boxes)):
-        box = boxes[i]
-        x1 = int(box[0] * width)
-        y1 = int(box[1] * height)
-        x2 = int(box[2] * width)
-        y2 = int(box[3] * height)
-
+    if isinstance(boxes, np.ndarray) and boxes.dtype.names is not None:
+        # DETECTION_DTYPE rows of post_processing
+        coords = (boxes['box'] * [width, height, width, height]).astype(np.int32).tolist()
+        labels = list(zip(boxes['score'].tolist(), boxes['class_id'].tolist()))
+    else:
+        coords = [[int(box[0] * width), int(box[1] * height), int(box[2] * width), int(box[3] * height)] for box in boxes]
+        labels = [(box[5], box[6]) if len(box) >= 7 else None for box in boxes]
+
+    for (x1, y1, x2, y2), label in zip(coords, labels):
         if color:
             rgb = color
         else:
             rgb = (255, 0, 0)
-        if len(box) >= 7 and class_names:
-            cls_conf = box[5]
-            cls_id = box[6]
-            print('%s: %f' % (class_names[cls_id], cls_conf))
+        if label is not None and class_names:
+            cls_conf, cls_id = label
+            if verbose:
+                print('%s: %f' % (class_names[cls_id], cls_conf))
             classes = len(class_names)
             offset = cls_id * 123457 % classes
             red = get_color(2, offset, classes)
@@ -78,7 +91,8 @@ def plot_boxes_cv2(img, boxes, savename=None, class_names=None, color=None):
             img = cv2.putText(img, class_names[cls_id], (x1, y1), cv2.FONT_HERSHEY_SIMPLEX, 1.2, rgb, 1)
         img = cv2.rectangle(img, (x1, y1), (x2, y2), rgb, 1)
     if savename:
-        print("save plot results to %s" % savename)
+        if verbose:
+            print("save plot results to %s" % savename)
         cv2.imwrite(savename, img)
     return img
 
@@ -96,19 +110,11 @@ def load_class_names(namesfile):
 def get_region_boxes(boxes_and_confs):
 
     # print('Getting boxes from boxes and confs ...')
-    boxes_list = []
-    confs_list = []
-
-    for item in boxes_and_confs:
-        boxes_list.append(item[0])
-        confs_list.append(item[1])
-
     # boxes: [batch, num1 + num2 + num3, 1, 4]
     # confs: [batch, num1 + num2 + num3, num_classes]
-    boxes = cat(boxes_list, dim=1)
-    confs = cat(confs_list, dim=1)
-        
-    return [boxes, confs]
+    # or with compact Yolo layers
+    # boxes: [batch, num1 + num2 + num3, 4], scores and classes: [batch, num1 + num2 + num3]
+    return [cat([item[i] for item in boxes_and_confs], dim=1) for i in range(len(boxes_and_confs[0]))]
 
 # Function for Non maximum suppression (CPU utilization)
 def nms_cpu(boxes, confs, nms_thresh=0.5, min_mode=False):
@@ -148,69 +154,536 @@ def nms_cpu(boxes, confs, nms_thresh=0.5, min_mode=False):
     return np.array(keep)
 
 
+# Function for keeping only the top-k candidates before NMS (partial selection, no full sort)
+def pre_nms_topk(confs, class_ids, top_k, per_class=False):
+    """Cap the number of NMS candidates of one image.
+    # Args
+        confs: float numpy array of shape (num,)
+        class_ids: int numpy array of shape (num,)
+        top_k: max candidates to keep, <= 0 for no limit
+        per_class: apply top_k to each class instead of the whole image
+    # Returns
+        indices of the surviving candidates (unordered), number of dropped candidates
+    """
+    num = confs.size
+    if top_k <= 0 or num <= top_k:
+        return np.arange(num), 0
+
+    if not per_class:
+        return np.argpartition(-confs, top_k - 1)[:top_k], num - top_k
+
+    counts = np.bincount(class_ids)
+    mask = np.ones(num, dtype=bool)
+    for j in np.flatnonzero(counts > top_k):
+        cls_idx = np.flatnonzero(class_ids == j)
+        mask[cls_idx[np.argpartition(-confs[cls_idx], top_k - 1)[top_k:]]] = False
+    keep = np.flatnonzero(mask)
+    return keep, num - keep.size
+
+# Function for Non maximum suppression with a uniform grid index (CPU utilization)
+def nms_grid_cpu(boxes, confs, nms_thresh=0.5, min_mode=False, class_ids=None):
+    """Same result as nms_cpu, but IoU is only computed between boxes sharing a grid cell.
+    # Args
+        boxes: float numpy array of shape (num, 4), x1 y1 x2 y2
+        confs: float numpy array of shape (num,)
+        class_ids: optional int numpy array of shape (num,),
+                   boxes only suppress boxes of the same class when it is given
+    # Returns
+        indices of the kept boxes, sorted by descending confidence
+    """
+    x1 = boxes[:, 0]
+    y1 = boxes[:, 1]
+    x2 = boxes[:, 2]
+    y2 = boxes[:, 3]
+
+    areas = (x2 - x1) * (y2 - y1)
+    order = confs.argsort()[::-1]
+    num = order.size
+    if num == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # Empty boxes overlap every other box through 0 / 0 and negative
+    # thresholds suppress disjoint boxes, so no spatial index applies
+    if nms_thresh < 0 or np.any(areas <= 0):
+        if class_ids is None:
+            return nms_cpu(boxes, confs, nms_thresh, min_mode)
+        keep = []
+        for j in np.unique(class_ids):
+            cls_idx = np.flatnonzero(class_ids == j)
+            keep.append(cls_idx[nms_cpu(boxes[cls_idx], confs[cls_idx], nms_thresh, min_mode)])
+        keep = np.concatenate(keep)
+        return keep[np.argsort(-confs[keep], kind='stable')]
+
+    # Cells follow the median box size, so a typical box covers about 2 x 2 cells
+    x_min = x1.min()
+    y_min = y1.min()
+    x_ext = x2.max() - x_min
+    y_ext = y2.max() - y_min
+    gx = int(min(max(x_ext / np.median(x2 - x1), 1), NMS_GRID_MAX_CELLS))
+    gy = int(min(max(y_ext / np.median(y2 - y1), 1), NMS_GRID_MAX_CELLS))
+    cx1 = np.minimum(((x1 - x_min) * (gx / x_ext)).astype(np.int64), gx - 1)
+    cx2 = np.minimum(((x2 - x_min) * (gx / x_ext)).astype(np.int64), gx - 1)
+    cy1 = np.minimum(((y1 - y_min) * (gy / y_ext)).astype(np.int64), gy - 1)
+    cy2 = np.minimum(((y2 - y_min) * (gy / y_ext)).astype(np.int64), gy - 1)
+
+    # Every class gets its own copy of the grid
+    base = np.zeros(num, dtype=np.int64)
+    num_grids = 1
+    if class_ids is not None:
+        cls_index, base = np.unique(class_ids, return_inverse=True)
+        num_grids = cls_index.size
+        base = base.reshape(-1) * (gx * gy)
+
+    # (box, cell) pairs for every cell a box covers, grouped by cell
+    ncx = cx2 - cx1 + 1
+    ncell = ncx * (cy2 - cy1 + 1)
+    pair_box = np.repeat(np.arange(num), ncell)
+    local = np.arange(pair_box.size) - np.repeat(np.cumsum(ncell) - ncell, ncell)
+    pair_cell = base[pair_box] + (cy1[pair_box] + local // ncx[pair_box]) * gx + cx1[pair_box] + local % ncx[pair_box]
+    cell_order = np.argsort(pair_cell, kind='stable')
+    cell_boxes = pair_box[cell_order]
+    cell_start = np.searchsorted(pair_cell[cell_order], np.arange(num_grids * gx * gy + 1))
+
+    rank = np.empty(num, dtype=np.int64)
+    rank[order] = np.arange(num)
+    suppressed = np.zeros(num, dtype=bool)
+
+    keep = []
+    for idx_self in order:
+        if suppressed[idx_self]:
+            continue
+        keep.append(idx_self)
+
+        rows = base[idx_self] + np.arange(cy1[idx_self], cy2[idx_self] + 1) * gx
+        idx_other = np.concatenate([cell_boxes[cell_start[r + cx1[idx_self]]:cell_start[r + cx2[idx_self] + 1]] for r in rows])
+        idx_other = idx_other[~suppressed[idx_other] & (rank[idx_other] > rank[idx_self])]
+        if idx_other.size == 0:
+            continue
+
+        xx1 = np.maximum(x1[idx_self], x1[idx_other])
+        yy1 = np.maximum(y1[idx_self], y1[idx_other])
+        xx2 = np.minimum(x2[idx_self], x2[idx_other])
+        yy2 = np.minimum(y2[idx_self], y2[idx_other])
+
+        w = np.maximum(0.0, xx2 - xx1)
+        h = np.maximum(0.0, yy2 - yy1)
+        inter = w * h
+
+        if min_mode:
+            over = inter / np.minimum(areas[idx_self], areas[idx_other])
+        else:
+            over = inter / (areas[idx_self] + areas[idx_other] - inter)
+
+        suppressed[idx_other[~(over <= nms_thresh)]] = True
+
+    return np.array(keep, dtype=np.int64)
+
+# Function for greedy NMS of all classes side by side, boxes grouped by class and sorted by confidence
+def _nms_by_class_cpu(boxes, class_ids, nms_thresh, min_mode):
+    x1 = boxes[:, 0]
+    y1 = boxes[:, 1]
+    x2 = boxes[:, 2]
+    y2 = boxes[:, 3]
+    areas = (x2 - x1) * (y2 - y1)
+
+    # In each round the best remaining box of each class suppresses the
+    # boxes of its own class only, so the number of rounds is the largest
+    # per-class keep count.
+    keep = []
+    alive = np.arange(class_ids.size)
+    while alive.size > 0:
+        alive_ids = class_ids[alive]
+        heads = np.flatnonzero(np.r_[True, alive_ids[1:] != alive_ids[:-1]])
+        keep.append(alive[heads])
+
+        idx_self = alive[heads[np.searchsorted(alive_ids[heads], alive_ids)]]
+        idx_other = alive
+
+        xx1 = np.maximum(x1[idx_self], x1[idx_other])
+        yy1 = np.maximum(y1[idx_self], y1[idx_other])
+        xx2 = np.minimum(x2[idx_self], x2[idx_other])
+        yy2 = np.minimum(y2[idx_self], y2[idx_other])
+
+        w = np.maximum(0.0, xx2 - xx1)
+        h = np.maximum(0.0, yy2 - yy1)
+        inter = w * h
+
+        if min_mode:
+            over = inter / np.minimum(areas[idx_self], areas[idx_other])
+        else:
+            over = inter / (areas[idx_self] + areas[idx_other] - inter)
+
+        over[heads] = np.inf
+        alive = alive[over <= nms_thresh]
+
+    return np.concatenate(keep)
+
+# Function for the pairwise IoU matrix of boxes (CPU utilization)
+def _iou_matrix(boxes, min_mode=False):
+    x1 = boxes[:, 0]
+    y1 = boxes[:, 1]
+    x2 = boxes[:, 2]
+    y2 = boxes[:, 3]
+    areas = (x2 - x1) * (y2 - y1)
+
+    w = np.maximum(0.0, np.minimum(x2[:, None], x2[None, :]) - np.maximum(x1[:, None], x1[None, :]))
+    h = np.maximum(0.0, np.minimum(y2[:, None], y2[None, :]) - np.maximum(y1[:, None], y1[None, :]))
+    inter = w * h
+
+    if min_mode:
+        return inter / np.minimum(areas[:, None], areas[None, :])
+    return inter / (areas[:, None] + areas[None, :] - inter)
+
+# Function for Matrix NMS (SOLOv2), boxes sorted by descending confidence
+def matrix_nms_cpu(boxes, confs, kernel='linear', sigma=2.0, min_mode=False):
+    """Decay the scores of one class with one pairwise IoU matrix instead of a sequential loop.
+    # Args
+        boxes: float numpy array of shape (num, 4), sorted by descending confs
+        confs: float numpy array of shape (num,), sorted in descending order
+        kernel: 'linear' or 'gaussian' decay
+        sigma: gaussian kernel parameter
+    # Returns
+        decayed confs of shape (num,)
+    """
+    # iou[i, j]: overlap of box j with the higher scored box i
+    iou = np.triu(_iou_matrix(boxes, min_mode), k=1)
+    # How much every suppressor has been suppressed itself
+    compensate = iou.max(axis=0)[:, None]
+
+    if kernel == 'gaussian':
+        decay = np.exp(-sigma * (iou ** 2 - compensate ** 2))
+    elif kernel == 'linear':
+        # A duplicate of a higher scored box has compensate 1, keep its row finite
+        decay = (1 - iou) / np.maximum(1 - compensate, 1e-6)
+    else:
+        raise ValueError('ERROR: unknown matrix nms kernel (%s)!' % kernel)
+    return confs * decay.min(axis=0)
+
+# Function for Soft-NMS of all classes side by side, boxes grouped by class
+def _soft_nms_by_class_cpu(boxes, confs, class_ids, kernel, nms_thresh, sigma, score_thresh, min_mode):
+    x1 = boxes[:, 0]
+    y1 = boxes[:, 1]
+    x2 = boxes[:, 2]
+    y2 = boxes[:, 3]
+    areas = (x2 - x1) * (y2 - y1)
+
+    # In each round the best remaining box of each class is kept and decays
+    # the scores of the remaining boxes of its own class.
+    scores = confs.copy()
+    keep = []
+    keep_scores = []
+    alive = np.flatnonzero(scores > score_thresh)
+    while alive.size > 0:
+        alive_ids = class_ids[alive]
+        alive_scores = scores[alive]
+        new_seg = np.r_[True, alive_ids[1:] != alive_ids[:-1]]
+        seg = np.cumsum(new_seg) - 1
+        seg_max = np.maximum.reduceat(alive_scores, np.flatnonzero(new_seg))
+        heads = np.flatnonzero(alive_scores == seg_max[seg])
+        heads = heads[np.r_[True, seg[heads][1:] != seg[heads][:-1]]]
+        keep.append(alive[heads])
+        keep_scores.append(alive_scores[heads])
+
+        idx_self = alive[heads[seg]]
+        idx_other = alive
+
+        xx1 = np.maximum(x1[idx_self], x1[idx_other])
+        yy1 = np.maximum(y1[idx_self], y1[idx_other])
+        xx2 = np.minimum(x2[idx_self], x2[idx_other])
+        yy2 = np.minimum(y2[idx_self], y2[idx_other])
+
+        w = np.maximum(0.0, xx2 - xx1)
+        h = np.maximum(0.0, yy2 - yy1)
+        inter = w * h
+
+        if min_mode:
+            over = inter / np.minimum(areas[idx_self], areas[idx_other])
+        else:
+            over = inter / (areas[idx_self] + areas[idx_other] - inter)
+
+        if kernel == 'gaussian':
+            scores[alive] = alive_scores * np.exp(-(over * over) / sigma)
+        else:
+            scores[alive] = alive_scores * np.where(over > nms_thresh, 1 - over, 1)
+
+        alive_mask = scores[alive] > score_thresh
+        alive_mask[heads] = False
+        alive = alive[alive_mask]
+
+    return np.concatenate(keep), np.concatenate(keep_scores)
+
+# Function for batched multi-class NMS (CPU fallback of BatchedNMS_TRT)
+def batched_nms_cpu(boxes, confs, class_ids, nms_thresh=0.5, top_k=-1, keep_top_k=-1, min_mode=False,
+                    method='greedy', score_thresh=0.0, sigma=0.5):
+    """Run NMS for all classes of one image in a single pass.
+    # Args
+        boxes: float numpy array of shape (num, 4), x1 y1 x2 y2
+        confs: float numpy array of shape (num,)
+        class_ids: int numpy array of shape (num,)
+        nms_thresh: IoU threshold (BatchedNMS_TRT iouThreshold), unused by 'matrix'
+        top_k: max candidates per class before NMS (BatchedNMS_TRT topK), <= 0 for no limit,
+               MATRIX_NMS_TOP_K for 'matrix'
+        keep_top_k: max detections per image after NMS (BatchedNMS_TRT keepTopK), <= 0 for no limit
+        method: 'greedy', 'grid' (spatially indexed, for very large candidate sets),
+                'matrix' (Matrix NMS, linear kernel), 'soft-linear' or 'soft-gaussian' (Soft-NMS)
+        score_thresh: min decayed score kept by 'matrix' and 'soft-*'
+        sigma: gaussian kernel parameter of 'soft-gaussian'
+    # Returns
+        indices of the kept boxes sorted by descending score, their scores
+        (decayed by 'matrix' and 'soft-*', confs[keep] otherwise)
+    """
+    if confs.size == 0:
+        return np.zeros(0, dtype=np.int64), confs[:0]
+
+    # Group candidates by class, highest confidence first inside each class
+    order = np.lexsort((-confs, class_ids))
+    sorted_ids = class_ids[order]
+    if method == 'matrix' and top_k <= 0:
+        top_k = MATRIX_NMS_TOP_K
+    if top_k > 0:
+        rank = np.arange(order.size) - np.searchsorted(sorted_ids, sorted_ids, side='left')
+        order = order[rank < top_k]
+        sorted_ids = sorted_ids[rank < top_k]
+
+    if method == 'greedy':
+        keep = order[_nms_by_class_cpu(boxes[order], sorted_ids, nms_thresh, min_mode)]
+        scores = confs[keep]
+    elif method == 'grid':
+        keep = order[nms_grid_cpu(boxes[order], confs[order], nms_thresh, min_mode, sorted_ids)]
+        scores = confs[keep]
+    elif method == 'matrix':
+        scores = confs[order]
+        starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+        ends = np.r_[starts[1:], order.size]
+        for start, end in zip(starts, ends):
+            scores[start:end] = matrix_nms_cpu(boxes[order[start:end]], scores[start:end], min_mode=min_mode)
+        keep = order[scores > score_thresh]
+        scores = scores[scores > score_thresh]
+    elif method in ('soft-linear', 'soft-gaussian'):
+        keep, scores = _soft_nms_by_class_cpu(boxes[order], confs[order], sorted_ids, method[5:],
+                                              nms_thresh, sigma, score_thresh, min_mode)
+        keep = order[keep]
+    else:
+        raise ValueError('ERROR: unknown nms method (%s)!' % method)
+
+    sort = np.argsort(-scores, kind='stable')
+    if keep_top_k > 0:
+        sort = sort[:keep_top_k]
+    return keep[sort], scores[sort]
+
+# Function for reading BatchedNMS_TRT attributes from a graph surgery json as post_processing arguments
+def load_batched_nms_params(json_file):
+    import json
+    with open(json_file, 'r') as fp:
+        node_param = json.load(fp)['add_node_req']['node_param']
+    return {
+        'conf_thresh' : node_param['scoreThreshold'],
+        'nms_thresh'  : node_param['iouThreshold'],
+        'top_k'       : node_param['topK'],
+        'keep_top_k'  : node_param['keepTopK'],
+        'multi_label' : True,
+    }
+
+# Batched detections: one contiguous DETECTION_DTYPE array for the whole batch and per-image offsets
+class Detections(object):
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return self.offsets.size - 1
+
+    # Detections of image i as a view on self.data
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        return self.data[self.offsets[i]:self.offsets[i + 1]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    # Conversion for old callers: lists of [x1, y1, x2, y2, conf, conf, cls_id] per image
+    def tolist(self):
+        bboxes_batch = []
+        for dets in self:
+            confs = dets['score'].tolist()
+            bboxes_batch.append([box + [conf, conf, cls_id] for box, conf, cls_id in
+                                 zip(dets['box'].tolist(), confs, dets['class_id'].tolist())])
+        return bboxes_batch
+
+    def __repr__(self):
+        return 'Detections(batch=%d, boxes=%d)' % (len(self), self.data.size)
+
+# Function for post processing a chunk of the batch, run by post_processing or its worker pool
+def _post_processing_chunk(box_array, confs, conf_thresh, nms_thresh, top_k, keep_top_k, multi_label,
+                           pre_nms_top_k, pre_nms_per_class, method):
+    t1 = time.time()
+
+    if isinstance(confs, tuple):
+        # Compact outputs, the max and argmax were already taken in the model
+        max_conf, max_id = confs
+    elif not multi_label:
+        # [batch, num, num_classes] --> [batch, num]
+        max_conf = np.max(confs, axis=2)
+        max_id = np.argmax(confs, axis=2)
+
+    t2 = time.time()
+
+    num_candidates = 0
+    num_dropped = 0
+    bboxes_batch = []
+    for i in range(box_array.shape[0]):
+        if multi_label:
+            argwhere, l_max_id = np.nonzero(confs[i] > conf_thresh)
+            l_max_conf = confs[i, argwhere, l_max_id]
+        else:
+            argwhere = np.nonzero(max_conf[i] > conf_thresh)[0]
+            l_max_conf = max_conf[i, argwhere]
+            l_max_id = max_id[i, argwhere]
+        num_candidates += argwhere.size
+
+        if pre_nms_top_k > 0:
+            topk, dropped = pre_nms_topk(l_max_conf, l_max_id, pre_nms_top_k, pre_nms_per_class)
+            argwhere = argwhere[topk]
+            l_max_conf = l_max_conf[topk]
+            l_max_id = l_max_id[topk]
+            num_dropped += dropped
+        l_box_array = box_array[i, argwhere, :]
+
+        # nms for all classes at once
+        keep, ll_max_conf = batched_nms_cpu(l_box_array, l_max_conf, l_max_id, nms_thresh, top_k, keep_top_k,
+                                            method=method, score_thresh=conf_thresh)
+
+        bboxes_batch.append((l_box_array[keep, :], ll_max_conf, l_max_id[keep]))
+
+    t3 = time.time()
+
+    return bboxes_batch, num_candidates, num_dropped, t2 - t1, t3 - t2
+
+# Persistent worker pools of post_processing, one per number of workers
+_post_processing_pools = {}
+
+# Function for the number of cores this process may run on (its CPU affinity, e.g. in a container)
+def get_usable_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def get_post_processing_pool(num_workers):
+    if num_workers not in _post_processing_pools:
+        from concurrent.futures import ThreadPoolExecutor
+        _post_processing_pools[num_workers] = ThreadPoolExecutor(max_workers=num_workers,
+                                                                 thread_name_prefix='post_processing')
+    return _post_processing_pools[num_workers]
+
 # Yolo test helper function for post part
-def post_processing(img, conf_thresh, nms_thresh, output):
+def post_processing(img, conf_thresh, nms_thresh, output, top_k=-1, keep_top_k=-1, multi_label=False,
+                    pre_nms_top_k=-1, pre_nms_per_class=False, method='greedy', num_workers=0,
+                    metrics=None, verbose=False):
     # anchors = [12, 16, 19, 36, 40, 28, 36, 75, 76, 55, 72, 146, 142, 110, 192, 243, 459, 401]
     # num_anchors = 9
     # anchor_masks = [[0, 1, 2], [3, 4, 5], [6, 7, 8]]
     # strides = [8, 16, 32]
     # anchor_step = len(anchors) // num_anchors
-
-    # [batch, num, 1, 4]
+    #
+    # multi_label=False keeps only the best class of each box,
+    # multi_label=True  keeps every class above conf_thresh like BatchedNMS_TRT does
+    # pre_nms_top_k caps the candidates of each image (or of each class with
+    # pre_nms_per_class=True) before NMS to bound the worst case latency
+    # method='grid' uses the spatially indexed NMS for very large candidate sets,
+    # 'matrix', 'soft-linear' and 'soft-gaussian' decay scores instead of
+    # removing boxes (see batched_nms_cpu). 'matrix' needs N x N memory for
+    # the N candidates of a class, without top_k it keeps the best
+    # MATRIX_NMS_TOP_K (500) of each class
+    # num_workers > 1 splits the batch across a persistent thread pool,
+    # numpy releases the GIL for most of the work. It is opt-in: each chunk
+    # costs a pool dispatch, so it only pays off with several usable cores and
+    # chunks of many candidates (large batches, low conf_thresh). num_workers
+    # is capped by the usable cores, one core always runs the serial path.
+    # benchmarks/bench_post_processing.py prints the break-even batch and
+    # candidate count of a target
+    # Stage latencies and candidate counts go to metrics (tools.metrics
+    # default registry if None), verbose=True also prints them
+    #
+    # Compact outputs [boxes, scores, classes] of Darknet.set_compact_output()
+    # skip the max and argmax, multi_label needs the full confs then
+    #
+    # Returns Detections, use Detections.tolist() for the old nested list format
+
+    # [batch, num, 1, 4] or [batch, num, 4] (compact)
     box_array = output[0]
-    # [batch, num, num_classes]
-    confs = output[1]
+    # [batch, num, num_classes] or [batch, num] scores and [batch, num] classes (compact)
+    confs = output[1:]
 
     t1 = time.time()
 
     if type(box_array).__name__ != 'ndarray':
         box_array = box_array.cpu().detach().numpy()
-        confs = confs.cpu().detach().numpy()
+        confs = [c.cpu().detach().numpy() for c in confs]
 
-    num_classes = confs.shape[2]
+    if len(confs) == 2:
+        if multi_label:
+            raise ValueError('ERROR: multi_label needs the full confs output, not the compact one!')
+        compact = True
+    else:
+        compact = False
+        confs = confs[0]
 
     # [batch, num, 4]
-    box_array = box_array[:, :, 0]
-
-    # [batch, num, num_classes] --> [batch, num]
-    max_conf = np.max(confs, axis=2)
-    max_id = np.argmax(confs, axis=2)
-
-    t2 = time.time()
-
-    bboxes_batch = []
-    for i in range(box_array.shape[0]):
-        argwhere = max_conf[i] > conf_thresh
-        l_box_array = box_array[i, argwhere, :]
-        l_max_conf = max_conf[i, argwhere]
-        l_max_id = max_id[i, argwhere]
-
-        bboxes = []
-        # nms for each class
-        for j in range(num_classes):
-            cls_argwhere = l_max_id == j
-            ll_box_array = l_box_array[cls_argwhere, :]
-            ll_max_conf = l_max_conf[cls_argwhere]
-            ll_max_id = l_max_id[cls_argwhere]
-
-            keep = nms_cpu(ll_box_array, ll_max_conf, nms_thresh)
-            
-            if (keep.size > 0):
-                ll_box_array = ll_box_array[keep, :]
-                ll_max_conf = ll_max_conf[keep]
-                ll_max_id = ll_max_id[keep]
-
-                for k in range(ll_box_array.shape[0]):
-                    bboxes.append([ll_box_array[k, 0], ll_box_array[k, 1], ll_box_array[k, 2], ll_box_array[k, 3], ll_max_conf[k], ll_max_conf[k], ll_max_id[k]])
-        
-        bboxes_batch.append(bboxes)
+    if box_array.ndim == 4:
+        box_array = box_array[:, :, 0]
+
+    args = (conf_thresh, nms_thresh, top_k, keep_top_k, multi_label, pre_nms_top_k, pre_nms_per_class, method)
+    batch = box_array.shape[0]
+    num_workers = min(num_workers, get_usable_cores())
+    if num_workers > 1 and batch > 1:
+        bounds = np.linspace(0, batch, min(num_workers, batch) + 1).astype(np.int64)
+        pool = get_post_processing_pool(num_workers)
+        chunks = [pool.submit(_post_processing_chunk, box_array[s:e],
+                              (confs[0][s:e], confs[1][s:e]) if compact else confs[s:e], *args)
+                  for s, e in zip(bounds[:-1], bounds[1:])]
+        chunks = [chunk.result() for chunk in chunks]
+    else:
+        chunks = [_post_processing_chunk(box_array, tuple(confs) if compact else confs, *args)]
+
+    bboxes_batch = [bboxes for chunk in chunks for bboxes in chunk[0]]
+    num_candidates = sum(chunk[1] for chunk in chunks)
+    num_dropped = sum(chunk[2] for chunk in chunks)
+    # Wall time of the stages, the chunks run at the same time
+    t_max = max(chunk[3] for chunk in chunks)
+    t_nms = max(chunk[4] for chunk in chunks)
+
+    num_boxes = np.zeros(batch + 1, dtype=np.int64)
+    num_boxes[1:] = [bboxes[1].size for bboxes in bboxes_batch]
+    offsets = np.cumsum(num_boxes)
+    detections = np.empty(offsets[-1], dtype=DETECTION_DTYPE)
+    for i, (ll_box_array, ll_max_conf, ll_max_id) in enumerate(bboxes_batch):
+        detections['box'][offsets[i]:offsets[i + 1]] = ll_box_array
+        detections['score'][offsets[i]:offsets[i + 1]] = ll_max_conf
+        detections['class_id'][offsets[i]:offsets[i + 1]] = ll_max_id
 
     t3 = time.time()
 
-    print('-----------------------------------')
-    print('       max and argmax : %f' % (t2 - t1))
-    print('                  nms : %f' % (t3 - t2))
-    print('Post processing total : %f' % (t3 - t1))
-    print('-----------------------------------')
-    
-    return bboxes_batch
+    if metrics is None:
+        metrics = get_metrics()
+    metrics.observe('post_processing.max_argmax', t_max)
+    metrics.observe('post_processing.nms', t_nms)
+    metrics.observe('post_processing.total', t3 - t1)
+    metrics.increment('post_processing.images', batch)
+    metrics.increment('post_processing.candidates', num_candidates)
+    metrics.increment('post_processing.pre_nms_dropped', num_dropped)
+    metrics.increment('post_processing.detections', int(offsets[-1]))
+
+    if verbose:
+        print('-----------------------------------')
+        print('       max and argmax : %f' % t_max)
+        print('                  nms : %f' % t_nms)
+        print('           candidates : %d' % num_candidates)
+        if pre_nms_top_k > 0:
+            print('pre-nms top-k dropped : %d' % num_dropped)
+        print('           detections : %d' % offsets[-1])
+        print('Post processing total : %f' % (t3 - t1))
+        print('-----------------------------------')
+
+    return Detections(detections, offsets)
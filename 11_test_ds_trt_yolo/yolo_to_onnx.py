@@ -19,6 +19,8 @@
 import os
 import sys
 import cv2
+import time
+import json
 import onnx
 import torch
 import argparse
@@ -26,9 +28,47 @@ import onnxruntime
 import numpy as np
 
 from tools.onnx.net.darknet import Darknet
+from tools.onnx.net.darknet_cfg import Darknet_cfg, get_onnx_file_name, parse_input_size
+from tools.onnx.onnx_specialize import specialize_onnx
+from tools.onnx.onnx_builder import ONNX_OPSET
+from tools.pipeline import list_images
+from tools.preprocess import preprocess_into, restore_boxes
+from tools.artifact_cache import ArtifactCache, source_files
+from tools.utils import post_processing, load_class_names, plot_boxes_cv2
 
-# Convert Darknet to Onnx
-def transform_to_onnx(model_file, config_file, batch_size, onnx_path):
+# Code that changes the exported graph, part of the cache key and of the export info
+EXPORT_SOURCES = ('tools/onnx/net', 'tools/onnx/layer', 'tools/utils.py')
+
+# Function for the options of one exported variant
+def get_export_options(batch_size, height, width, compact=False, compact_thresh=None, fuse=True):
+    return {'batch_size': batch_size, 'height': height, 'width': width, 'opset': ONNX_OPSET,
+            'compact': compact, 'compact_thresh': compact_thresh, 'fuse': fuse, 'torch': torch.__version__}
+
+# Function for the export info of an ONNX file: its options, the size and mtime of itself, its cfg, weights and code
+def get_export_info(onnx_file, model_file, config_file, options):
+    files = [config_file, model_file] + source_files(*EXPORT_SOURCES)
+    # The ONNX file itself, rewriting it in place (swap_weights.py, graph surgery) makes the info stale
+    stat = os.stat(onnx_file)
+    return {'options': options, 'output': [stat.st_size, stat.st_mtime],
+            'sources': [[f, os.stat(f).st_size, os.stat(f).st_mtime] for f in files]}
+
+# Function for the sidecar of an exported ONNX file, {onnx_file}.json
+def save_export_info(onnx_file, model_file, config_file, options):
+    with open(onnx_file + '.json.tmp', 'w') as fp:
+        json.dump(get_export_info(onnx_file, model_file, config_file, options), fp, indent=2)
+    os.replace(onnx_file + '.json.tmp', onnx_file + '.json')
+
+# Function for checking that an unchanged ONNX file matches the export options and its cfg, weights and code
+def is_onnx_up_to_date(onnx_file, model_file, config_file, options):
+    if not os.path.isfile(onnx_file) or not os.path.isfile(onnx_file + '.json'):
+        return False
+    with open(onnx_file + '.json') as fp:
+        info = json.load(fp)
+    # Through json, like the stored info
+    return info == json.loads(json.dumps(get_export_info(onnx_file, model_file, config_file, options)))
+
+# Function for building Darknet and loading its weights once, for every exported variant
+def load_darknet(model_file, config_file, compact=False, compact_thresh=None, fuse=True, weights_cache=False):
     # Building Darknet by torch
     model = Darknet(config_file)
     print('Buliding Darknet from %s... Done!' % (model_file))
@@ -37,134 +77,303 @@ def transform_to_onnx(model_file, config_file, batch_size, onnx_path):
     model.print_network()
 
     # Loading weights to Darknet
-    model.load_weights(model_file)
+    model.load_weights(model_file, cache=weights_cache)
     print('Loading weights from %s... Done!' % (model_file))
 
+    # Folding BatchNorm into the convolutions, one op per layer
+    if fuse:
+        model.fuse_conv_bn()
+
+    if compact:
+        # Top-1 score and class of every box instead of the confs of all classes
+        model.set_compact_output(True, compact_thresh)
+    return model
+
+# Function for exporting one (batch, resolution) variant of a loaded Darknet
+def export_onnx(model, model_file, batch_size, height, width, onnx_path, compact=False):
     # Input and Output define
     input_names = ["input"]
-    output_names = ['boxes', 'confs']
-
-    onnx_path = "models/onnx/"
-    os.makedirs(onnx_path, exist_ok=True)
-    model_name_parts = model_file.split('.weights')[0].split('/')[-1].split('-')
-    model_name = model_name_parts[0]
-    for _str in model_name_parts:
-        if _str.isalpha():
-            model_name += "-" + _str
+    output_names = ['boxes', 'scores', 'classes'] if compact else ['boxes', 'confs']
+    onnx_file_name = get_onnx_file_name(model_file, height, width, batch_size, compact)
 
-    # Exporting ONNX model from Darknet
+    # Exporting ONNX model from Darknet, the cfg layers do not depend on the input size of the net block
     if batch_size <= 0:
-        x = torch.randn((batch_size, 3, model.height, model.width), requires_grad=True)
-        onnx_file_name = "{}_-1_3_{}_{}_dynamic.onnx".format(model_name, model.height, model.width)
-        dynamic_axes = {"input": {0: "batch_size"}, "boxes": {0: "batch_size"}, "confs": {0: "batch_size"}}
-        # Export the model
-        print('Export the onnx model ...')
-        torch.onnx.export(model,
-                          x,
-                          onnx_path + onnx_file_name,
-                          export_params=True,
-                          opset_version=12,
-                          do_constant_folding=True,
-                          verbose=True,
-                          input_names=input_names, output_names=output_names,
-                          dynamic_axes=dynamic_axes)
-
-        print('Onnx model exporting done')
-        print('Please check >>> \"%s\"'%(onnx_path + onnx_file_name))
+        x = torch.randn((1, 3, height, width), requires_grad=True)
+        dynamic_axes = {name: {0: "batch_size"} for name in input_names + output_names}
     else:
-        x = torch.randn((batch_size, 3, model.height, model.width), requires_grad=True)
-        onnx_file_name = "{}_{}_3_{}_{}_static.onnx".format(model_name, batch_size, model.height, model.width)
-        torch.onnx.export(model,
-                          x,
-                          onnx_path + onnx_file_name,
-                          export_params=True,
-                          opset_version=12,
-                          do_constant_folding=True,
-                          verbose=True,
-                          input_names=input_names, output_names=output_names,
-                          dynamic_axes=None)
-
-        print('Onnx model exporting done')
-        print('Please check >>> \"%s\"'%(onnx_path + onnx_file_name))
+        x = torch.randn((batch_size, 3, height, width), requires_grad=True)
+        dynamic_axes = None
+    print('Export the onnx model ...')
+    torch.onnx.export(model,
+                      x,
+                      onnx_path + onnx_file_name,
+                      export_params=True,
+                      opset_version=ONNX_OPSET,
+                      do_constant_folding=True,
+                      verbose=True,
+                      input_names=input_names, output_names=output_names,
+                      dynamic_axes=dynamic_axes)
+
+    print('Onnx model exporting done')
+    print('Please check >>> \"%s\"'%(onnx_path + onnx_file_name))
     return onnx_file_name
 
+# Convert Darknet to Onnx
+def transform_to_onnx(model_file, config_file, batch_size, onnx_path, compact=False, compact_thresh=None, fuse=True,
+                      weights_cache=False, input_sizes=None, cache_dir=None, specialize=False):
+    """Export every (batch, input size) variant from one loaded model.
+    # Args
+        batch_size: int or list of ints, 0/-1 for the dynamic batch
+        input_sizes: list of 608 or '416x608' sizes, the net block of the cfg if None
+        cache_dir: ArtifactCache directory, variants whose cfg, weights, code and options
+                   are unchanged are copied from it without loading the model
+        specialize: trace only the dynamic batch of the first input size, the other
+                    variants are rewritten from its graph (tools/onnx/onnx_specialize.py)
+    # Returns
+        onnx_file_name of a single variant, the list of them for lists of batch sizes or input sizes
+    """
+    onnx_path = "models/onnx/"
+    os.makedirs(onnx_path, exist_ok=True)
+
+    cache = ArtifactCache(cache_dir) if cache_dir else None
+    net = Darknet_cfg().parse_cfg(config_file)[0]
+    batch_sizes = batch_size if isinstance(batch_size, (list, tuple)) else [batch_size]
+    sizes = [parse_input_size(size) for size in input_sizes] if input_sizes else [(int(net['height']), int(net['width']))]
+    variants = [(height, width, batch if batch > 0 else -1) for height, width in sizes for batch in batch_sizes]
+    base = None
+    if specialize:
+        # The traced base comes first, the other variants are rewritten from it
+        base = (sizes[0][0], sizes[0][1], -1)
+        variants = [base] + [variant for variant in variants if variant != base]
+        base_name = get_onnx_file_name(model_file, base[0], base[1], -1, compact)
+    model = None
+    summary = []
+    for height, width, batch in dict.fromkeys(variants):
+        t = time.time()
+        onnx_file_name = get_onnx_file_name(model_file, height, width, batch, compact)
+        options = get_export_options(batch, height, width, compact, compact_thresh, fuse)
+        if base is not None and (height, width, batch) != base:
+            specialize_onnx(onnx_path + base_name, batch, height, width, onnx_path)
+            save_export_info(onnx_path + onnx_file_name, model_file, config_file, options)
+            summary.append((onnx_file_name, batch, height, width, time.time() - t, 'rewritten'))
+            continue
+        if cache is not None:
+            code = source_files(*EXPORT_SOURCES)
+            key, inputs = cache.key('onnx_export', {'cfg': config_file, 'weights': model_file, 'code': code},
+                                    options)
+            if cache.fetch(key, onnx_path + onnx_file_name):
+                save_export_info(onnx_path + onnx_file_name, model_file, config_file, options)
+                summary.append((onnx_file_name, batch, height, width, time.time() - t, 'cached'))
+                continue
+        if model is None:
+            model = load_darknet(model_file, config_file, compact, compact_thresh, fuse, weights_cache)
+            t = time.time()
+        export_onnx(model, model_file, batch, height, width, onnx_path, compact)
+        seconds = time.time() - t
+        save_export_info(onnx_path + onnx_file_name, model_file, config_file, options)
+        if cache is not None:
+            cache.store(key, inputs, onnx_path + onnx_file_name, seconds)
+        summary.append((onnx_file_name, batch, height, width, seconds, 'exported'))
+
+    if len(summary) == 1:
+        return summary[0][0]
+    print('%-56s %6s %11s %10s %9s' % ('onnx file', 'batch', 'input', 'export(s)', 'status'))
+    for onnx_file_name, batch, height, width, seconds, status in summary:
+        print('%-56s %6s %11s %10.1f %9s' % (onnx_file_name, batch if batch > 0 else 'dynamic',
+                                             '%dx%d' % (height, width), seconds, status))
+    return [onnx_file_name for onnx_file_name, _, _, _, _, _ in summary]
+
 # Test function for detection with exported onnx model by onnxruntime
-def detect(session, image_file, label_file):
+def detect(session, image_file, label_file, letterbox=False):
     IN_IMAGE_H = session.get_inputs()[0].shape[2]
     IN_IMAGE_W = session.get_inputs()[0].shape[3]
 
     # Input
-    image_src = cv2.imread(input_file)
-    resized = cv2.resize(image_src, (IN_IMAGE_W, IN_IMAGE_H), interpolation=cv2.INTER_LINEAR)
-    img_in = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)
-    img_in = np.transpose(img_in, (2, 0, 1)).astype(np.float32)
-    img_in = np.expand_dims(img_in, axis=0)
-    img_in /= 255.0
+    image_src = cv2.imread(image_file)
+    img_in = np.empty((1, 3, IN_IMAGE_H, IN_IMAGE_W), dtype=np.float32)
+    meta = preprocess_into(image_src, img_in[0], letterbox)
     print("Shape of the network input: ", img_in.shape)
 
     # Compute
     input_name = session.get_inputs()[0].name
     outputs = session.run(None, {input_name: img_in})
     boxes = post_processing(img_in, 0.4, 0.6, outputs)
+    if letterbox:
+        boxes[0]['box'] = restore_boxes(boxes[0]['box'], meta)
 
     class_names = load_class_names(label_file)
     plot_boxes_cv2(image_src, boxes[0], savename='predictions_onnx.jpg', class_names=class_names)
 
+# Test function for batched detection over many images, detections are written as JSON Lines
+def detect_batch(session, image_files, label_file, batch_size, jsonl_file, conf_thresh=0.4, nms_thresh=0.6,
+                 letterbox=False):
+    input_shape = session.get_inputs()[0].shape
+    IN_IMAGE_H = input_shape[2]
+    IN_IMAGE_W = input_shape[3]
+    # Static batch models always take a full batch, dynamic ones take batch_size
+    static_batch = isinstance(input_shape[0], int) and input_shape[0] > 0
+    if static_batch:
+        batch_size = input_shape[0]
+    input_name = session.get_inputs()[0].name
+    class_names = load_class_names(label_file) if label_file else None
+
+    # One input buffer reused by every batch
+    img_in = np.zeros((batch_size, 3, IN_IMAGE_H, IN_IMAGE_W), dtype=np.float32)
+    print("Shape of the network input: ", img_in.shape)
+
+    num_images = 0
+    with open(jsonl_file, 'w') as fp:
+        for start in range(0, len(image_files), batch_size):
+            batch_files = []
+            for image_file in image_files[start:start + batch_size]:
+                image_src = cv2.imread(image_file)
+                if image_src is None:
+                    print('WARNING: failed to read %s' % image_file)
+                    continue
+                meta = preprocess_into(image_src, img_in[len(batch_files)], letterbox)
+                batch_files.append((image_file, image_src.shape[1], image_src.shape[0], meta))
+            if not batch_files:
+                continue
+
+            outputs = session.run(None, {input_name: img_in if static_batch else img_in[:len(batch_files)]})
+            detections = post_processing(img_in, conf_thresh, nms_thresh, outputs)
+
+            for (image_file, width, height, meta), dets in zip(batch_files, detections):
+                if letterbox:
+                    dets['box'] = restore_boxes(dets['box'], meta)
+                record = {'image': image_file, 'width': width, 'height': height, 'detections': [
+                    {'box': box, 'score': score, 'class_id': cls_id} for box, score, cls_id in
+                    zip(dets['box'].tolist(), dets['score'].tolist(), dets['class_id'].tolist())]}
+                if class_names:
+                    for det in record['detections']:
+                        det['class'] = class_names[det['class_id']]
+                fp.write(json.dumps(record) + '\n')
+            num_images += len(batch_files)
+
+    print('Detections of %d images have been written to %s' % (num_images, jsonl_file))
+
 # Main function
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument(
-        '-m', '--model_file', type=str, required=True,
+        '-m', '--model_file', type=str,
         help=('Put YOLO model file path'
               'Samples are like models/yolovX[-spp|]-[288|416|608].weights'))
     parser.add_argument(
-        '-c', '--config_file', type=str, required=True,
+        '-c', '--config_file', type=str,
         help=('Put YOLO model configuration file path'
               'Samples are like models/yolovX-[288|416|608].cfg'))
     parser.add_argument(
-        '-b', '--batch_size', type=int, default=-1,
+        '-b', '--batch_size', type=int, nargs='+', default=[-1],
         help=('Set specific batchsize'
               'For dyamic batch, set 0/-1 (Default)'
-              'For static batch  set [1, N]'))
+              'For static batch  set [1, N]'
+              ' Several batch sizes are exported from one loaded model, e.g. -b 8 4 -1'))
+    parser.add_argument(
+        '-s', '--input_sizes', type=str, nargs='+',
+        help=('Input sizes to export like 416 or 416x608 (height x width), all from one loaded model'
+              ' [the size of the cfg]'))
     parser.add_argument(
         '-o', '--output_file', type=str, default="models/onnx/",
         help=('Put Output ONNX file path'
               'Samples are like models/onnx/yolovX_{batch}_{channel}_{height}_{width}_[static|dynamic].onnx'))
+    parser.add_argument(
+        '--compact', default=False, action="store_true",
+        help=('Output the top-1 score and class of every box (boxes, scores, classes)'
+              ' instead of the confs of all classes, for engines without the NMS plugin'))
+    parser.add_argument(
+        '--compact_thresh', type=float,
+        help='With --compact, set the scores below this confidence threshold to 0 in the model')
+    parser.add_argument(
+        '--no_fuse', default=False, action="store_true",
+        help='Export the BatchNorm layers as they are instead of folding them into the convolutions')
+    parser.add_argument(
+        '--weights_cache', default=False, action="store_true",
+        help='Map the weights from the sidecar cache {model_file}.cache.npy, written on the first run')
+    parser.add_argument(
+        '--cache_dir', type=str,
+        help=('Reuse the exports of unchanged cfg, weights and options from this artifact cache'
+              ' (e.g. models/cache), new exports are added to it'))
+    parser.add_argument(
+        '--specialize', default=False, action="store_true",
+        help=('Trace only the dynamic batch of the first input size, the other batch sizes and input sizes'
+              ' are rewritten from its graph in seconds (see specialize_onnx.py)'))
     parser.add_argument(
         '-t','--test', default=False, action="store_true",
         help = "Flag to do test with converted onnx model by onnxruntime")
     parser.add_argument(
         '-i', '--input_test', type=str,
-        help='Put input file path for test')
+        help=('Put input file path for test.'
+              ' A directory or a glob pattern of images runs the batched test and writes JSON Lines'))
     parser.add_argument(
         '-l', '--label_file', type=str,
         help='Put label of classes file path')
+    parser.add_argument(
+        '-x', '--onnx_file', type=str,
+        help='Test an existing ONNX file instead of exporting one (-m/-c are not needed then)')
+    parser.add_argument(
+        '--test_batch', type=int, default=8,
+        help='Batch size of the batched test for dynamic batch ONNX models [8]')
+    parser.add_argument(
+        '--jsonl_file', type=str, default='predictions_onnx.jsonl',
+        help='Output JSON Lines file of the batched test [predictions_onnx.jsonl]')
+    parser.add_argument(
+        '--letterbox', default=False, action="store_true",
+        help='Keep the aspect ratio of test images and pad them to the network input')
     args = parser.parse_args()
 
-    if not os.path.isfile(args.model_file):
-        raise SystemExit('ERROR: Model file (%s) not found!' % weights_file_path)
-    if not os.path.isfile(args.config_file):
-        raise SystemExit('ERROR: Model config file (%s) not found!' % weights_file_path)
+    if args.onnx_file is None or not args.test:
+        if args.model_file is None or args.config_file is None:
+            parser.error('--model_file and --config_file are required unless --test runs with --onnx_file.')
+        if not os.path.isfile(args.model_file):
+            raise SystemExit('ERROR: Model file (%s) not found!' % args.model_file)
+        if not os.path.isfile(args.config_file):
+            raise SystemExit('ERROR: Model config file (%s) not found!' % args.config_file)
 
     if args.test == False:
-        if args.batch_size <= 0:
-            # Transform to onnx as dynamicspecified batch size
-            transform_to_onnx(args.model_file, args.config_file, args.batch_size, args.output_file)
-        else:
-            # Transform to onnx as specified batch size
-            transform_to_onnx(args.model_file, args.config_file, args.batch_size, args.output_file)
+        # Transform to onnx as the specified batch sizes (0/-1 for dynamic) and input sizes
+        transform_to_onnx(args.model_file, args.config_file, args.batch_size, args.output_file,
+                          args.compact, args.compact_thresh, not args.no_fuse,
+                          args.weights_cache, args.input_sizes, args.cache_dir, args.specialize)
     else:
-        if args.input_test == None and args.label_file==None:
+        if args.input_test == None:
+            raise SystemExit('ERROR: You need to put options --input_test and --label_file for testing onnx file.')
+        batch_test = not os.path.isfile(args.input_test)
+        if not batch_test and args.label_file == None:
             raise SystemExit('ERROR: You need to put options --input_test and --label_file for testing onnx file.')
-        # Transform to onnx as demo
-        onnx_path_demo = transform_to_onnx(args.model_file, args.config_file, 1, args.output_file)
+
+        if args.onnx_file:
+            onnx_path_demo = args.onnx_file
+        else:
+            # Transform to onnx as demo, batch 1 for one image and the requested batch for many
+            demo_batch = args.batch_size[0] if batch_test else 1
+            net = Darknet_cfg().parse_cfg(args.config_file)[0]
+            onnx_path_demo = "models/onnx/" + get_onnx_file_name(args.model_file, int(net['height']), int(net['width']), demo_batch,
+                                                              args.compact)
+            options = get_export_options(demo_batch if demo_batch > 0 else -1, int(net['height']), int(net['width']),
+                                         args.compact, args.compact_thresh, not args.no_fuse)
+            if is_onnx_up_to_date(onnx_path_demo, args.model_file, args.config_file, options):
+                print('Reusing up-to-date %s' % onnx_path_demo)
+            else:
+                onnx_path_demo = "models/onnx/" + transform_to_onnx(args.model_file, args.config_file, demo_batch, args.output_file,
+                                                                   args.compact, args.compact_thresh, not args.no_fuse,
+                                                                   args.weights_cache, cache_dir=args.cache_dir)
+        if not os.path.isfile(onnx_path_demo):
+            raise SystemExit('ERROR: ONNX file (%s) not found!' % onnx_path_demo)
 
         # Set ONNXRUNTIME session for inference
         session = onnxruntime.InferenceSession(onnx_path_demo)
         print("The model expects input shape: ", session.get_inputs()[0].shape)
 
         # Do test
-        detect(session, args.input_test, args.label_file)
+        if batch_test:
+            image_files = list_images(args.input_test)
+            if not image_files:
+                raise SystemExit('ERROR: No images found in %s' % args.input_test)
+            detect_batch(session, image_files, args.label_file, args.test_batch, args.jsonl_file,
+                         letterbox=args.letterbox)
+        else:
+            detect(session, args.input_test, args.label_file, args.letterbox)
 
 if __name__ == '__main__':
     main()